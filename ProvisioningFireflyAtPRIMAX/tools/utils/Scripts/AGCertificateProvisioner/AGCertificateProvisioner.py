@@ -1,32 +1,65 @@
 # Copyright 2022 Motive Technologies, Inc.
 # All rights reserved
 import argparse
-import datetime
+import copy
 import errno
 import json
 import os
 import re
-import secrets
+import sqlite3
 import subprocess
 import sys
+import threading
+import time
 from json import JSONDecodeError
 from json.encoder import JSONEncoder
 from pathlib import Path
 import cryptography.x509
 import serial
 import yubihsm.exceptions
-from serial import Serial
-from yubihsm import YubiHsm
-from yubihsm.core import LogData
-from yubihsm.core import AuthSession
+from cryptography.hazmat.primitives import serialization
 from yubihsm.exceptions import YubiHsmDeviceError
+from transport import SerialTransport, EchoError
+from audit_chain import ChainVerifier
+from audit_drainer import AuditDrainer
+from audit_store import AuditStore
+from ca_router import CaRouter, load_ca_profiles
+from cert_registry import (
+    CONFIRMED,
+    MISMATCH,
+    SIGNED,
+    STORED,
+    CertificateRegistry,
+    normalize_serial,
+)
+from hsm_queue import HsmQueue
+from hsm_session import HsmSessions, SessionKey
+from serial_allocator import SerialAllocator
+from hsm_signer import (
+    CertificateSigner,
+    load_extension_profile,
+    openssl_sign_cmd,
+    read_pkcs11_pin,
+)
+
+# Results of AGs provisioned at the same time are printed whole, tagged by port
+output_lock = threading.Lock()
+station = threading.local()
+
+
+def print_json(result: dict) -> None:
+    com_port = getattr(station, "com_port", None)
+    if com_port:
+        next(iter(result.values()))["PORT"] = com_port
+    with output_lock:
+        print(JSONEncoder(indent=4).encode(result))
 
 
 # Helper function to print a result.
 def print_result(
     cmd: str, msg_key: str, msg_val: str, pass_fail: str, error_number: int
 ) -> None:
-    result = JSONEncoder(indent=4).encode(
+    print_json(
         {
             "PROVISION_CERTS": {
                 "CMD": cmd,
@@ -36,14 +69,13 @@ def print_result(
             }
         }
     )
-    print(result)
 
 
 class CertificateProvisioner:
     """Class to manage provisioning an AG with its TLS client auth certificates"""
 
-    serial_port: Serial = None
-    hsm: YubiHsm = None
+    serial_port: SerialTransport = None
+    hsm_sessions: HsmSessions = None
 
     # AG CLI commands
     CRYPTO_CLI_MODULE_NAME = "CRYPTO"
@@ -56,17 +88,24 @@ class CertificateProvisioner:
 
     # General data
     CA_EXT_FILE: Path = Path("client_ext")
+    SERIALS_FILE: Path = Path("serials.db")  # Serials handed out, in the ca directory
+    REGISTRY_FILE: Path = Path("certificates.db")  # Certificates issued, likewise
     VERSION = 2002
 
     # AG-specific data
     identifier: str = ""
     cert_serial: str = ""
     cert_serial_actual: str = ""
-    csr_path: Path = None
+    csr_path: Path = None  # Files only written to sign with openssl
     device_cert_path: Path = None
+    csr_pem: str = ""
+    device_cert_pem: str = ""
+    device_cert_json: str = ""  # Argument of CRYPTO CERT
+    audit_mark: int = 0  # Audit log pull covering the signature
 
     # Timeouts in seconds
     DEFAULT_RD_TIMEOUT = 1
+    AUDIT_TIMEOUT = 30  # For the audit log pull covering a signature
 
     def __init__(
         self,
@@ -83,6 +122,11 @@ class CertificateProvisioner:
         openssl_conf: str,
         debug: int,
         linux: int,
+        echo_lockstep: int = 0,
+        signing: str = "hsm",
+        debug_dump: int = 0,
+        ext_file: str = "",
+        hsm_serial: int = 0,
     ):
         ca_data_directory: Path = Path(os.path.expandvars(ca_data_dir))
         if not ca_data_directory.is_dir():
@@ -126,22 +170,36 @@ class CertificateProvisioner:
             sys.exit(errno.ENOENT)
         self.com_port = com_port
         self.baud = baud
-        self.ca_ext_path: Path = ca_data_directory / self.CA_EXT_FILE
+        self.ca_ext_path: Path = ca_data_directory / (ext_file or self.CA_EXT_FILE)
         self.ca_key_id = ca_key_id
         self.audit_key_id = audit_key_id
         self.audit_key_password = audit_key_password
-        self.audit_data_name = Path(str(datetime.date.today()) + ".json")
-        self.audit_data_path = audit_data_directory / self.audit_data_name
+        self.audit_store = AuditStore(audit_data_directory)
         self.ca_cert_name: Path = Path(ca_cn + ".crt")
-        self.ca_srl_name: Path = Path(ca_cn + ".srl")
         self.ca_cert_path = ca_data_directory / self.ca_cert_name
-        self.ca_srl_path: Path = ca_data_directory / self.ca_srl_name
+        try:
+            self.serials = SerialAllocator(ca_data_directory / self.SERIALS_FILE)
+            self.registry = CertificateRegistry(ca_data_directory / self.REGISTRY_FILE)
+        except sqlite3.Error as e:
+            print_result(
+                "OPEN_SERIALS",
+                "ERR",
+                f"Failed to open the serials and registry in {ca_data_directory}, "
+                + f"got {e}",
+                "FAIL",
+                errno.EIO,
+            )
+            sys.exit(errno.EIO)
         self.debug = debug
         self.linux = linux
+        self.echo_lockstep = echo_lockstep
+        self.debug_dump = debug_dump
+        self.cert_signer: CertificateSigner = None  # None to sign with openssl
         try:
-            with open(self.ca_cert_path, "rb") as ca_cert_fd:
+            with open(self.ca_cert_path, "r") as ca_cert_fd:
+                ca_cert: str = ca_cert_fd.read()
                 ca_cert_data = cryptography.x509.load_pem_x509_certificate(
-                    ca_cert_fd.read()
+                    ca_cert.encode()
                 )
                 for attribute in ca_cert_data.subject:
                     if attribute.oid.dotted_string == "2.5.4.3":
@@ -167,8 +225,21 @@ class CertificateProvisioner:
                 CaCertErr.errno,
             )
             sys.exit(CaCertErr.errno)
-        self.hsm = YubiHsm.connect(connector_url)
-        hsm_serial: int = self.hsm.get_device_info().serial
+        self.ca_cert_json: str = self.cert_payload(ca=ca_cert)
+        self.hsm_sessions = HsmSessions(connector_url)
+        self.hsm_sessions.add_key(self.audit_key_id, self.audit_key_password)
+        if hsm_serial and hsm_serial != self.hsm_sessions.serial:
+            print_result(
+                "GET_HSM_SERIAL",
+                "ERR",
+                f"HSM at {connector_url} is {self.hsm_sessions.serial}, "
+                + f"not {hsm_serial}",
+                "FAIL",
+                errno.EINVAL,
+            )
+            sys.exit(errno.EINVAL)
+        hsm_serial: int = self.hsm_sessions.serial
+        self.hsm_serial = hsm_serial
         if "AG CA" in self.CA_CN:
             ca_cn_num: str = self.CA_CN[self.CA_CN.index("AG CA ") + len("AG CA ") :]
         elif "Motive Firefly CA" in self.CA_CN:
@@ -186,34 +257,81 @@ class CertificateProvisioner:
                 errno.EINVAL,
             )
             sys.exit(errno.EINVAL)
+        if signing == "hsm":
+            self.open_cert_signer(ca_cert_data)
+        self.print_pending_certificates()
+        # Drain the audit log now, then in the background
+        self.audit_drainer = AuditDrainer(
+            self.hsm_sessions,
+            self.audit_key_id,
+            self.audit_store,
+            warn=self.print_audit_warning,
+            verifier=ChainVerifier(self.audit_store.directory, hsm_serial),
+        )
+        self.get_audit_logs()
+        self.audit_drainer.start()
+
+    def open_cert_signer(self, ca_cert: cryptography.x509.Certificate):
+        """Sign in-process, over a session of the signing key given in openssl_conf"""
+        try:
+            key_id, password = read_pkcs11_pin(self.openssl_conf_path)
+            self.hsm_sessions.add_key(key_id, password)
+            ca_key = SessionKey(self.hsm_sessions, key_id, self.ca_key_id)
+            # Authenticates now, and checks the key is the one of the CA certificate
+            if ca_key.get_public_key().public_bytes(
+                serialization.Encoding.DER,
+                serialization.PublicFormat.SubjectPublicKeyInfo,
+            ) != ca_cert.public_key().public_bytes(
+                serialization.Encoding.DER,
+                serialization.PublicFormat.SubjectPublicKeyInfo,
+            ):
+                raise ValueError(
+                    f"Key {hex(self.ca_key_id)} is not the key of {self.ca_cert_path}"
+                )
+            self.cert_signer = CertificateSigner(
+                ca_cert, ca_key, load_extension_profile(self.ca_ext_path)
+            )
+        except (OSError, ValueError, yubihsm.exceptions.YubiHsmError) as e:
+            print_result(
+                "OPEN_SIGNER",
+                "ERR",
+                f"Failed to set up in-process signing, {e}",
+                "FAIL",
+                errno.EINVAL,
+            )
+            sys.exit(errno.EINVAL)
 
     def __del__(self):
         if self.serial_port:
-            if self.serial_port.isOpen():
+            if self.serial_port.is_open:
                 self.flush_serial()
                 try:
                     self.serial_port.close()
                 except TypeError:
                     pass
-        if self.hsm:
-            self.hsm.close()
+        if self.hsm_sessions:
+            try:
+                self.audit_drainer.close()
+            except Exception:
+                pass  # AGs signed since the last pull were already reported failed
+            self.audit_store.close()
+            self.serials.close()
+            self.registry.close()
+            self.hsm_sessions.close()
 
     def flush_serial(self):
         if self.serial_port:
             try:
-                self.serial_port.flushInput()
-            except TypeError:
-                pass
-            try:
-                self.serial_port.flushOutput()
+                self.serial_port.flush()
             except TypeError:
                 pass
 
     def connect_to_ag(self):
         try:
-            self.serial_port = serial.Serial(
-                port=self.com_port, baudrate=self.baud, timeout=self.DEFAULT_RD_TIMEOUT
+            self.serial_port = SerialTransport(
+                self.com_port, self.baud, self.DEFAULT_RD_TIMEOUT, self.echo_lockstep
             )
+            self.serial_port.open()
         except ValueError as serialError:
             print_result(
                 "OPEN_SERIAL_PORT",
@@ -232,61 +350,45 @@ class CertificateProvisioner:
                 errno.ENOENT,
             )
             sys.exit(errno.ENOENT)
-        # Clear the serial port input
-        self.flush_serial()
 
     def send_cmd(self, cmd: str) -> None:
         """Send a CLI command to AG"""
-        self.flush_serial()
-        cmd = cmd + "\n"  # Add LF to complete command
-        for wdata in cmd:  # read byte from string
-            wdata = wdata.encode("charmap")  # encode byte
-            self.serial_port.write(wdata)  # send byte
-            rdata = self.serial_port.read(1)  # read the echoed byte
-            if rdata != wdata:  # AG should have echoed the same byte back
-                print_result(
-                    "SERIAL",
-                    "TIMEOUT",
-                    f"AG failed to echo byte in {self.serial_port.timeout}s",
-                    "FAIL",
-                    errno.ETIMEDOUT,
-                )
-                sys.exit(errno.EINVAL)
-        self.serial_port.readline()  # Read the new line printed on ending the command
+        try:
+            self.serial_port.send_cmd(cmd)
+        except EchoError as echoError:  # AG should have echoed the same bytes back
+            print_result(
+                "SERIAL",
+                "TIMEOUT",
+                f"AG failed to echo byte {echoError.offset} in {self.DEFAULT_RD_TIMEOUT}s",
+                "FAIL",
+                errno.ETIMEDOUT,
+            )
+            sys.exit(errno.EINVAL)
 
     def read_response(self, timeout: int, command: str) -> object:
         """Read a response from an AG"""
-        output: str = ""
-        self.serial_port.timeout = timeout
-        line = self.serial_port.readline()
-
-        while True:
-            if len(line) == 1 and line == b"$":  # Previous line was end of response
-                try:
-                    return json.loads(output)
-                except JSONDecodeError as jsonError:
-                    print_result(
-                        command,
-                        "ERR",
-                        f"JSON decode error {jsonError}, data was {output}",
-                        "FAIL",
-                        errno.EINVAL,
-                    )
-                    sys.exit(errno.EINVAL)
-            elif not line:
-                # timeout error
-                print_result(
-                    command,
-                    "TIMEOUT",
-                    f"Failed to read line from AG in {self.serial_port.timeout}s",
-                    "FAIL",
-                    errno.ETIMEDOUT,
-                )
-                sys.exit(errno.ETIMEDOUT)
-            else:
-                # Got a line
-                output += line.decode("charmap")
-                line = self.serial_port.readline()
+        output, complete = self.serial_port.read_reply(timeout)
+        if not complete:
+            # timeout error
+            print_result(
+                command,
+                "TIMEOUT",
+                f"Failed to read line from AG in {timeout}s",
+                "FAIL",
+                errno.ETIMEDOUT,
+            )
+            sys.exit(errno.ETIMEDOUT)
+        try:
+            return json.loads(output)
+        except JSONDecodeError as jsonError:
+            print_result(
+                command,
+                "ERR",
+                f"JSON decode error {jsonError}, data was {output}",
+                "FAIL",
+                errno.EINVAL,
+            )
+            sys.exit(errno.EINVAL)
 
     def get_device_identifier(self):
         if self.serial_port:
@@ -372,20 +474,8 @@ class CertificateProvisioner:
                     # It worked
                     if self.debug == 1:
                         print("Generate CSR worked")
-                    try:
-                        with open(self.csr_path, "w") as device_csr_file:
-                            device_csr_file.write(resp["CRYPTO"]["MSG"]["PEM"])
-                        if self.debug == 1:
-                            print("Writing CSR to file worked")
-                    except OSError as e:
-                        print_result(
-                            "GET_CSR",
-                            "ERR",
-                            f"Failed to open file: {e}",
-                            "FAIL",
-                            e.errno,
-                        )
-                        sys.exit(e.errno)
+                    self.csr_pem = resp["CRYPTO"]["MSG"]["PEM"]
+                    self.dump_device_data()
                 else:
                     print_result(
                         "GET_CSR",
@@ -407,28 +497,26 @@ class CertificateProvisioner:
 
     def generate_certificate_serial(self):
         try:
-            with open(self.ca_srl_path, "w") as srl_file:
-                self.cert_serial = "20" + secrets.token_hex(19)
-                srl_file.write(self.cert_serial + "\n")
-                if self.debug == 1:
-                    print("Generate Certificate Serial worked")
-        except OSError as e:
+            self.cert_serial = self.serials.allocate(self.identifier)
+        except sqlite3.Error as e:
             print_result(
                 "SERIAL",
                 "ERR",
-                f"Error, could not open {self.ca_srl_path} for writing, got error {e}",
+                f"Failed to allocate a serial, got {e}",
                 "FAIL",
-                e.errno,
+                errno.EIO,
             )
-            sys.exit(e.errno)
+            sys.exit(errno.EIO)
+        if self.debug == 1:
+            print("Generate Certificate Serial worked")
 
     def sign_device_certificate(self):
-        # Check for file existence
-        if not self.csr_path.exists():
+        # Check for the CSR and file existence
+        if not self.csr_pem:
             print_result(
                 "SIGN_CERT",
                 "ERR",
-                f"Missing device CSR file {self.csr_path}",
+                "Missing device CSR",
                 "FAIL",
                 errno.ENOENT,
             )
@@ -451,168 +539,173 @@ class CertificateProvisioner:
                 errno.ENOENT,
             )
             sys.exit(errno.ENOENT)
-        if not self.ca_srl_path.exists():
+        if not self.openssl_conf_path.exists():
             print_result(
                 "SIGN_CERT",
                 "ERR",
-                f"Missing CA serial number file {self.ca_srl_path}",
+                f"Missing Openssl Config file {self.openssl_conf_path}",
                 "FAIL",
                 errno.ENOENT,
             )
             sys.exit(errno.ENOENT)
-        if not self.openssl_conf_path.exists():
+        if self.cert_signer:
+            self.sign_in_process()
+        else:
+            self.sign_with_openssl()
+        self.dump_device_data()
+
+    def sign_with_openssl(self):
+        """Sign with openssl and the pkcs11 engine, through temporary files"""
+        try:
+            with open(self.csr_path, "w") as device_csr_file:
+                device_csr_file.write(self.csr_pem)
+        except OSError as e:
             print_result(
                 "SIGN_CERT",
                 "ERR",
-                f"Missing Openssl Config file {self.openssl_conf_path}",
+                f"Failed to write the OpenSSL input files, got error {e}",
                 "FAIL",
-                errno.ENOENT,
+                e.errno,
             )
-            sys.exit(errno.ENOENT)
-        # Build up the OpenSSL command string
-        openssl_cmd = 'openssl x509 -req -CAkeyform engine -engine pkcs11 -sha256 -in "'
-        openssl_cmd += str(self.csr_path)
-        openssl_cmd += '" -CA "'
-        openssl_cmd += str(self.ca_cert_path)
-        openssl_cmd += '" -CAkey 0:'
-        openssl_cmd += hex(self.ca_key_id)[2:].zfill(4)
-        openssl_cmd += ' -out "'
-        openssl_cmd += str(self.device_cert_path)
-        openssl_cmd += '" -days 3650'
-        openssl_cmd += ' -extfile "'
-        openssl_cmd += str(self.ca_ext_path)
-        openssl_cmd += '" -CAserial "'
-        openssl_cmd += str(self.ca_srl_path)
-        openssl_cmd += '"'
-        proc = None
-        openssl_env = os.environ.copy()
-        openssl_env["OPENSSL_CONF"] = str(self.openssl_conf_path)
+            sys.exit(e.errno)
         try:
-            if self.linux == 1:
-                # I don't know why this needs to be different on Linux but it works...
-                proc = subprocess.run(
-                    openssl_cmd, check=True, text=True, shell=True, env=openssl_env
-                )
-            else:
-                proc = subprocess.run(
-                    openssl_cmd,
-                    check=True,
-                    capture_output=True,
-                    text=True,
-                    env=openssl_env,
-                )
-        except subprocess.CalledProcessError as e:
-            if proc:
-                print_result(
-                    "SIGN_CERT",
-                    "OPENSSL_ERR",
-                    "" + str(proc.stdout) + str(proc.stderr),
-                    "FAIL",
-                    e.returncode,
-                )
-                sys.exit(e.returncode)
-            else:
+            # Build up the OpenSSL command string
+            openssl_cmd = openssl_sign_cmd(
+                self.csr_path,
+                self.ca_cert_path,
+                "0:" + hex(self.ca_key_id)[2:].zfill(4),
+                self.device_cert_path,
+                self.ca_ext_path,
+                "0x" + self.cert_serial,
+            )
+            proc = None
+            openssl_env = os.environ.copy()
+            openssl_env["OPENSSL_CONF"] = str(self.openssl_conf_path)
+            try:
+                if self.linux == 1:
+                    # I don't know why this needs to be different on Linux but it works...
+                    proc = subprocess.run(
+                        openssl_cmd, check=True, text=True, shell=True, env=openssl_env
+                    )
+                else:
+                    proc = subprocess.run(
+                        openssl_cmd,
+                        check=True,
+                        capture_output=True,
+                        text=True,
+                        env=openssl_env,
+                    )
+            except subprocess.CalledProcessError as e:
+                if proc:
+                    print_result(
+                        "SIGN_CERT",
+                        "OPENSSL_ERR",
+                        "" + str(proc.stdout) + str(proc.stderr),
+                        "FAIL",
+                        e.returncode,
+                    )
+                    sys.exit(e.returncode)
+                else:
+                    print_result(
+                        "SIGN_CERT",
+                        "OPENSSL_ERR",
+                        f"Failed to run OpenSSL with command '{openssl_cmd}'",
+                        "FAIL",
+                        e.returncode,
+                    )
+                    sys.exit(e.returncode)
+            except subprocess.SubprocessError as e:
                 print_result(
                     "SIGN_CERT",
-                    "OPENSSL_ERR",
-                    f"Failed to run OpenSSL with command '{openssl_cmd}'",
+                    "SUBPROCESS_ERR",
+                    f"Failed to run OpenSSL with command '{openssl_cmd}', got error {e}",
                     "FAIL",
-                    e.returncode,
+                    errno.EINVAL,
                 )
-                sys.exit(e.returncode)
-        except subprocess.SubprocessError as e:
+                sys.exit(errno.EINVAL)
+            with open(self.device_cert_path, "r") as device_cert_file:
+                self.device_cert_pem = device_cert_file.read()
+        except OSError as e:
             print_result(
                 "SIGN_CERT",
-                "SUBPROCESS_ERR",
-                f"Failed to run OpenSSL with command '{openssl_cmd}', got error {e}",
+                "ERR",
+                f"Failed to read device cert from {self.device_cert_path}, got {e}",
                 "FAIL",
-                errno.EINVAL,
+                e.errno,
             )
+            sys.exit(e.errno)
+        finally:
+            self.delete_temporary_files()
+
+    def sign_in_process(self):
+        """Sign the device's CSR with the CA key over the open HSM session"""
+        try:
+            self.device_cert_pem = self.cert_signer.sign(
+                self.csr_pem.encode(), int(self.cert_serial, 16)
+            ).decode()
+        except (ValueError, yubihsm.exceptions.YubiHsmError) as e:
+            print_result("SIGN_CERT", "HSM_ERR", f"{e}", "FAIL", errno.EINVAL)
             sys.exit(errno.EINVAL)
 
+    @staticmethod
+    def cert_payload(**certs: str) -> str:
+        """JSON argument of CRYPTO CERT, without a space after the colons"""
+        cert_json: str = JSONEncoder().encode(certs)
+        pattern = re.compile(r'": "')
+        return re.sub(pattern, '":"', cert_json)
+
     def store_device_cert(self):
         """Store an AG's certificate to that AG"""
-        try:
-            with open(self.device_cert_path, "r") as device_cert_file:
-                device_cert: str = device_cert_file.read()
-                device_cert_json: str = JSONEncoder().encode(dict(device=device_cert))
-                pattern = re.compile(r'": "')
-                device_cert_json = re.sub(pattern, '":"', device_cert_json)
-                self.send_cmd(
-                    self.CRYPTO_CLI_MODULE_NAME
-                    + " "
-                    + self.CMD_STORE_CERT
-                    + " "
-                    + device_cert_json
+        self.device_cert_json = self.cert_payload(device=self.device_cert_pem)
+        self.send_cmd(
+            self.CRYPTO_CLI_MODULE_NAME
+            + " "
+            + self.CMD_STORE_CERT
+            + " "
+            + self.device_cert_json
+        )
+        resp = self.read_response(1, "DEVICE_" + self.CMD_STORE_CERT)
+        if isinstance(resp, dict):
+            # Valid response, parsed JSON
+            if resp["CRYPTO"]["RESULT"] != "PASS":
+                print_result(
+                    "STORE_DEVICE_CERT", "ERR", f"{resp}", "FAIL", errno.EINVAL
                 )
-                resp = self.read_response(1, "DEVICE_" + self.CMD_STORE_CERT)
-                if isinstance(resp, dict):
-                    # Valid response, parsed JSON
-                    if resp["CRYPTO"]["RESULT"] != "PASS":
-                        print_result(
-                            "STORE_DEVICE_CERT", "ERR", f"{resp}", "FAIL", errno.EINVAL
-                        )
-                        sys.exit(errno.EINVAL)
-                else:
-                    print_result(
-                        "STORE_DEVICE_CERT",
-                        "ERR",
-                        "Response wasn't a JSON dict",
-                        "FAIL",
-                        errno.EINVAL,
-                    )
-                    sys.exit(errno.EINVAL)
-        except OSError as e:
+                sys.exit(errno.EINVAL)
+        else:
             print_result(
                 "STORE_DEVICE_CERT",
                 "ERR",
-                f"Failed to read device cert from {self.device_cert_path}, got {e}",
+                "Response wasn't a JSON dict",
                 "FAIL",
-                e.errno,
+                errno.EINVAL,
             )
-            sys.exit(e.errno)
+            sys.exit(errno.EINVAL)
 
     def store_ca_cert(self):
         """Store the CA certificate to the AG"""
-        try:
-            with open(self.ca_cert_path, "r") as ca_cert_file:
-                ca_cert: str = ca_cert_file.read()
-                ca_cert_json: str = JSONEncoder().encode(dict(ca=ca_cert))
-                pattern = re.compile(r'": "')
-                ca_cert_json = re.sub(pattern, '":"', ca_cert_json)
-                self.send_cmd(
-                    self.CRYPTO_CLI_MODULE_NAME
-                    + " "
-                    + self.CMD_STORE_CERT
-                    + " "
-                    + ca_cert_json
-                )
-                resp = self.read_response(1, "CA_" + self.CMD_STORE_CERT)
-                if isinstance(resp, dict):
-                    # Valid response, parsed JSON
-                    if resp["CRYPTO"]["RESULT"] != "PASS":
-                        print_result(
-                            "STORE_CA_CERT", "ERR", f"{resp}", "FAIL", errno.EINVAL
-                        )
-                        sys.exit(errno.EINVAL)
-                else:
-                    print_result(
-                        "STORE_CA_CERT",
-                        "ERR",
-                        "Response wasn't a JSON dict",
-                        "FAIL",
-                        errno.EINVAL,
-                    )
-                    sys.exit(errno.EINVAL)
-        except OSError as e:
+        self.send_cmd(
+            self.CRYPTO_CLI_MODULE_NAME
+            + " "
+            + self.CMD_STORE_CERT
+            + " "
+            + self.ca_cert_json
+        )
+        resp = self.read_response(1, "CA_" + self.CMD_STORE_CERT)
+        if isinstance(resp, dict):
+            # Valid response, parsed JSON
+            if resp["CRYPTO"]["RESULT"] != "PASS":
+                print_result("STORE_CA_CERT", "ERR", f"{resp}", "FAIL", errno.EINVAL)
+                sys.exit(errno.EINVAL)
+        else:
             print_result(
                 "STORE_CA_CERT",
                 "ERR",
-                f"Failed to read CA cert from {self.ca_cert_path}, got {e}",
+                "Response wasn't a JSON dict",
                 "FAIL",
-                e.errno,
+                errno.EINVAL,
             )
-            sys.exit(e.errno)
+            sys.exit(errno.EINVAL)
 
     def get_certificate_serial(self):
         self.send_cmd(self.CRYPTO_CLI_MODULE_NAME + " " + self.CMD_PRINTSERIAL)
@@ -631,8 +724,62 @@ class CertificateProvisioner:
             )
             sys.exit(e.errno)
 
+    def register_certificate(self, state: str):
+        """Journal the device certificate, as SIGNED before it leaves the process"""
+        try:
+            if state == SIGNED:
+                self.registry.record_signed(
+                    self.identifier,
+                    self.device_cert_pem,
+                    self.CA_CN,
+                    self.ca_key_id,
+                    self.hsm_serial,
+                )
+            else:
+                self.registry.set_state(self.cert_serial, state)
+        except sqlite3.Error as e:
+            print_result(
+                "REGISTRY",
+                "ERR",
+                f"Failed to record {state}, got {e}",
+                "FAIL",
+                errno.EIO,
+            )
+            sys.exit(errno.EIO)
+
+    def confirm_certificate(self):
+        """Check the AG reports the serial of the certificate it was given"""
+        if normalize_serial(self.cert_serial_actual) != normalize_serial(
+            self.cert_serial
+        ):
+            self.register_certificate(MISMATCH)
+            print_result(
+                "READ_CERT_SERIAL",
+                "ERR",
+                f"AG reports serial {self.cert_serial_actual}, not {self.cert_serial}",
+                "FAIL",
+                errno.EINVAL,
+            )
+            sys.exit(errno.EINVAL)
+        self.register_certificate(CONFIRMED)
+
+    def print_pending_certificates(self):
+        """Certificates left unconfirmed by runs that stopped"""
+        for record in self.registry.pending():
+            del record["pem"]
+            print_json(
+                {
+                    "REGISTRY": {
+                        "CMD": "PENDING",
+                        "MSG": record,
+                        "RESULT": "WARN",
+                        "ERRNO": "0",
+                    }
+                }
+            )
+
     def print_id_and_serial(self):
-        result = JSONEncoder(indent=4).encode(
+        print_json(
             {
                 "PROVISION": {
                     "CMD": "PRINT_CERT_SERIAL",
@@ -646,13 +793,14 @@ class CertificateProvisioner:
                 }
             }
         )
-        print(result)
 
-    def get_audit_logs(self):
+    def get_audit_logs(self, mark: int = 0):
+        """Pull the audit logs now, or wait for pull mark of the drainer"""
         try:
-            audit_session = self.hsm.create_session_derived(
-                self.audit_key_id, self.audit_key_password
-            )
+            if mark:
+                self.audit_drainer.wait(mark, self.AUDIT_TIMEOUT)
+            else:
+                self.audit_drainer.drain()
         except yubihsm.exceptions.YubiHsmAuthenticationError:
             print_result(
                 "AUDIT",
@@ -663,70 +811,242 @@ class CertificateProvisioner:
                 errno.EKEYREJECTED,
             )
             sys.exit(errno.EKEYREJECTED)
-        if isinstance(audit_session, AuthSession):
-            try:
-                logs: LogData = audit_session.get_log_entries()
-                audit_session.set_log_index(logs.entries[-1].number)
-                logs_json: str = JSONEncoder().encode(
-                    {
-                        "AUDIT": {
-                            "CMD": "GET_LOGS",
-                            "MSG": {
-                                "UNLOGGED_BOOTS": f"{logs.n_boot}",
-                                "UNLOGGED_AUTH": f"{logs.n_auth}",
-                                "LOG_ENTRIES": f"{logs.entries}",
-                            },
-                            "RESULT": "PASS",
-                            "ERRNO": "0",
-                        }
-                    }
-                )
-                if self.audit_data_path.exists():
-                    try:
-                        with open(self.audit_data_path, "a") as audit_logs_file:
-                            audit_logs_file.write(",\n" + logs_json)
-                    except OSError as e:
-                        print_result(
-                            "AUDIT",
-                            "ERR",
-                            f"Failed to open {self.audit_data_path} for append",
-                            "FAIL",
-                            e.errno,
-                        )
-                else:
-                    try:
-                        with open(self.audit_data_path, "w") as audit_logs_file:
-                            audit_logs_file.write(logs_json)
-                    except OSError as e:
-                        print_result(
-                            "AUDIT",
-                            "ERR",
-                            f"Failed to open {self.audit_data_path} for append",
-                            "FAIL",
-                            e.errno,
-                        )
-                        sys.exit(e.errno)
-            except YubiHsmDeviceError as e:
-                print_result(
-                    "AUDIT",
-                    "ERR",
-                    f"Failed to get audit logs, error {e}",
-                    "FAIL",
-                    e.code,
-                )
-                sys.exit(e.code)
-            finally:
-                audit_session.close()
-        else:
+        except YubiHsmDeviceError as e:
             print_result(
-                "AUDIT", "ERR", "Audit session not initialized", "FAIL", errno.ENOENT
+                "AUDIT",
+                "ERR",
+                f"Failed to get audit logs, error {e}",
+                "FAIL",
+                e.code,
             )
-            sys.exit(errno.ENOENT)
+            sys.exit(e.code)
+        except yubihsm.exceptions.YubiHsmError as e:
+            print_result(
+                "AUDIT",
+                "ERR",
+                f"Failed to get audit logs, error {e}",
+                "FAIL",
+                errno.EIO,
+            )
+            sys.exit(errno.EIO)
+        except TimeoutError as e:
+            print_result("AUDIT", "ERR", f"{e}", "FAIL", errno.ETIMEDOUT)
+            sys.exit(errno.ETIMEDOUT)
+        except OSError as e:
+            print_result(
+                "AUDIT",
+                "ERR",
+                f"Failed to append to the audit store in {self.audit_store.directory}",
+                "FAIL",
+                e.errno,
+            )
+            sys.exit(e.errno)
+
+    def print_audit_warning(self, cmd: str, msg: dict):
+        print_json({"AUDIT": {"CMD": cmd, "MSG": msg, "RESULT": "WARN", "ERRNO": "0"}})
+
+    def print_hsm_latency(self):
+        print_json(
+            {
+                "HSM": {
+                    "CMD": "LATENCY",
+                    "MSG": self.hsm_sessions.latency(),
+                    "RESULT": "PASS",
+                    "ERRNO": "0",
+                }
+            }
+        )
 
     def delete_temporary_files(self):
         self.device_cert_path.unlink(missing_ok=True)
         self.csr_path.unlink(missing_ok=True)
 
+    def dump_device_data(self):
+        """
+        Debug dump of what is known of the AG so far, to <identifier>.json in
+        the device data directory. Replaced whole, so a crash never leaves
+        half of it
+        """
+        if self.debug_dump != 1:
+            return
+        dump_path = self.device_data_directory / Path(str(self.identifier) + ".json")
+        temp_path = dump_path.with_suffix(".tmp")
+        dump = {
+            "IDENTIFIER": self.identifier,
+            "CSR": self.csr_pem,
+            "CERT_SERIAL": self.cert_serial,
+            "DEVICE_CERT": self.device_cert_pem,
+            "DEVICE_CERT_JSON": self.device_cert_json,
+            "CERT_SERIAL_ACTUAL": self.cert_serial_actual,
+        }
+        try:
+            with open(temp_path, "w") as dump_file:
+                dump_file.write(JSONEncoder(indent=4).encode(dump))
+                dump_file.flush()
+                os.fsync(dump_file.fileno())
+            os.replace(temp_path, dump_path)
+        except OSError as e:
+            print(f"Failed to write debug dump {dump_path}, got {e}")
+
+    def for_port(self, com_port: str) -> "CertificateProvisioner":
+        """Provisioner of the AG on another port, its HSM work goes through this one"""
+        device = copy.copy(self)
+        device.com_port = com_port
+        device.serial_port = None
+        device.hsm_sessions = None  # Not to be closed with the device
+        return device
+
+    def for_device(self, device: "CertificateProvisioner") -> "CertificateProvisioner":
+        """Provisioner with this one's CA of an AG device connected to and identified"""
+        ca = self.for_port(device.com_port)
+        ca.serial_port = device.serial_port
+        ca.identifier = device.identifier
+        ca.csr_path = device.csr_path
+        ca.device_cert_path = device.device_cert_path
+        return ca
+
+    def sign(self):
+        # Make a new serial number for the device certificate
+        self.generate_certificate_serial()
+        # Sign the device's CSR, resulting in a device certificate (cert)
+        self.sign_device_certificate()
+        self.register_certificate(SIGNED)
+        self.audit_mark = self.audit_drainer.signed(
+            {"IDENTIFIER": self.identifier, "CERT_SERIAL": self.cert_serial}
+        )
+
+    def sign_on_queue(self):
+        """sign() on the HSM queue thread, its messages tagged with the AG's port"""
+        station.com_port = self.com_port
+        try:
+            self.sign()
+        finally:
+            station.com_port = None
+
+    def provision(self, hsm_queue: HsmQueue = None, router: CaRouter = None):
+        """
+        Provision the AG, signing through hsm_queue if shared with other AGs,
+        or with the CA router picks for it
+        """
+        # Connect to the AG serial port
+        self.connect_to_ag()
+        # Read the AG's device identifier (CSN).
+        self.get_device_identifier()
+        if router:
+            self.provision_routed(router)
+        else:
+            self.provision_identified(hsm_queue)
+
+    def provision_routed(self, router: CaRouter):
+        """Provision the identified AG with its CA, counted in that CA's throughput"""
+        name = router.route(self.com_port, self.identifier)
+        if name is None:
+            print_result(
+                "ROUTE",
+                "ERR",
+                f"No CA profile takes AG {self.identifier}",
+                "FAIL",
+                errno.ENOENT,
+            )
+            sys.exit(errno.ENOENT)
+        if self.debug == 1:
+            print(f"Routed AG {self.identifier} to CA profile {name}")
+        start = time.monotonic()
+        ok = False
+        try:
+            router.cas[name].for_device(self).provision_identified(router.queues[name])
+            ok = True
+        finally:
+            router.record(name, start, ok)
+
+    def provision_identified(self, hsm_queue: HsmQueue = None):
+        """Provision the AG once identified"""
+        # Command the AG to generate a new key pair
+        self.gen_keys()
+        # Get a Certificate Signing Request (CSR) from the AG
+        self.get_csr()
+        # Sign it, one AG at a time if the HSM is shared with other AGs
+        if hsm_queue:
+            hsm_queue.run(self.sign_on_queue)
+        else:
+            self.sign()
+        # Save device cert to AG
+        self.store_device_cert()
+        self.register_certificate(STORED)
+        # Save CA cert to AG
+        self.store_ca_cert()
+        # Wait for the audit log pull covering the signature
+        self.get_audit_logs(self.audit_mark)
+        # Ask the ag what its cert serial is
+        self.get_certificate_serial()
+        self.dump_device_data()
+        self.confirm_certificate()
+        # Print a result message containing the identifier and certificate serial number generated
+        self.print_id_and_serial()
+        if self.debug == 1 and self.hsm_sessions:
+            self.print_hsm_latency()
+
+
+def provision_ports(
+    provisioner: CertificateProvisioner, com_ports: list, router: CaRouter = None
+) -> int:
+    """
+    Provision the AGs on several ports at once, one thread per port. Signing
+    goes through one HSM queue run by provisioner, or with a router through
+    the queue of the CA it picks for each AG.
+    Returns the error number of the first port that failed, else 0.
+    """
+    hsm_queue = None if router else HsmQueue()
+    results = dict.fromkeys(com_ports, errno.EIO)
+
+    def provision_port(com_port: str):
+        station.com_port = com_port
+        try:
+            provisioner.for_port(com_port).provision(hsm_queue, router)
+            results[com_port] = 0
+        except SystemExit as e:
+            results[com_port] = e.code if isinstance(e.code, int) else errno.EIO
+        except Exception as e:
+            print_result("PROVISION", "ERR", f"{e!r}", "FAIL", errno.EIO)
+
+    threads = [threading.Thread(target=provision_port, args=(p,)) for p in com_ports]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if router:
+        router.close()
+        print_json(
+            {
+                "ROUTER": {
+                    "CMD": "THROUGHPUT",
+                    "MSG": router.stats(),
+                    "RESULT": "PASS",
+                    "ERRNO": "0",
+                }
+            }
+        )
+        if provisioner.debug == 1:
+            latency = {
+                name: ca.hsm_sessions.latency() for name, ca in router.cas.items()
+            }
+            print_json(
+                {
+                    "HSM": {
+                        "CMD": "LATENCY",
+                        "MSG": latency,
+                        "RESULT": "PASS",
+                        "ERRNO": "0",
+                    }
+                }
+            )
+    else:
+        hsm_queue.close()
+        if provisioner.debug == 1:
+            print(f"Signed for {hsm_queue.jobs} AGs in {hsm_queue.batches} HSM batches")
+            provisioner.print_hsm_latency()
+    return next((results[p] for p in com_ports if results[p]), 0)
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -735,15 +1055,16 @@ if __name__ == "__main__":
     parser.add_argument(
         "-c",
         "--com_port",
-        nargs=1,
+        nargs="+",
         required=True,
         type=str,
-        help="COM port where the AG is connected",
+        help="COM port where the AG is connected, several to provision "
+        + "their AGs at once",
     )
     parser.add_argument(
         "--ca_common_name",
         nargs=1,
-        required=True,
+        required=False,
         type=str,
         help="Common Name of the Certificate Authority associated with the HSM being used",
     )
@@ -759,21 +1080,21 @@ if __name__ == "__main__":
     parser.add_argument(
         "--ca_key_id",
         nargs=1,
-        required=True,
+        required=False,
         type=str,
         help="Hex Key ID of the signer asymmetric key in the HSM",
     )
     parser.add_argument(
         "--audit_key_id",
         nargs=1,
-        required=True,
+        required=False,
         type=str,
         help="Hex Key ID of the audit authentication key in the HSM",
     )
     parser.add_argument(
         "--audit_key_password",
         nargs=1,
-        required=True,
+        required=False,
         type=str,
         help="Passphrase of the audit authentication key in the HSM",
     )
@@ -812,7 +1133,7 @@ if __name__ == "__main__":
     parser.add_argument(
         "--openssl_conf",
         nargs=1,
-        required=True,
+        required=False,
         type=str,
         help="Path to the OpenSSL Config file for the HSM",
     )
@@ -832,7 +1153,98 @@ if __name__ == "__main__":
         default=[0],
         help="0 if running on Windows, 1 if running on Linux",
     )
+    parser.add_argument(
+        "--echo_lockstep",
+        nargs=1,
+        required=False,
+        type=int,
+        default=[0],
+        help="1 to echo commands byte by byte, for AG firmware without bulk echo support",
+    )
+    parser.add_argument(
+        "--signing",
+        nargs=1,
+        required=False,
+        type=str,
+        choices=["hsm", "openssl"],
+        default=["hsm"],
+        help="hsm to sign in-process over the HSM session, openssl to run "
+        + "openssl with the pkcs11 engine per certificate",
+    )
+    parser.add_argument(
+        "--debug_dump",
+        nargs=1,
+        required=False,
+        type=int,
+        default=[0],
+        help="1 to dump the CSR, serial and certificate of each AG to "
+        + "<identifier>.json in the device data directory",
+    )
+    parser.add_argument(
+        "--ca_profiles",
+        nargs=1,
+        required=False,
+        type=str,
+        help="JSON file of the CAs to route the AGs to, in place of "
+        + "--ca_common_name, --ca_key_id, --audit_key_id, --audit_key_password, "
+        + "--ca_data_directory, --audit_data_directory, --connector_url "
+        + "and --openssl_conf",
+    )
     args = parser.parse_args()
+    if args.ca_profiles:
+        try:
+            profiles = load_ca_profiles(args.ca_profiles[0])
+        except (OSError, KeyError, ValueError) as e:
+            print_result(
+                "CA_PROFILES",
+                "ERR",
+                f"Failed to load {args.ca_profiles[0]}, got {e!r}",
+                "FAIL",
+                errno.EINVAL,
+            )
+            sys.exit(errno.EINVAL)
+        # Every CA and its HSM session is ready before the first AG
+        cas = {
+            profile["name"]: CertificateProvisioner(
+                com_port=args.com_port[0],
+                ca_cn=profile["ca_common_name"],
+                baud=args.baud[0],
+                ca_key_id=profile["ca_key_id"],
+                audit_key_id=profile["audit_key_id"],
+                audit_key_password=profile["audit_key_password"],
+                audit_data_dir=profile["audit_data_directory"],
+                ca_data_dir=profile["ca_data_directory"],
+                device_data_dir=args.device_data_directory[0],
+                connector_url=profile["connector_url"],
+                openssl_conf=profile["openssl_conf"],
+                debug=args.debug[0],
+                linux=args.linux[0],
+                echo_lockstep=args.echo_lockstep[0],
+                signing=args.signing[0],
+                debug_dump=args.debug_dump[0],
+                ext_file=profile["extensions"],
+                hsm_serial=profile["hsm_serial"],
+            )
+            for profile in profiles
+        }
+        router = CaRouter(profiles, cas)
+        sys.exit(provision_ports(next(iter(cas.values())), args.com_port, router))
+    missing = [
+        option
+        for option in (
+            "ca_common_name",
+            "ca_key_id",
+            "audit_key_id",
+            "audit_key_password",
+            "openssl_conf",
+        )
+        if getattr(args, option) is None
+    ]
+    if missing:
+        parser.error(
+            "the following arguments are required without --ca_profiles: "
+            + ", ".join("--" + option for option in missing)
+        )
     provisioner = CertificateProvisioner(
         com_port=args.com_port[0],
         ca_cn=args.ca_common_name[0],
@@ -847,28 +1259,10 @@ if __name__ == "__main__":
         openssl_conf=args.openssl_conf[0],
         debug=args.debug[0],
         linux=args.linux[0],
+        echo_lockstep=args.echo_lockstep[0],
+        signing=args.signing[0],
+        debug_dump=args.debug_dump[0],
     )
-    # Connect to the AG serial port
-    provisioner.connect_to_ag()
-    # Read the AG's device identifier (CSN).
-    provisioner.get_device_identifier()
-    # Command the AG to generate a new key pair
-    provisioner.gen_keys()
-    # Get a Certificate Signing Request (CSR) from the AG
-    provisioner.get_csr()
-    # Make a new serial number for the device certificate
-    provisioner.generate_certificate_serial()
-    # Sign the device's CSR, resulting in a device certificate (cert)
-    provisioner.sign_device_certificate()
-    # Save device cert to AG
-    provisioner.store_device_cert()
-    # Save CA cert to AG
-    provisioner.store_ca_cert()
-    # Get audit logs
-    provisioner.get_audit_logs()
-    # Ask the ag what its cert serial is
-    provisioner.get_certificate_serial()
-    # Print a result message containing the identifier and certificate serial number generated
-    provisioner.print_id_and_serial()
-    # Delete the temporary device cert & CSR files.
-    provisioner.delete_temporary_files()
+    if len(args.com_port) > 1:
+        sys.exit(provision_ports(provisioner, args.com_port))
+    provisioner.provision()
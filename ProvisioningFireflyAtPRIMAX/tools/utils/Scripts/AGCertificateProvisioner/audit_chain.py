@@ -0,0 +1,153 @@
+# Copyright 2022 Motive Technologies, Inc.
+# All rights reserved
+"""
+Verification of the hash chain of the HSM audit log entries in the audit
+store. Each entry's digest is the first 16 bytes of the SHA-256 of the entry
+and the digest of the previous one, so a missing, changed or inserted entry
+breaks the chain. A checkpoint per HSM (chain-<HSM SERIAL>.json) keeps where
+verification got to, and the next run only reads what was stored since.
+
+Usage:
+    python audit_chain.py AUDIT_DIRECTORY --hsm_serial SERIAL [--rebuild]
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import struct
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+from audit_store import DATA_SUFFIX, read_records
+
+ENTRY_FORMAT = "!HBHHHHBL"  # yubihsm LogEntry, without the digest
+MAX_PROBLEMS = 100  # Problems kept in detail per run, the others are counted
+
+
+def entry_digest(record: dict, previous_digest: bytes) -> bytes:
+    """Digest an ENTRY record should have, chained to the previous entry"""
+    data = struct.pack(
+        ENTRY_FORMAT,
+        record["NUMBER"],
+        record["COMMAND_CODE"],
+        record["LENGTH"],
+        record["SESSION_KEY"],
+        record["TARGET_KEY"],
+        record["SECOND_KEY"],
+        record["RESULT"],
+        record["TICK"],
+    )
+    return hashlib.sha256(data + previous_digest).digest()[:16]
+
+
+class ChainVerifier:
+    """
+    Verifies the entries of one HSM in store order, from its checkpoint.
+    Where the chain breaks, the problem is reported and verification goes on
+    from the entry found, so one gap is reported once. Files are streamed,
+    whatever their size.
+    """
+
+    def __init__(self, directory: Path, hsm_serial: int):
+        self.directory = Path(directory)
+        self.hsm_serial = hsm_serial
+        self.checkpoint_path = self.directory / f"chain-{hsm_serial}.json"
+
+    def load_checkpoint(self) -> Optional[dict]:
+        if not self.checkpoint_path.exists():
+            return None
+        with open(self.checkpoint_path, "r") as checkpoint_file:
+            return json.load(checkpoint_file)
+
+    def save_checkpoint(self, checkpoint: dict) -> None:
+        temp_path = self.checkpoint_path.with_suffix(".tmp")
+        with open(temp_path, "w") as checkpoint_file:
+            checkpoint_file.write(json.dumps(checkpoint, indent=4))
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(temp_path, self.checkpoint_path)
+
+    def verify(self, rebuild: bool = False) -> List[dict]:
+        """
+        Verify the entries stored since the checkpoint, or all of them with
+        rebuild. Returns the problems found (at most MAX_PROBLEMS), the
+        checkpoint counts them all.
+        """
+        checkpoint = None if rebuild else self.load_checkpoint()
+        if checkpoint is None:
+            checkpoint = {
+                "HSM_SERIAL": self.hsm_serial,
+                "FILE": "",
+                "OFFSET": 0,
+                "NUMBER": None,
+                "DIGEST": None,
+                "VERIFIED": 0,
+                "PROBLEMS": 0,
+            }
+        problems = []
+
+        def problem(kind: str, data_path: Path, offset: int, record: dict):
+            checkpoint["PROBLEMS"] += 1
+            if len(problems) < MAX_PROBLEMS:
+                problems.append(
+                    {
+                        "PROBLEM": kind,
+                        "NUMBER": record["NUMBER"],
+                        "PREVIOUS": checkpoint["NUMBER"],
+                        "FILE": data_path.name,
+                        "OFFSET": offset,
+                    }
+                )
+
+        for data_path in sorted(self.directory.glob("*" + DATA_SUFFIX)):
+            if data_path.name < checkpoint["FILE"]:
+                continue
+            start = checkpoint["OFFSET"] if data_path.name == checkpoint["FILE"] else 0
+            for offset, end, record in read_records(data_path, start):
+                checkpoint["FILE"], checkpoint["OFFSET"] = data_path.name, end
+                if record["TYPE"] != "ENTRY" or record["HSM_SERIAL"] != self.hsm_serial:
+                    continue
+                digest = bytes.fromhex(record["DIGEST"])
+                if checkpoint["NUMBER"] is not None:
+                    previous = bytes.fromhex(checkpoint["DIGEST"])
+                    if record["NUMBER"] == checkpoint["NUMBER"] and digest == previous:
+                        continue  # Stored twice
+                    if (record["NUMBER"] - checkpoint["NUMBER"]) & 0xFFFF != 1:
+                        problem("GAP", data_path, offset, record)
+                    elif entry_digest(record, previous) != digest:
+                        problem("DIGEST", data_path, offset, record)
+                    else:
+                        checkpoint["VERIFIED"] += 1
+                checkpoint["NUMBER"] = record["NUMBER"]
+                checkpoint["DIGEST"] = record["DIGEST"]
+        checkpoint["TIME"] = (
+            datetime.datetime.utcnow().isoformat(timespec="seconds") + "Z"
+        )
+        self.save_checkpoint(checkpoint)
+        return problems
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Verify the HSM audit log hash chain")
+    ap.add_argument("directory", help="Audit data directory")
+    ap.add_argument("--hsm_serial", type=int, required=True, help="HSM serial number")
+    ap.add_argument(
+        "--rebuild", action="store_true", help="Verify all, ignoring the checkpoint"
+    )
+    args = ap.parse_args()
+    verifier = ChainVerifier(Path(os.path.expandvars(args.directory)), args.hsm_serial)
+    problems = verifier.verify(args.rebuild)
+    for problem in problems:
+        print(json.dumps(problem))
+    checkpoint = verifier.load_checkpoint()
+    print(
+        f"Verified {checkpoint['VERIFIED']} entries up to {checkpoint['NUMBER']}, "
+        + f"{checkpoint['PROBLEMS']} problems"
+    )
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+# Copyright 2022 Motive Technologies, Inc.
+# All rights reserved
+"""Background draining of the HSM audit log into the audit store"""
+import threading
+from typing import Callable, List, Optional
+
+from yubihsm.core import AuthSession, LogData
+
+from audit_chain import ChainVerifier
+from audit_store import AuditStore, entry_record, pull_record
+from hsm_session import HsmSessions
+
+
+def is_newer(number: int, last: Optional[int]) -> bool:
+    """Whether a log entry number comes after last, numbers wrap at 65536"""
+    return last is None or 0 < (number - last) & 0xFFFF < 0x8000
+
+
+class AuditDrainer:
+    """
+    Thread pulling the new entries of the HSM audit log into the store, every
+    interval seconds and whenever an AG was signed, and marking them read so
+    the HSM can reuse their space. AGs signed in the meantime are listed in
+    the pull record. With a verifier, the hash chain of the new entries is
+    checked after each pull and breaks are warned about. An AG only has to
+    check that the pull following its signature is done:
+        mark = drainer.signed({"IDENTIFIER": ..., "CERT_SERIAL": ...})
+        ...
+        drainer.wait(mark, timeout)
+    """
+
+    CAPACITY = 62  # Entries the YubiHSM 2 log holds
+    INTERVAL = 30.0  # Seconds between pulls when no AG is signed
+    WARN_FILL = 0.75  # Fraction of CAPACITY new entries reach to warn
+
+    def __init__(
+        self,
+        sessions: HsmSessions,
+        auth_key_id: int,
+        store: AuditStore,
+        warn: Callable[[str, dict], None] = None,
+        verifier: ChainVerifier = None,
+        interval: float = INTERVAL,
+        warn_fill: float = WARN_FILL,
+    ):
+        self.sessions = sessions
+        self.auth_key_id = auth_key_id
+        self.store = store
+        self.warn = warn
+        self.verifier = verifier
+        self.interval = interval
+        self.warn_fill = warn_fill
+        self.condition = threading.Condition()
+        self.unaudited: List[dict] = []  # AGs signed since the last pull
+        self.started = 0  # Pulls started, done and failed
+        self.drained = 0
+        self.failed = 0
+        self.error: BaseException = None  # Of the last failed pull
+        self.last_number: Optional[int] = store.last_number(sessions.serial)
+        self.pull_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def signed(self, device: dict) -> int:
+        """Note an AG was signed, returns the pull that will cover it"""
+        with self.condition:
+            self.unaudited.append(device)
+            mark = self.started + 1
+        self.wake.set()
+        return mark
+
+    def is_drained(self, mark: int) -> bool:
+        return self.drained >= mark
+
+    def wait(self, mark: int, timeout: float) -> None:
+        """Wait for pull mark, raising what made it fail"""
+        self.wake.set()
+        with self.condition:
+            done = self.condition.wait_for(
+                lambda: self.drained >= mark or self.failed >= mark, timeout
+            )
+            if self.drained >= mark:
+                return
+            if not done:
+                raise TimeoutError(f"Audit log not pulled in {timeout}s")
+            raise self.error
+
+    def drain(self) -> None:
+        """Pull the new log entries into the store, raising what went wrong"""
+        with self.pull_lock:
+            with self.condition:
+                self.started += 1
+                pull = self.started
+                devices = self.unaudited[:]
+                del self.unaudited[:]
+            try:
+                logs = self.sessions.run(
+                    self.auth_key_id, "get_log_entries", self._pull
+                )
+                entries = [
+                    entry
+                    for entry in logs.entries
+                    if is_newer(entry.number, self.last_number)
+                ]
+                logs = LogData(logs.n_boot, logs.n_auth, entries)
+                records = [pull_record(self.sessions.serial, logs, devices)]
+                for entry in entries:
+                    records.append(entry_record(self.sessions.serial, entry))
+                self.store.append(records)
+            except BaseException as e:
+                with self.condition:
+                    self.unaudited[:0] = devices  # In the next pull
+                    self.failed = pull
+                    self.error = e
+                    self.condition.notify_all()
+                raise
+            if entries:
+                self.last_number = entries[-1].number
+            with self.condition:
+                self.drained = pull
+                self.condition.notify_all()
+            self._check_fill(logs)
+            self._check_chain()
+
+    def close(self) -> None:
+        """Stop, after a last pull if AGs were signed since the previous one"""
+        self.closed.set()
+        self.wake.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        if self.unaudited:
+            self.drain()
+
+    def _pull(self, session: AuthSession) -> LogData:
+        logs: LogData = session.get_log_entries()
+        if logs.entries:
+            session.set_log_index(logs.entries[-1].number)
+        return logs
+
+    def _check_fill(self, logs: LogData) -> None:
+        fill = len(logs.entries) / self.CAPACITY
+        if self.warn and (fill >= self.warn_fill or logs.n_boot or logs.n_auth):
+            self.warn(
+                "LOG_FILL",
+                {
+                    "NEW_ENTRIES": len(logs.entries),
+                    "CAPACITY": self.CAPACITY,
+                    "UNLOGGED_BOOTS": logs.n_boot,
+                    "UNLOGGED_AUTH": logs.n_auth,
+                },
+            )
+
+    def _check_chain(self) -> None:
+        if not self.verifier:
+            return
+        try:
+            problems = self.verifier.verify()
+        except (OSError, ValueError) as e:
+            problems = [{"PROBLEM": "VERIFY", "ERR": f"{e}"}]
+        for problem in problems:
+            if self.warn:
+                self.warn("CHAIN", problem)
+
+    def _run(self) -> None:
+        while not self.closed.is_set():
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            if self.closed.is_set():
+                return
+            try:
+                self.drain()
+            except Exception:
+                pass  # Kept in self.error for the AGs waiting, retried next time
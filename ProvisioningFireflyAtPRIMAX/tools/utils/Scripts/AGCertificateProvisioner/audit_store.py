@@ -0,0 +1,352 @@
+# Copyright 2022 Motive Technologies, Inc.
+# All rights reserved
+"""
+Append-only store of the HSM audit logs: one JSON record per line, in a file
+per day (YYYY-MM-DD.jsonl), with a sidecar index (YYYY-MM-DD.idx) from device
+identifier and HSM log number to the offset of their records. The processes
+of a station (one per AG in single-port mode) share the directory, each
+append being made under a lock file (audit.lock).
+
+Usage:
+    python audit_store.py AUDIT_DIRECTORY --device IDENTIFIER
+    python audit_store.py AUDIT_DIRECTORY --log HSM_SERIAL:NUMBER
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+DATA_SUFFIX = ".jsonl"
+INDEX_SUFFIX = ".idx"
+LOCK_FILE = "audit.lock"
+
+
+def entry_record(hsm_serial: int, entry) -> dict:
+    """Record of one yubihsm LogEntry"""
+    return {
+        "TYPE": "ENTRY",
+        "HSM_SERIAL": hsm_serial,
+        "NUMBER": entry.number,
+        "COMMAND": getattr(entry.command, "name", str(entry.command)),
+        "COMMAND_CODE": int(entry.command),
+        "LENGTH": entry.length,
+        "SESSION_KEY": entry.session_key,
+        "TARGET_KEY": entry.target_key,
+        "SECOND_KEY": entry.second_key,
+        "RESULT": entry.result,
+        "TICK": entry.tick,
+        "DIGEST": entry.digest.hex(),
+    }
+
+
+def pull_record(hsm_serial: int, logs, devices: List[dict]) -> dict:
+    """Record of one yubihsm LogData pull, with the AGs signed since the last one"""
+    numbers = [entry.number for entry in logs.entries]
+    return {
+        "TYPE": "PULL",
+        "TIME": datetime.datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "HSM_SERIAL": hsm_serial,
+        "UNLOGGED_BOOTS": logs.n_boot,
+        "UNLOGGED_AUTH": logs.n_auth,
+        "FIRST": numbers[0] if numbers else None,
+        "LAST": numbers[-1] if numbers else None,
+        "DEVICES": devices,
+    }
+
+
+def record_keys(record: dict) -> List[str]:
+    """Index keys of a record"""
+    if record["TYPE"] == "ENTRY":
+        return [f"LOG:{record['HSM_SERIAL']}:{record['NUMBER']}"]
+    return [f"DEVICE:{device['IDENTIFIER']}" for device in record.get("DEVICES", [])]
+
+
+def read_record(data_path: Path, offset: int) -> dict:
+    with open(data_path, "rb") as data_file:
+        data_file.seek(offset)
+        return json.loads(data_file.readline())
+
+
+def read_records(data_path: Path, offset: int = 0) -> Iterator[tuple]:
+    """(offset, end, record) of the whole lines of a day file from offset"""
+    with open(data_path, "rb") as data_file:
+        data_file.seek(offset)
+        for line in data_file:
+            if not line.endswith(b"\n"):
+                return  # Torn by a crash, never made durable
+            yield offset, offset + len(line), json.loads(line)
+            offset += len(line)
+
+
+def truncate_torn(path: Path) -> int:
+    """Cut a file back to its last whole line, returns its length"""
+    if not path.exists():
+        return 0
+    with open(path, "rb+") as torn_file:
+        data = torn_file.read()
+        length = data.rfind(b"\n") + 1
+        if length != len(data):
+            torn_file.truncate(length)
+    return length
+
+
+class DirectoryLock:
+    """Lock file of a directory, held by one process at a time"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        if self.file is None:
+            self.file = open(self.path, "a+b")
+        if fcntl:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+            return self
+        self.file.seek(0)
+        while True:
+            try:
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+                return self
+            except OSError:
+                pass  # LK_LOCK gives up after 10 tries a second apart
+
+    def __exit__(self, *exc_info) -> None:
+        if fcntl:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def close(self) -> None:
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+class DayIndex:
+    """
+    Index of one day file, one line per record: offset, end and index keys,
+    tab separated. It is rebuilt from the data file where it falls behind, so
+    it is never synced to disk. Other processes append to both files, so it
+    is only read or changed with the directory locked, refresh() first taking
+    in what they added.
+    """
+
+    def __init__(self, data_path: Path):
+        self.data_path = data_path
+        self.index_path = data_path.with_suffix(INDEX_SUFFIX)
+        self.offsets: Dict[str, List[int]] = {}
+        self.end = 0  # Data file offset up to which records are indexed
+        self.loaded = 0  # Index file offset up to which lines are loaded
+        self.file = None
+        self._load()
+        size = data_path.stat().st_size if data_path.exists() else 0
+        if self.end > size:  # Data lost in a crash the index survived
+            self.offsets = {}
+            self.end = 0
+            self.loaded = 0
+            self.index_path.unlink()
+        truncate_torn(self.index_path)
+        if size:
+            self._scan()
+
+    def refresh(self) -> None:
+        """Take in the records other processes appended since"""
+        self._load()
+        self._scan()
+
+    def _load(self) -> None:
+        if not self.index_path.exists():
+            return
+        with open(self.index_path, "rb") as index_file:
+            index_file.seek(self.loaded)
+            for line in index_file:
+                if not line.endswith(b"\n"):
+                    return
+                self.loaded += len(line)
+                offset, end, *keys = line.decode().rstrip("\r\n").split("\t")
+                self._add(int(offset), int(end), keys)
+
+    def _scan(self) -> None:
+        if self.data_path.exists():
+            for offset, end, record in read_records(self.data_path, self.end):
+                self.add(offset, end, record_keys(record))
+
+    def _add(self, offset: int, end: int, keys: List[str]) -> None:
+        for key in keys:
+            self.offsets.setdefault(key, []).append(offset)
+        self.end = end
+
+    def add(self, offset: int, end: int, keys: List[str]) -> None:
+        if self.file is None:
+            self.file = open(self.index_path, "ab")
+        line = ("\t".join([str(offset), str(end)] + keys) + "\n").encode()
+        self.file.write(line)
+        self.loaded += len(line)
+        self._add(offset, end, keys)
+
+    def flush(self) -> None:
+        if self.file:
+            self.file.flush()
+
+    def close(self) -> None:
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+class AuditStore:
+    """
+    Appends records to today's file and its index. An append returns once its
+    records are on disk: the writer syncing does so for everything written so
+    far, so writers arriving meanwhile share one fsync (group commit).
+    Records are written at the end of the file with the directory locked,
+    after taking in what other processes appended, and flushed before it is
+    unlocked.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.lock = threading.Lock()  # Files and indexes
+        self.directory_lock = DirectoryLock(self.directory / LOCK_FILE)
+        self.sync_lock = threading.Lock()  # One fsync at a time
+        self.days: Dict[Path, DayIndex] = {}
+        self.data_path: Path = None
+        self.data_file = None
+        self.written = 0  # Appends written, and synced
+        self.synced = 0
+        self.syncs = 0
+
+    def append(self, records: List[dict]) -> None:
+        with self.lock, self.directory_lock:
+            self._rotate()
+            index = self._day(self.data_path)
+            self.data_file.seek(0, os.SEEK_END)
+            for record in records:
+                line = (json.dumps(record, separators=(",", ":")) + "\n").encode()
+                offset = self.data_file.tell()
+                self.data_file.write(line)
+                index.add(offset, offset + len(line), record_keys(record))
+            self.data_file.flush()
+            index.flush()
+            self.written += 1
+            ticket = self.written
+        self._sync(ticket)
+
+    def find(self, key: str) -> List[dict]:
+        """Records of an index key, oldest first"""
+        with self.lock, self.directory_lock:
+            records = []
+            for data_path in sorted(self.directory.glob("*" + DATA_SUFFIX)):
+                for offset in self._day(data_path).offsets.get(key, []):
+                    records.append(read_record(data_path, offset))
+            return records
+
+    def find_device(self, identifier: str) -> List[dict]:
+        """Pulls made after the AG was signed"""
+        return self.find(f"DEVICE:{identifier}")
+
+    def find_log(self, hsm_serial: int, number: int) -> List[dict]:
+        """Log entries of that number (numbers wrap at 65536)"""
+        return self.find(f"LOG:{hsm_serial}:{number}")
+
+    def last_number(self, hsm_serial: int) -> Optional[int]:
+        """Number of the last log entry stored for an HSM"""
+        prefix = f"LOG:{hsm_serial}:"
+        with self.lock, self.directory_lock:
+            for data_path in sorted(self.directory.glob("*" + DATA_SUFFIX))[::-1]:
+                offsets = self._day(data_path).offsets
+                keys = [key for key in offsets if key.startswith(prefix)]
+                if keys:  # Numbers wrap, the last entry is the last in the file
+                    last = max(keys, key=lambda key: offsets[key][-1])
+                    return int(last[len(prefix) :])
+        return None
+
+    def close(self) -> None:
+        with self.lock:
+            self._close_data()
+            for index in self.days.values():
+                index.close()
+            self.directory_lock.close()
+
+    def _day(self, data_path: Path) -> DayIndex:
+        """Index of a day file, up to date; the directory must be locked"""
+        index = self.days.get(data_path)
+        if index is None:
+            index = self.days[data_path] = DayIndex(data_path)
+        else:
+            index.refresh()
+        return index
+
+    def _rotate(self) -> None:
+        data_path = self.directory / (str(datetime.date.today()) + DATA_SUFFIX)
+        if data_path == self.data_path:
+            return
+        self._close_data()
+        truncate_torn(data_path)
+        self.data_path = data_path
+        self.data_file = open(data_path, "ab")
+
+    def _close_data(self) -> None:
+        if self.data_file:
+            self.data_file.flush()
+            os.fsync(self.data_file.fileno())
+            self.data_file.close()
+            self.data_file = None
+            self.days[self.data_path].flush()
+            self.data_path = None
+            self.synced = self.written
+
+    def _sync(self, ticket: int) -> None:
+        with self.sync_lock:
+            if self.synced >= ticket:
+                return  # Synced by another writer
+            with self.lock:
+                target = self.written
+                self.data_file.flush()
+                self.days[self.data_path].flush()
+                fd = os.dup(self.data_file.fileno())  # Even if rotated meanwhile
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self.synced = max(self.synced, target)
+            self.syncs += 1
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Look up the HSM audit log store")
+    ap.add_argument("directory", help="Audit data directory")
+    ap.add_argument("--device", help="Identifier (CSN) of an AG")
+    ap.add_argument("--log", help="HSM_SERIAL:NUMBER of a log entry")
+    args = ap.parse_args()
+    store = AuditStore(Path(os.path.expandvars(args.directory)))
+    start = time.perf_counter()
+    if args.device:
+        records = store.find_device(args.device)
+    elif args.log:
+        hsm_serial, number = args.log.split(":")
+        records = store.find_log(int(hsm_serial), int(number))
+    else:
+        ap.error("Give --device or --log")
+    for record in records:
+        print(json.dumps(record))
+    print(
+        f"{len(records)} records in {time.perf_counter() - start:.3f}s", file=sys.stderr
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# Copyright 2022 Motive Technologies, Inc.
+# All rights reserved
+"""
+Routing of AGs to the CAs of several HSMs served by one provisioning process.
+The CA profiles file lists, per CA, the options of a single CA run and which
+AGs it signs, by AG identifier prefix or by port:
+    {
+        "ca_profiles": [
+            {
+                "name": "101",
+                "ca_common_name": "Motive Firefly CA 18 952 101",
+                "ca_key_id": "6bfa",
+                "hsm_serial": 18952101,
+                "connector_url": "http://127.0.0.1:12345/api",
+                "openssl_conf": "%APPDATA%/AGCertificateProvisioner/hsm-101/etc/openssl.conf",
+                "ca_data_directory": "%APPDATA%/AGCertificateProvisioner/hsm-101/ca",
+                "audit_data_directory": "%APPDATA%/AGCertificateProvisioner/hsm-101/audit",
+                "audit_key_id": "0002",
+                "audit_key_password": "...",
+                "extensions": "client_ext",
+                "identifier_prefixes": ["ACCA11"],
+                "com_ports": ["COM3"]
+            }
+        ]
+    }
+"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from hsm_queue import HsmQueue
+from hsm_session import OperationStats
+
+REQUIRED = (
+    "ca_common_name",
+    "ca_key_id",
+    "hsm_serial",
+    "connector_url",
+    "openssl_conf",
+    "ca_data_directory",
+    "audit_data_directory",
+    "audit_key_id",
+    "audit_key_password",
+)
+NUMBERS = {"ca_key_id": 16, "audit_key_id": 16, "hsm_serial": 10}  # Key: base
+
+
+def profile_number(profile: dict, key: str) -> int:
+    """A number of a CA profile, given as a JSON number or a string in its base"""
+    value = profile[key]
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    try:
+        return int(value, base=NUMBERS[key])
+    except (TypeError, ValueError):
+        raise ValueError(f"CA profile {profile['name']} has {key} {value!r}") from None
+
+
+def load_ca_profiles(path: Path) -> List[dict]:
+    """
+    CA profiles of a profiles file, with defaults filled in and key IDs
+    (hex) and HSM serial numbers as ints
+    """
+    with open(Path(os.path.expandvars(str(path))), "r") as profiles_file:
+        profiles = json.load(profiles_file)["ca_profiles"]
+    names = set()
+    routes = {}  # Identifier prefixes and ports, to the profile taking them
+    for profile in profiles:
+        missing = [key for key in REQUIRED if key not in profile]
+        if missing:
+            raise ValueError(f"CA profile {profile} has no {', '.join(missing)}")
+        profile.setdefault("name", profile["ca_common_name"])
+        profile.setdefault("extensions", "client_ext")
+        profile.setdefault("identifier_prefixes", [])
+        profile.setdefault("com_ports", [])
+        for key in NUMBERS:
+            profile[key] = profile_number(profile, key)
+        if profile["name"] in names:
+            raise ValueError(f"Two CA profiles are named {profile['name']}")
+        names.add(profile["name"])
+        for route in profile["identifier_prefixes"] + profile["com_ports"]:
+            if route in routes:
+                raise ValueError(
+                    f"CA profiles {routes[route]} and {profile['name']} both take "
+                    + route
+                )
+            routes[route] = profile["name"]
+    if not profiles:
+        raise ValueError(f"No CA profiles in {path}")
+    return profiles
+
+
+class CaThroughput:
+    """AGs provisioned by one CA, and how fast"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.provisioned = OperationStats()  # Seconds per AG, from its CSR on
+        self.failed = 0
+        self.first: float = None  # First start and last end, monotonic
+        self.last: float = None
+
+    def add(self, start: float, end: float, ok: bool) -> None:
+        with self.lock:
+            if ok:
+                self.provisioned.add(end - start)
+            else:
+                self.failed += 1
+            self.first = start if self.first is None else min(self.first, start)
+            self.last = end if self.last is None else max(self.last, end)
+
+    def summary(self) -> dict:
+        with self.lock:
+            elapsed = self.last - self.first if self.first is not None else 0.0
+            per_hour = self.provisioned.count * 3600 / elapsed if elapsed else 0.0
+            return {
+                "PROVISIONED": self.provisioned.count,
+                "FAILED": self.failed,
+                "PER_HOUR": round(per_hour, 1),
+                "PROVISION": self.provisioned.summary(),
+            }
+
+
+class CaRouter:
+    """
+    Picks the CA of each AG: the profile with the longest identifier prefix
+    the AG identifier starts with, else the profile listing the AG's port,
+    else the only profile. Each CA has its own HSM, so each has an HSM queue
+    of its own and AGs of different CAs are signed in parallel.
+    """
+
+    def __init__(self, profiles: List[dict], cas: Dict[str, object]):
+        """cas: the provisioner of each CA profile, by name"""
+        self.profiles = {profile["name"]: profile for profile in profiles}
+        self.cas = cas
+        self.queues: Dict[str, HsmQueue] = {name: HsmQueue() for name in self.profiles}
+        self.throughput = {name: CaThroughput() for name in self.profiles}
+
+    def route(self, com_port: str, identifier: str) -> Optional[str]:
+        """Name of the CA profile of an AG, None if no profile takes it"""
+        prefixes = [
+            (len(prefix), name)
+            for name, profile in self.profiles.items()
+            for prefix in profile["identifier_prefixes"]
+            if identifier.startswith(prefix)
+        ]
+        if prefixes:
+            return max(prefixes)[1]
+        for name, profile in self.profiles.items():
+            if com_port in profile["com_ports"]:
+                return name
+        if len(self.profiles) == 1:
+            return next(iter(self.profiles))
+        return None
+
+    def record(self, name: str, start: float, ok: bool) -> None:
+        self.throughput[name].add(start, time.monotonic(), ok)
+
+    def stats(self) -> Dict[str, dict]:
+        return {name: stats.summary() for name, stats in self.throughput.items()}
+
+    def close(self) -> None:
+        for hsm_queue in self.queues.values():
+            hsm_queue.close()
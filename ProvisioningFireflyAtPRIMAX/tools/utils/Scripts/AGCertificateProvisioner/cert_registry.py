@@ -0,0 +1,356 @@
+# Copyright 2022 Motive Technologies, Inc.
+# All rights reserved
+"""
+Registry of the device certificates issued by a CA
+
+Usage:
+    python cert_registry.py REGISTRY_DB --identifier IDENTIFIER
+    python cert_registry.py REGISTRY_DB --serial SERIAL
+    python cert_registry.py REGISTRY_DB --pending
+    python cert_registry.py REGISTRY_DB --export index.txt
+    python cert_registry.py REGISTRY_DB --revoke SERIAL [--reason REASON]
+"""
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+from typing import Callable, List, Optional, TextIO
+
+from cryptography import x509
+
+# States of a certificate, in order
+SIGNED = "SIGNED"  # Recorded before it leaves the process
+STORED = "STORED"  # Accepted by the AG
+CONFIRMED = "CONFIRMED"  # The AG reports its serial
+MISMATCH = "MISMATCH"  # The AG reports another serial
+ABANDONED = "ABANDONED"  # Left SIGNED or STORED, the AG got another one since
+PENDING = (SIGNED, STORED)
+
+COLUMNS = (
+    "serial",
+    "identifier",
+    "subject",
+    "not_before",
+    "not_after",
+    "ca",
+    "ca_key_id",
+    "hsm_serial",
+    "state",
+    "signed",
+    "updated",
+    "pem",
+)
+
+
+# CRL reason codes, as OpenSSL names them (Ex: openssl ca -crl_reason)
+REASONS = [flag.value for flag in x509.ReasonFlags]
+
+
+def utc_now() -> str:
+    return datetime.datetime.utcnow().isoformat(timespec="seconds") + "Z"
+
+
+def normalize_serial(serial) -> str:
+    """Upper case hex of an even length, from an int or hex with or without colons"""
+    if not isinstance(serial, int):
+        serial = int(str(serial).replace(":", ""), 16)
+    digits = f"{serial:X}"
+    return digits.zfill(len(digits) + len(digits) % 2)
+
+
+def validity(cert: x509.Certificate) -> tuple:
+    """Not before and not after, as naive UTC datetimes"""
+    if hasattr(cert, "not_valid_after_utc"):  # cryptography 42 and later
+        return (
+            cert.not_valid_before_utc.replace(tzinfo=None),
+            cert.not_valid_after_utc.replace(tzinfo=None),
+        )
+    return cert.not_valid_before, cert.not_valid_after
+
+
+def oneline_name(name: x509.Name) -> str:
+    """Name as OpenSSL writes it in index.txt (Ex: /C=US/CN=AG 123)"""
+    return "".join(f"/{attr.rfc4514_attribute_name}={attr.value}" for attr in name)
+
+
+def index_time(when: datetime.datetime) -> str:
+    """UTCTime up to 2049, GeneralizedTime after, as in index.txt"""
+    if when.year < 2050:
+        return when.strftime("%y%m%d%H%M%SZ")
+    return when.strftime("%Y%m%d%H%M%SZ")
+
+
+class CertificateRegistry:
+    """
+    The device certificates issued by a CA, in SQLite with every write synced
+    to its write-ahead log. A certificate is recorded SIGNED before it leaves
+    the process, then moves to STORED once the AG accepted it and CONFIRMED
+    once the AG reports its serial. Certificates a stopped run left SIGNED or
+    STORED are listed by pending(), and become ABANDONED when their AG is
+    given another one.
+    """
+
+    def __init__(self, db_path: Path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(
+            str(db_path), isolation_level=None, check_same_thread=False
+        )
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS certificates "
+            + "(serial TEXT PRIMARY KEY, identifier TEXT, subject TEXT, "
+            + "not_before TEXT, not_after TEXT, ca TEXT, ca_key_id INTEGER, "
+            + "hsm_serial INTEGER, state TEXT, signed TEXT, updated TEXT, pem TEXT)"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS certificates_identifier "
+            + "ON certificates (identifier)"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS certificates_state ON certificates (state)"
+        )
+        # crl_number: of the first CRL listing the revocation, NULL until then
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS revocations "
+            + "(serial TEXT PRIMARY KEY, ca TEXT, revoked TEXT, reason TEXT, "
+            + "crl_number INTEGER)"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS revocations_crl "
+            + "ON revocations (ca, crl_number)"
+        )
+        # base: number of the full CRL a delta CRL is relative to, NULL if full
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS crls (ca TEXT, number INTEGER, "
+            + "base INTEGER, entries INTEGER, issued TEXT, PRIMARY KEY (ca, number))"
+        )
+
+    def record_signed(
+        self, identifier: str, pem: str, ca: str, ca_key_id: int, hsm_serial: int
+    ) -> str:
+        """Record a certificate just signed, returns its serial"""
+        cert = x509.load_pem_x509_certificate(pem.encode())
+        not_before, not_after = validity(cert)
+        serial = normalize_serial(cert.serial_number)
+        now = utc_now()
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                self.db.execute(
+                    "UPDATE certificates SET state = ?, updated = ? "
+                    + "WHERE identifier = ? AND state IN (?, ?)",
+                    (ABANDONED, now, identifier) + PENDING,
+                )
+                self.db.execute(
+                    f"INSERT INTO certificates ({', '.join(COLUMNS)}) "
+                    + f"VALUES ({', '.join('?' * len(COLUMNS))})",
+                    (
+                        serial,
+                        identifier,
+                        oneline_name(cert.subject),
+                        not_before.isoformat() + "Z",
+                        not_after.isoformat() + "Z",
+                        ca,
+                        ca_key_id,
+                        hsm_serial,
+                        SIGNED,
+                        now,
+                        now,
+                        pem,
+                    ),
+                )
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+        return serial
+
+    def set_state(self, serial, state: str) -> None:
+        with self.lock:
+            self.db.execute(
+                "UPDATE certificates SET state = ?, updated = ? WHERE serial = ?",
+                (state, utc_now(), normalize_serial(serial)),
+            )
+
+    def by_serial(self, serial) -> Optional[dict]:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT * FROM certificates WHERE serial = ?",
+                (normalize_serial(serial),),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def by_identifier(self, identifier: str) -> List[dict]:
+        """Certificates of an AG, oldest first"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT * FROM certificates WHERE identifier = ? ORDER BY signed",
+                (identifier,),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def pending(self) -> List[dict]:
+        """Certificates signed by runs that stopped before the AG confirmed them"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT * FROM certificates WHERE state IN (?, ?) ORDER BY signed",
+                PENDING,
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def revoke(self, serial, reason: str = "unspecified") -> bool:
+        """Revoke a certificate, returns False if it was revoked already"""
+        if reason not in REASONS:
+            raise ValueError(f"Unknown reason {reason}, one of {', '.join(REASONS)}")
+        serial = normalize_serial(serial)
+        with self.lock:
+            row = self.db.execute(
+                "SELECT ca FROM certificates WHERE serial = ?", (serial,)
+            ).fetchone()
+            if row is None:
+                raise KeyError(f"No certificate {serial}")
+            cursor = self.db.execute(
+                "INSERT OR IGNORE INTO revocations VALUES (?, ?, ?, ?, NULL)",
+                (serial, row["ca"], utc_now(), reason),
+            )
+        return cursor.rowcount == 1
+
+    def revocations(self, ca: str) -> List[dict]:
+        """Revocations of a CA, oldest first"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT * FROM revocations WHERE ca = ? ORDER BY revoked", (ca,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def issue_crl(
+        self,
+        ca: str,
+        sign: Callable[[int, Optional[int], List[dict]], bytes],
+        delta: bool = False,
+    ) -> bytes:
+        """
+        Number the next CRL of a CA and have sign(number, base, revocations)
+        make it, with all the revocations, or for a delta CRL those not in the
+        last full CRL (its number is base). Only the revocations not listed
+        before are read for a delta CRL. The CRL and the revocations it lists
+        first are recorded once sign returns, so a failed signature leaves no
+        trace.
+        """
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                (last,) = self.db.execute(
+                    "SELECT MAX(number) FROM crls WHERE ca = ?", (ca,)
+                ).fetchone()
+                number = (last or 0) + 1
+                base = None
+                query = "SELECT * FROM revocations WHERE ca = ?"
+                params = (ca,)
+                if delta:
+                    (base,) = self.db.execute(
+                        "SELECT MAX(number) FROM crls WHERE ca = ? AND base IS NULL",
+                        (ca,),
+                    ).fetchone()
+                    if base is None:
+                        raise ValueError(f"No full CRL of {ca} for a delta CRL")
+                    query += " AND (crl_number IS NULL OR crl_number > ?)"
+                    params += (base,)
+                rows = self.db.execute(query + " ORDER BY revoked", params)
+                revocations = [dict(row) for row in rows]
+                crl = sign(number, base, revocations)
+                self.db.execute(
+                    "UPDATE revocations SET crl_number = ? "
+                    + "WHERE ca = ? AND crl_number IS NULL",
+                    (number, ca),
+                )
+                self.db.execute(
+                    "INSERT INTO crls VALUES (?, ?, ?, ?, ?)",
+                    (ca, number, base, len(revocations), utc_now()),
+                )
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+        return crl
+
+    def export_index(self, index_file: TextIO) -> int:
+        """Write the OpenSSL CA database (index.txt), returns the certificates"""
+        now = datetime.datetime.utcnow()
+        count = 0
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT c.serial, subject, not_after, revoked, reason "
+                + "FROM certificates c LEFT JOIN revocations r ON c.serial = r.serial "
+                + "ORDER BY signed"
+            )
+            for serial, subject, not_after, revoked, reason in rows:
+                expiry = datetime.datetime.fromisoformat(not_after.rstrip("Z"))
+                status = "E" if expiry < now else "V"
+                revocation = ""
+                if revoked:
+                    status = "R"
+                    when = datetime.datetime.fromisoformat(revoked.rstrip("Z"))
+                    revocation = index_time(when)
+                    if reason != "unspecified":
+                        revocation += f",{reason}"
+                index_file.write(
+                    f"{status}\t{index_time(expiry)}\t{revocation}\t{serial}\t"
+                    + f"unknown\t{subject}\n"
+                )
+                count += 1
+        return count
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Look up the device certificate registry")
+    ap.add_argument("registry", help="Registry database (certificates.db)")
+    ap.add_argument("--identifier", help="Identifier (CSN) of an AG")
+    ap.add_argument("--serial", help="Certificate serial number, in hex")
+    ap.add_argument("--pending", action="store_true", help="Unconfirmed certificates")
+    ap.add_argument("--export", help="OpenSSL index.txt file to write")
+    ap.add_argument("--revoke", help="Serial of a certificate to revoke, in hex")
+    ap.add_argument(
+        "--reason", choices=REASONS, default="unspecified", help="Revocation reason"
+    )
+    args = ap.parse_args()
+    registry = CertificateRegistry(Path(os.path.expandvars(args.registry)))
+    if args.revoke:
+        try:
+            revoked = registry.revoke(args.revoke, args.reason)
+        except KeyError as e:
+            sys.exit(f"{e.args[0]}")
+        print(f"Revoked {args.revoke}" if revoked else f"{args.revoke} was revoked")
+        return
+    if args.export:
+        with open(args.export, "w") as index_file:
+            count = registry.export_index(index_file)
+        # An AG provisioned again has a second certificate of the same subject
+        with open(args.export + ".attr", "w") as attr_file:
+            attr_file.write("unique_subject = no\n")
+        print(f"Wrote {count} certificates to {args.export}", file=sys.stderr)
+        return
+    if args.identifier:
+        records = registry.by_identifier(args.identifier)
+    elif args.serial:
+        records = [record for record in [registry.by_serial(args.serial)] if record]
+    elif args.pending:
+        records = registry.pending()
+    else:
+        ap.error("Give --identifier, --serial, --pending, --export or --revoke")
+    for record in records:
+        print(json.dumps(record, indent=4))
+
+
+if __name__ == "__main__":
+    main()
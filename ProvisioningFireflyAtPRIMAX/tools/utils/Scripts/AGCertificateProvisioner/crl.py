@@ -0,0 +1,192 @@
+# Copyright 2022 Motive Technologies, Inc.
+# All rights reserved
+"""
+Certificate revocation lists of a CA, made from the revocations in the
+certificate registry and signed by the CA key in the HSM. A full CRL lists
+every revocation of the CA; a delta CRL only those the last full CRL does not
+have, so it stays small and can be issued often. Both share the CRL numbers.
+Revoke with `cert_registry.py REGISTRY_DB --revoke SERIAL`.
+
+Usage:
+    python crl.py REGISTRY_DB --ca_conf tls-ca.conf --ca_cert CRT
+        --connector_url URL [--ca_key_id ID] [--delta] [-o CRL]
+    python crl.py REGISTRY_DB --ca_conf tls-ca.conf --ca_cert CRT
+        --ca_key KEY_PEM [--delta] [-o CRL]
+
+The PIN and, by default, the CA key ID are read from the CA config as the
+pkcs11 engine does. With --ca_key a software key stands in for the HSM.
+"""
+import argparse
+import datetime
+import os
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from cert_registry import CertificateRegistry
+from hsm_signer import (
+    SoftwareKey,
+    authority_key_identifier,
+    load_conf_sections,
+    read_pkcs11_pin,
+    signed_der,
+)
+
+
+def load_crl_profile(ca_conf: Path) -> Tuple[int, Dict[str, str], str]:
+    """default_crl_days, crl_extensions and private_key of the default CA"""
+    sections = load_conf_sections(ca_conf)
+    ca = sections.get(sections.get("ca", {}).get("default_ca", ""), {})
+    days = int(ca.get("default_crl_days", CrlSigner.DAYS))
+    profile = sections.get(ca.get("crl_extensions", ""), {})
+    return days, profile, ca.get("private_key", "")
+
+
+class CrlSigner:
+    """
+    Builds CRLs as `openssl ca -gencrl` does from the CA config: issuer from
+    the CA certificate, next update default_crl_days ahead and extensions from
+    crl_extensions, plus the CRL number and, in a delta CRL, the number of its
+    full CRL. As with CertificateSigner, only the TBS part goes to the HSM.
+    """
+
+    DAYS = 30  # Until the next CRL
+
+    def __init__(
+        self, ca_cert: x509.Certificate, key, profile: Dict[str, str], days=DAYS
+    ):
+        if not isinstance(ca_cert.public_key(), ec.EllipticCurvePublicKey):
+            raise ValueError("Only EC CA keys can be used in-process")
+        self.ca_cert = ca_cert
+        self.key = key
+        self.profile = profile
+        self.days = days
+        self.tbs_key = ec.generate_private_key(ec.SECP256R1())
+        self.extensions()  # Unsupported profiles fail here
+
+    def extensions(self, delta: bool = False) -> List[Tuple[x509.ExtensionType, bool]]:
+        """Extensions of the profile, freshestCRL (where delta CRLs are) if full"""
+        extensions = []
+        for name, value in self.profile.items():
+            words = [word.strip() for word in value.split(",")]
+            critical = "critical" in words
+            words = [word for word in words if word != "critical"]
+            if name == "authorityKeyIdentifier" and words[0].startswith("keyid"):
+                extension = authority_key_identifier(self.ca_cert)
+            elif name == "freshestCRL" and all(
+                word.startswith("URI:") for word in words
+            ):
+                if delta:
+                    continue
+                extension = x509.FreshestCRL(
+                    [
+                        x509.DistributionPoint(
+                            [x509.UniformResourceIdentifier(word[len("URI:") :])],
+                            None,
+                            None,
+                            None,
+                        )
+                        for word in words
+                    ]
+                )
+            else:
+                raise ValueError(f"Unsupported CRL extension {name} = {value}")
+            extensions.append((extension, critical))
+        return extensions
+
+    def sign(self, number: int, base: Optional[int], revocations: List[dict]) -> bytes:
+        """
+        Sign CRL number, a delta CRL of full CRL base unless base is None,
+        listing registry revocations. Returns the DER CRL.
+        """
+        now = datetime.datetime.utcnow().replace(microsecond=0)
+        builder = (
+            x509.CertificateRevocationListBuilder()
+            .issuer_name(self.ca_cert.subject)
+            .last_update(now)
+            .next_update(now + datetime.timedelta(days=self.days))
+        )
+        for extension, critical in self.extensions(base is not None):
+            builder = builder.add_extension(extension, critical)
+        builder = builder.add_extension(x509.CRLNumber(number), False)
+        if base is not None:
+            builder = builder.add_extension(x509.DeltaCRLIndicator(base), True)
+        for revocation in revocations:
+            revoked = datetime.datetime.fromisoformat(revocation["revoked"].rstrip("Z"))
+            entry = (
+                x509.RevokedCertificateBuilder()
+                .serial_number(int(revocation["serial"], 16))
+                .revocation_date(revoked)
+            )
+            if revocation["reason"] != "unspecified":  # RFC 5280 leaves it out
+                reason = x509.ReasonFlags(revocation["reason"])
+                entry = entry.add_extension(x509.CRLReason(reason), False)
+            builder = builder.add_revoked_certificate(entry.build())
+        tbs = builder.sign(self.tbs_key, hashes.SHA256()).tbs_certlist_bytes
+        der = signed_der(tbs, self.key)
+        crl = x509.load_der_x509_crl(der)
+        if not crl.is_signature_valid(self.ca_cert.public_key()):
+            raise ValueError("CRL signature does not verify with the CA certificate")
+        return der
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Issue a CRL from the registry")
+    ap.add_argument("registry", help="Registry database (certificates.db)")
+    ap.add_argument("--ca_conf", required=True, help="CA config (tls-ca.conf)")
+    ap.add_argument("--ca_cert", required=True, help="CA certificate")
+    ap.add_argument("--connector_url", help="yubihsm-connector URL")
+    ap.add_argument("--ca_key_id", help="CA key ID, default from private_key")
+    ap.add_argument("--ca_key", help="PEM key standing in for the HSM")
+    ap.add_argument("--delta", action="store_true", help="Delta CRL")
+    ap.add_argument("-o", "--out", help="CRL file to write (PEM), default stdout")
+    args = ap.parse_args()
+    ca_conf = Path(os.path.expandvars(args.ca_conf))
+    ca_cert = x509.load_pem_x509_certificate(
+        Path(os.path.expandvars(args.ca_cert)).read_bytes()
+    )
+    (ca_name,) = ca_cert.subject.get_attributes_for_oid(NameOID.COMMON_NAME)
+    days, profile, private_key = load_crl_profile(ca_conf)
+    sessions = None
+    if args.ca_key:
+        key = SoftwareKey(
+            serialization.load_pem_private_key(Path(args.ca_key).read_bytes(), None)
+        )
+    elif args.connector_url:
+        from hsm_session import HsmSessions, SessionKey
+
+        key_id, password = read_pkcs11_pin(ca_conf)
+        ca_key_id = int(args.ca_key_id or private_key.split(":")[-1], 16)
+        sessions = HsmSessions(args.connector_url, keepalive=0)
+        sessions.add_key(key_id, password)
+        key = SessionKey(sessions, key_id, ca_key_id)
+    else:
+        ap.error("Give --connector_url or --ca_key")
+    registry = CertificateRegistry(Path(os.path.expandvars(args.registry)))
+    try:
+        signer = CrlSigner(ca_cert, key, profile, days)
+        der = registry.issue_crl(ca_name.value, signer.sign, args.delta)
+    except ValueError as e:
+        sys.exit(f"{e}")
+    finally:
+        registry.close()
+        if sessions:
+            sessions.close()
+    crl = x509.load_der_x509_crl(der)
+    pem = crl.public_bytes(serialization.Encoding.PEM)
+    if args.out:
+        Path(args.out).write_bytes(pem)
+    else:
+        sys.stdout.write(pem.decode())
+    number = crl.extensions.get_extension_for_class(x509.CRLNumber).value.crl_number
+    kind = "Delta CRL" if args.delta else "CRL"
+    print(f"{kind} {number} of {ca_name.value}, {len(crl)} revoked", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# Copyright 2022 Motive Technologies, Inc.
+# All rights reserved
+"""Single queue for the HSM work of AGs provisioned at the same time"""
+import queue
+import threading
+import time
+from typing import Callable, List
+
+
+class HsmJob:
+    """A piece of HSM work and its outcome"""
+
+    def __init__(self, work: Callable[[], None]):
+        self.work = work
+        self.error: BaseException = None
+        self.done = threading.Event()
+
+
+class HsmQueue:
+    """
+    Runs the HSM work of several provisioning threads one at a time in a
+    thread of its own, so the CA serial file and the HSM are only ever used
+    by one of them. Requests arriving together are run as one batch, which
+    is followed by a single after_batch call (Ex: one audit session pulling
+    the logs of every signature in the batch).
+    """
+
+    BATCH_WINDOW = 0.05  # Seconds to wait for more requests after the first
+    MAX_BATCH = 16  # Requests run before after_batch is called
+
+    def __init__(
+        self,
+        after_batch: Callable[[], None] = None,
+        batch_window: float = BATCH_WINDOW,
+        max_batch: int = MAX_BATCH,
+    ):
+        self.after_batch = after_batch
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.requests: queue.Queue = queue.Queue()
+        self.jobs = 0  # Requests run
+        self.batches = 0  # Batches run
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def run(self, work: Callable[[], None]) -> None:
+        """Run work on the HSM thread and wait for it, raising what it raised"""
+        job = HsmJob(work)
+        self.requests.put(job)
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+
+    def close(self) -> None:
+        """Stop once the requests already queued are run"""
+        self.requests.put(None)
+        self.thread.join()
+
+    def _next_batch(self) -> List[HsmJob]:
+        job = self.requests.get()
+        if job is None:
+            return []
+        batch = [job]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch:
+            try:
+                job = self.requests.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if job is None:
+                self.requests.put(None)  # Stop after this batch
+                break
+            batch.append(job)
+        return batch
+
+    def _serve(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            for job in batch:
+                try:
+                    job.work()
+                except BaseException as e:  # Including sys.exit(), for its port
+                    job.error = e
+            if self.after_batch and any(job.error is None for job in batch):
+                try:
+                    self.after_batch()
+                except BaseException as e:
+                    for job in batch:
+                        job.error = job.error or e
+            self.jobs += len(batch)
+            self.batches += 1
+            for job in batch:
+                job.done.set()
@@ -0,0 +1,195 @@
+# Copyright 2022 Motive Technologies, Inc.
+# All rights reserved
+"""Long-lived HSM sessions, re-authenticated when the HSM drops them"""
+import threading
+import time
+from typing import Callable, Dict, Tuple, TypeVar
+
+from cryptography.hazmat.primitives import hashes
+from yubihsm import YubiHsm
+from yubihsm.core import AuthSession
+from yubihsm.defs import ERROR, OBJECT
+from yubihsm.exceptions import (
+    YubiHsmConnectionError,
+    YubiHsmDeviceError,
+    YubiHsmError,
+    YubiHsmInvalidResponseError,
+)
+from yubihsm.utils import password_to_key
+
+T = TypeVar("T")
+
+# Device errors for a session the HSM no longer has (timed out, HSM restarted)
+STALE_SESSION = (ERROR.INVALID_SESSION, ERROR.SESSION_FAILED)
+
+
+class OperationStats:
+    """Latency of one kind of HSM operation"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0  # Seconds
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def summary(self) -> Dict[str, float]:
+        mean = self.total / self.count if self.count else 0.0
+        return {
+            "COUNT": self.count,
+            "MEAN_MS": round(mean * 1000, 2),
+            "MAX_MS": round(self.max * 1000, 2),
+        }
+
+
+class HsmSessions:
+    """
+    One connection to an HSM and one authenticated session per authentication
+    key, kept for the life of the process. Session keys are derived from the
+    passwords once, PBKDF2 being most of the cost of create_session_derived.
+    Sessions idle for keepalive seconds are pinged so the HSM does not time
+    them out. A session lost anyway (timeout, connector or HSM restart) is
+    re-authenticated and the operation run once more. Operations run one at a
+    time, as the commands of a session must.
+    """
+
+    KEEPALIVE = 20.0  # Seconds idle before a ping, the HSM drops sessions at 30
+
+    def __init__(self, connector_url: str, keepalive: float = KEEPALIVE):
+        self.connector_url = connector_url
+        self.keepalive = keepalive
+        self.lock = threading.Lock()
+        self.hsm = YubiHsm.connect(connector_url)
+        self.serial: int = self.hsm.get_device_info().serial
+        self.keys: Dict[int, Tuple[bytes, bytes]] = {}  # K-ENC, K-MAC by key ID
+        self.sessions: Dict[int, AuthSession] = {}
+        self.last_used: Dict[int, float] = {}
+        self.stats: Dict[str, OperationStats] = {}
+        self.reauthentications = 0
+        self.closed = threading.Event()
+        if keepalive:
+            threading.Thread(target=self._keep_alive, daemon=True).start()
+
+    def add_key(self, auth_key_id: int, password: str) -> None:
+        """Derive the session keys of an authentication key, once"""
+        with self.lock:
+            if auth_key_id not in self.keys:
+                self.keys[auth_key_id] = password_to_key(password)
+
+    def run(
+        self, auth_key_id: int, operation: str, work: Callable[[AuthSession], T]
+    ) -> T:
+        """Run work over the session of auth_key_id, timed as operation"""
+        with self.lock:
+            try:
+                return self._timed(auth_key_id, operation, work)
+            except (YubiHsmConnectionError, YubiHsmInvalidResponseError):
+                self._reconnect()
+            except YubiHsmDeviceError as e:
+                if e.code not in STALE_SESSION:
+                    raise
+                self._drop(auth_key_id)
+            self.reauthentications += 1
+            return self._timed(auth_key_id, operation, work)
+
+    def latency(self) -> Dict[str, Dict[str, float]]:
+        """Latency summary of each operation run so far"""
+        with self.lock:
+            latency = {name: stats.summary() for name, stats in self.stats.items()}
+            latency["REAUTHENTICATIONS"] = self.reauthentications
+            return latency
+
+    def close(self) -> None:
+        self.closed.set()
+        with self.lock:
+            for auth_key_id in list(self.sessions):
+                self._drop(auth_key_id)
+            self.hsm.close()
+
+    def _record(self, operation: str, start: float) -> None:
+        stats = self.stats.setdefault(operation, OperationStats())
+        stats.add(time.perf_counter() - start)
+
+    def _session(self, auth_key_id: int) -> AuthSession:
+        session = self.sessions.get(auth_key_id)
+        if session is None:
+            start = time.perf_counter()
+            session = self.hsm.create_session(auth_key_id, *self.keys[auth_key_id])
+            self._record("create_session", start)
+            self.sessions[auth_key_id] = session
+        return session
+
+    def _timed(self, auth_key_id: int, operation: str, work: Callable) -> T:
+        session = self._session(auth_key_id)
+        start = time.perf_counter()
+        result = work(session)
+        self._record(operation, start)
+        self.last_used[auth_key_id] = time.monotonic()
+        return result
+
+    def _drop(self, auth_key_id: int) -> None:
+        session = self.sessions.pop(auth_key_id, None)
+        if session:
+            try:
+                session.close()
+            except YubiHsmError:
+                pass  # Already gone from the HSM
+
+    def _reconnect(self) -> None:
+        """New connection to the same HSM, its sessions are lost"""
+        self.sessions.clear()
+        try:
+            self.hsm.close()
+        except YubiHsmError:
+            pass
+        hsm = YubiHsm.connect(self.connector_url)
+        serial = hsm.get_device_info().serial
+        if serial != self.serial:
+            hsm.close()
+            raise YubiHsmConnectionError(
+                f"{self.connector_url} now serves HSM {serial}, not {self.serial}"
+            )
+        self.hsm = hsm
+
+    def _keep_alive(self) -> None:
+        while not self.closed.wait(self.keepalive / 4):
+            with self.lock:
+                for auth_key_id in list(self.sessions):
+                    idle = time.monotonic() - self.last_used.get(auth_key_id, 0)
+                    if idle < self.keepalive:
+                        continue
+                    try:
+                        # Cheapest session command, logged if audited like any other
+                        self.sessions[auth_key_id].get_pseudo_random(1)
+                        self.last_used[auth_key_id] = time.monotonic()
+                    except YubiHsmError:
+                        self._drop(auth_key_id)  # Re-authenticated when next used
+
+
+class SessionKey:
+    """An asymmetric key of the HSM, used over the managed session of an auth key"""
+
+    def __init__(self, sessions: HsmSessions, auth_key_id: int, key_id: int):
+        self.sessions = sessions
+        self.auth_key_id = auth_key_id
+        self.key_id = key_id
+
+    def _key(self, session: AuthSession):
+        return session.get_object(self.key_id, OBJECT.ASYMMETRIC_KEY)
+
+    def sign_ecdsa(self, data: bytes, hash: hashes.HashAlgorithm = hashes.SHA256()):
+        return self.sessions.run(
+            self.auth_key_id,
+            "sign_ecdsa",
+            lambda session: self._key(session).sign_ecdsa(data, hash),
+        )
+
+    def get_public_key(self):
+        return self.sessions.run(
+            self.auth_key_id,
+            "get_public_key",
+            lambda session: self._key(session).get_public_key(),
+        )
@@ -0,0 +1,226 @@
+# Copyright 2022 Motive Technologies, Inc.
+# All rights reserved
+"""In-process signing of device certificates and CRLs with the CA key held in the HSM"""
+import datetime
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import ExtendedKeyUsageOID
+
+# AlgorithmIdentifier of ecdsa-with-SHA256, as in the TBS certificate
+ECDSA_WITH_SHA256 = bytes.fromhex("300a06082a8648ce3d040302")
+
+KEY_USAGES = {
+    "digitalSignature": "digital_signature",
+    "nonRepudiation": "content_commitment",
+    "contentCommitment": "content_commitment",
+    "keyEncipherment": "key_encipherment",
+    "dataEncipherment": "data_encipherment",
+    "keyAgreement": "key_agreement",
+    "keyCertSign": "key_cert_sign",
+    "cRLSign": "crl_sign",
+    "encipherOnly": "encipher_only",
+    "decipherOnly": "decipher_only",
+}
+
+# Extensions `openssl x509 -req` (OpenSSL 3) adds unless the profile sets them
+DEFAULT_EXTENSIONS = {
+    "subjectKeyIdentifier": "hash",
+    "authorityKeyIdentifier": "keyid",
+}
+
+EXTENDED_KEY_USAGES = {
+    "serverAuth": ExtendedKeyUsageOID.SERVER_AUTH,
+    "clientAuth": ExtendedKeyUsageOID.CLIENT_AUTH,
+    "codeSigning": ExtendedKeyUsageOID.CODE_SIGNING,
+    "emailProtection": ExtendedKeyUsageOID.EMAIL_PROTECTION,
+    "timeStamping": ExtendedKeyUsageOID.TIME_STAMPING,
+    "OCSPSigning": ExtendedKeyUsageOID.OCSP_SIGNING,
+}
+
+
+def read_pkcs11_pin(openssl_conf: Path) -> Tuple[int, str]:
+    """Authentication key ID and password of the PIN in an OpenSSL config"""
+    with open(openssl_conf, "r") as conf_file:
+        for line in conf_file:
+            name, _, value = line.split("#", 1)[0].partition("=")
+            if name.strip() == "PIN":
+                pin = value.strip().strip('"')
+                return int(pin[:4], 16), pin[4:]
+    raise ValueError(f"No PIN in {openssl_conf}")
+
+
+def load_extension_profile(path: Path) -> Dict[str, str]:
+    """Read an OpenSSL extensions file (Ex: client_ext), in file order"""
+    profile = {}
+    with open(path, "r") as ext_file:
+        for line in ext_file:
+            line = line.split("#", 1)[0].strip()
+            if not line or line.startswith("["):
+                continue
+            name, _, value = line.partition("=")
+            profile[name.strip()] = value.strip()
+    return profile
+
+
+def load_conf_sections(path: Path) -> Dict[str, Dict[str, str]]:
+    """Read the sections of an OpenSSL config file (Ex: tls-ca.conf)"""
+    sections = {"": {}}
+    section = sections[""]
+    with open(path, "r") as conf_file:
+        for line in conf_file:
+            line = line.split("#", 1)[0].strip()
+            if line.startswith("["):
+                section = sections.setdefault(line.strip("[] "), {})
+            elif line:
+                name, _, value = line.partition("=")
+                section[name.strip()] = value.strip()
+    return sections
+
+
+def _der_length(length: int) -> bytes:
+    if length < 0x80:
+        return bytes([length])
+    octets = length.to_bytes((length.bit_length() + 7) // 8, "big")
+    return bytes([0x80 | len(octets)]) + octets
+
+
+def _der(tag: int, content: bytes) -> bytes:
+    return bytes([tag]) + _der_length(len(content)) + content
+
+
+def authority_key_identifier(ca_cert: x509.Certificate) -> x509.AuthorityKeyIdentifier:
+    """authorityKeyIdentifier = keyid of the CA, its subject key identifier"""
+    try:
+        ski = ca_cert.extensions.get_extension_for_class(x509.SubjectKeyIdentifier)
+        return x509.AuthorityKeyIdentifier.from_issuer_subject_key_identifier(ski.value)
+    except x509.ExtensionNotFound:
+        return x509.AuthorityKeyIdentifier.from_issuer_public_key(ca_cert.public_key())
+
+
+def signed_der(tbs: bytes, key) -> bytes:
+    """DER certificate or CRL of a TBS part signed by key (ecdsa-with-SHA256)"""
+    signature = key.sign_ecdsa(tbs, hashes.SHA256())
+    return _der(0x30, tbs + ECDSA_WITH_SHA256 + _der(0x03, b"\x00" + signature))
+
+
+def openssl_sign_cmd(
+    csr_path: Path,
+    ca_cert_path: Path,
+    ca_key: str,
+    cert_path: Path,
+    ext_path: Path,
+    serial: str,
+    engine: bool = True,
+) -> str:
+    """
+    `openssl x509 -req` command signing a CSR with the given serial (decimal,
+    or hex after 0x), ca_key is slot:id with the engine
+    """
+    openssl_cmd = "openssl x509 -req "
+    if engine:
+        openssl_cmd += "-CAkeyform engine -engine pkcs11 "
+    openssl_cmd += f'-sha256 -in "{csr_path}" -CA "{ca_cert_path}" -CAkey '
+    openssl_cmd += ca_key if engine else f'"{ca_key}"'
+    openssl_cmd += f' -out "{cert_path}" -days 3650 -extfile "{ext_path}"'
+    openssl_cmd += f" -set_serial {serial}"
+    return openssl_cmd
+
+
+class SoftwareKey:
+    """Stand-in for the HSM CA key (yubihsm AsymmetricKey) for tests and benchmarks"""
+
+    def __init__(self, private_key: ec.EllipticCurvePrivateKey):
+        self.private_key = private_key
+
+    def sign_ecdsa(self, data: bytes, hash: hashes.HashAlgorithm = hashes.SHA256()):
+        return self.private_key.sign(data, ec.ECDSA(hash))
+
+    def get_public_key(self):
+        return self.private_key.public_key()
+
+
+class CertificateSigner:
+    """
+    Builds device certificates as `openssl x509 -req -extfile` does: subject
+    and key from the CSR, issuer from the CA certificate, extensions from the
+    extensions file, plus the key identifiers OpenSSL 3 adds by default (set
+    to none in the file to leave them out). The TBS certificate is signed by the CA key in the HSM
+    (any object with yubihsm's AsymmetricKey.sign_ecdsa), so nothing leaves
+    the process but the signature request.
+    """
+
+    DAYS = 3650  # Validity of device certificates
+
+    def __init__(self, ca_cert: x509.Certificate, key, profile: Dict[str, str]):
+        if not isinstance(ca_cert.public_key(), ec.EllipticCurvePublicKey):
+            raise ValueError("Only EC CA keys can be used in-process")
+        self.ca_cert = ca_cert
+        self.key = key
+        self.profile = profile
+        # Signs the throwaway certificate the TBS part is taken from
+        self.tbs_key = ec.generate_private_key(ec.SECP256R1())
+        self.extensions(ca_cert.public_key())  # Unsupported profiles fail here
+
+    def extensions(self, public_key) -> List[Tuple[x509.ExtensionType, bool]]:
+        """Extensions of the profile for a device public key, in profile order"""
+        profile = dict(self.profile)
+        for name, value in DEFAULT_EXTENSIONS.items():
+            profile.setdefault(name, value)
+        extensions = []
+        for name, value in profile.items():
+            words = [word.strip() for word in value.split(",")]
+            critical = "critical" in words
+            words = [word for word in words if word != "critical"]
+            if words == ["none"]:
+                continue
+            if name == "keyUsage" and all(word in KEY_USAGES for word in words):
+                usages = dict.fromkeys(KEY_USAGES.values(), False)
+                for word in words:
+                    usages[KEY_USAGES[word]] = True
+                extension = x509.KeyUsage(**usages)
+            elif name == "basicConstraints":
+                options = dict(word.split(":", 1) for word in words)
+                path_length = options.get("pathlen")
+                extension = x509.BasicConstraints(
+                    ca=options.get("CA", "false").lower() == "true",
+                    path_length=int(path_length) if path_length else None,
+                )
+            elif name == "extendedKeyUsage" and all(
+                word in EXTENDED_KEY_USAGES for word in words
+            ):
+                extension = x509.ExtendedKeyUsage(
+                    [EXTENDED_KEY_USAGES[word] for word in words]
+                )
+            elif name == "subjectKeyIdentifier" and words == ["hash"]:
+                extension = x509.SubjectKeyIdentifier.from_public_key(public_key)
+            elif name == "authorityKeyIdentifier" and words[0].startswith("keyid"):
+                extension = authority_key_identifier(self.ca_cert)
+            else:
+                raise ValueError(f"Unsupported extension {name} = {value}")
+            extensions.append((extension, critical))
+        return extensions
+
+    def sign(self, csr_pem: bytes, serial: int) -> bytes:
+        """Sign a device CSR, returns the PEM certificate"""
+        csr = x509.load_pem_x509_csr(csr_pem)
+        if not csr.is_signature_valid:
+            raise ValueError("CSR signature is not valid")
+        now = datetime.datetime.utcnow().replace(microsecond=0)
+        builder = (
+            x509.CertificateBuilder()
+            .subject_name(csr.subject)
+            .issuer_name(self.ca_cert.subject)
+            .public_key(csr.public_key())
+            .serial_number(serial)
+            .not_valid_before(now)
+            .not_valid_after(now + datetime.timedelta(days=self.DAYS))
+        )
+        for extension, critical in self.extensions(csr.public_key()):
+            builder = builder.add_extension(extension, critical)
+        tbs = builder.sign(self.tbs_key, hashes.SHA256()).tbs_certificate_bytes
+        cert = x509.load_der_x509_certificate(signed_der(tbs, self.key))
+        return cert.public_bytes(serialization.Encoding.PEM)
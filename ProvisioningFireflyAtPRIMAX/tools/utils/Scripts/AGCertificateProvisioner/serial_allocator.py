@@ -0,0 +1,97 @@
+# Copyright 2022 Motive Technologies, Inc.
+# All rights reserved
+"""Allocation of device certificate serial numbers"""
+import datetime
+import hashlib
+import os
+import secrets
+import socket
+import sqlite3
+import threading
+from pathlib import Path
+
+
+def utc_now() -> str:
+    return datetime.datetime.utcnow().isoformat(timespec="seconds") + "Z"
+
+
+class SerialAllocator:
+    """
+    Certificate serial numbers of 20 bytes: 0x20, a 32-bit station ID (from
+    the station name), a 64-bit sequence number and 56 random bits. Each
+    process reserves a block of sequence numbers at a time from a database
+    shared by the processes of the station, so they never hand out the same
+    numbers, and every serial is recorded under a unique index before it is
+    used. A serial found there already is skipped and counted in collisions.
+    """
+
+    BLOCK = 1000  # Sequence numbers reserved at a time
+
+    def __init__(self, db_path: Path, station: str = "", block: int = BLOCK):
+        self.station = station or socket.gethostname()
+        digest = hashlib.sha256(self.station.encode()).digest()
+        self.station_id = int.from_bytes(digest[:4], "big")
+        self.block = block
+        self.lock = threading.Lock()
+        self.next = 0  # Sequence numbers reserved, [next, end)
+        self.end = 0
+        self.collisions = 0
+        self.db = sqlite3.connect(
+            str(db_path), isolation_level=None, check_same_thread=False
+        )
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")  # Reservations stay ordered
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS ranges "
+            + "(start INTEGER, end INTEGER, station TEXT, pid INTEGER, time TEXT)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS serials "
+            + "(serial TEXT PRIMARY KEY, identifier TEXT, time TEXT)"
+        )
+
+    def allocate(self, identifier: str = "") -> str:
+        """A new serial in hex, recorded for the AG identifier"""
+        with self.lock:
+            while True:
+                if self.next >= self.end:
+                    self._reserve()
+                sequence = self.next
+                self.next += 1
+                serial = f"20{self.station_id:08x}{sequence:016x}{secrets.token_hex(7)}"
+                try:
+                    self.db.execute(
+                        "INSERT INTO serials VALUES (?, ?, ?)",
+                        (serial, identifier, utc_now()),
+                    )
+                    return serial
+                except sqlite3.IntegrityError:
+                    self.collisions += 1
+
+    def is_allocated(self, serial: str) -> bool:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT 1 FROM serials WHERE serial = ?", (serial.lower(),)
+            ).fetchone()
+            return row is not None
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
+
+    def _reserve(self) -> None:
+        """Reserve the next block, disjoint from those of every other process"""
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            (start,) = self.db.execute(
+                "SELECT COALESCE(MAX(end), 0) FROM ranges"
+            ).fetchone()
+            self.db.execute(
+                "INSERT INTO ranges VALUES (?, ?, ?, ?, ?)",
+                (start, start + self.block, self.station, os.getpid(), utc_now()),
+            )
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.next, self.end = start, start + self.block
@@ -0,0 +1,205 @@
+# Copyright 2022 Motive Technologies, Inc.
+# All rights reserved
+"""
+Benchmark of in-process device certificate signing against openssl x509 -req
+
+Usage:
+    python sign_bench.py [-n CERTS] [--extfile client_ext]
+    python sign_bench.py --connector_url URL --openssl_conf CONF --ca_cert CRT
+        --ca_key_id ID [-n CERTS] [--extfile client_ext]
+
+Without an HSM a throwaway CA with a software key stands in for it, so the
+numbers show the host side cost only (no HSM signature, no pkcs11 engine).
+CSRs are made up front; the openssl case includes the CSR and certificate
+files it needs, as the provisioner does per device.
+"""
+import argparse
+import datetime
+import os
+import secrets
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from hsm_signer import (
+    CertificateSigner,
+    SoftwareKey,
+    load_extension_profile,
+    openssl_sign_cmd,
+    read_pkcs11_pin,
+)
+
+CLIENT_EXT = """keyUsage                = critical,digitalSignature
+basicConstraints        = CA:false
+extendedKeyUsage        = clientAuth
+subjectKeyIdentifier    = hash
+authorityKeyIdentifier  = keyid:always
+"""
+
+
+def make_csrs(count: int) -> list:
+    csrs = []
+    for number in range(count):
+        key = ec.generate_private_key(ec.SECP256R1())
+        name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, f"BENCH-{number}")])
+        csr = x509.CertificateSigningRequestBuilder().subject_name(name)
+        csr = csr.sign(key, hashes.SHA256())
+        csrs.append(csr.public_bytes(serialization.Encoding.PEM))
+    return csrs
+
+
+def make_software_ca(directory: Path):
+    """Self-signed CA with a software key, standing in for the HSM"""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "Bench CA")])
+    now = datetime.datetime.utcnow()
+    ca_cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.BasicConstraints(ca=True, path_length=0), True)
+        .add_extension(
+            x509.SubjectKeyIdentifier.from_public_key(key.public_key()), False
+        )
+        .sign(key, hashes.SHA256())
+    )
+    key_path = directory / "ca.key"
+    key_path.write_bytes(
+        key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        )
+    )
+    cert_path = directory / "ca.crt"
+    cert_path.write_bytes(ca_cert.public_bytes(serialization.Encoding.PEM))
+    return ca_cert, SoftwareKey(key), cert_path, str(key_path)
+
+
+def sign_openssl(csr_pem, directory, ca_cert_path, ca_key, ext_path, env, engine):
+    csr_path = directory / "device.csr"
+    cert_path = directory / "device.crt"
+    csr_path.write_bytes(csr_pem)
+    serial = "0x20" + secrets.token_hex(19)
+    cmd = openssl_sign_cmd(
+        csr_path, ca_cert_path, ca_key, cert_path, ext_path, serial, engine
+    )
+    subprocess.run(cmd, check=True, shell=True, capture_output=True, env=env)
+    cert_pem = cert_path.read_bytes()
+    cert_path.unlink()
+    csr_path.unlink()
+    return cert_pem
+
+
+def bench(name, sign, csrs, ca_cert):
+    times = []
+    certs = []
+    for csr_pem in csrs:
+        start = time.perf_counter()
+        cert_pem = sign(csr_pem)
+        times.append(time.perf_counter() - start)
+        certs.append(x509.load_pem_x509_certificate(cert_pem))
+    for cert in certs:
+        ca_cert.public_key().verify(
+            cert.signature,
+            cert.tbs_certificate_bytes,
+            ec.ECDSA(cert.signature_hash_algorithm),
+        )
+    times.sort()
+    print(
+        "{:<12} {:>6} {:>10.2f} {:>10.2f} {:>10.1f}".format(
+            name,
+            len(times),
+            statistics.mean(times) * 1000,
+            times[int(len(times) * 0.95) - 1] * 1000,
+            len(times) / sum(times),
+        )
+    )
+    return certs
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Device certificate signing benchmark")
+    ap.add_argument("-n", "--certs", type=int, default=50, help="Certificates per case")
+    ap.add_argument("--extfile", help="Extensions file (default client_ext profile)")
+    ap.add_argument(
+        "--connector_url", help="YubiHSM connector, software CA if not given"
+    )
+    ap.add_argument("--openssl_conf", help="OpenSSL config of the HSM (PIN)")
+    ap.add_argument("--ca_cert", help="CA certificate of the HSM")
+    ap.add_argument("--ca_key_id", help="Hex Key ID of the CA key in the HSM")
+    args = ap.parse_args()
+
+    directory = Path(tempfile.mkdtemp())
+    ext_path = Path(args.extfile) if args.extfile else directory / "client_ext"
+    if not args.extfile:
+        ext_path.write_text(CLIENT_EXT)
+    env = os.environ.copy()
+
+    if args.connector_url:
+        from yubihsm import YubiHsm
+        from yubihsm.defs import OBJECT
+
+        ca_cert_path = Path(args.ca_cert)
+        ca_cert = x509.load_pem_x509_certificate(ca_cert_path.read_bytes())
+        ca_key_id = int(args.ca_key_id, 16)
+        hsm = YubiHsm.connect(args.connector_url)
+        session = hsm.create_session_derived(*read_pkcs11_pin(args.openssl_conf))
+        key = session.get_object(ca_key_id, OBJECT.ASYMMETRIC_KEY)
+        openssl_key = "0:" + hex(ca_key_id)[2:].zfill(4)
+        env["OPENSSL_CONF"] = args.openssl_conf
+        engine = True
+    else:
+        ca_cert, key, ca_cert_path, openssl_key = make_software_ca(directory)
+        engine = False
+
+    csrs = make_csrs(args.certs)
+    signer = CertificateSigner(ca_cert, key, load_extension_profile(ext_path))
+
+    print(
+        "{:<12} {:>6} {:>10} {:>10} {:>10}".format(
+            "SIGNER", "CERTS", "MEAN[ms]", "P95[ms]", "CERTS/S"
+        )
+    )
+    in_process = bench(
+        "in-process",
+        lambda csr_pem: signer.sign(csr_pem, int("20" + secrets.token_hex(19), 16)),
+        csrs,
+        ca_cert,
+    )
+    openssl = bench(
+        "openssl",
+        lambda csr_pem: sign_openssl(
+            csr_pem, directory, ca_cert_path, openssl_key, ext_path, env, engine
+        ),
+        csrs,
+        ca_cert,
+    )
+
+    def extensions(cert: x509.Certificate) -> list:
+        return sorted(cert.extensions, key=lambda ext: ext.oid.dotted_string)
+
+    for ours, theirs in zip(in_process, openssl):
+        if (
+            ours.subject != theirs.subject
+            or ours.issuer != theirs.issuer
+            or extensions(ours) != extensions(theirs)
+        ):
+            print("\nError: in-process and openssl certificates differ")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# Copyright 2022 Motive Technologies, Inc.
+# All rights reserved
+"""
+CRLs from the certificate registry, signed by a software CA key standing in
+for the HSM. Run with `python -m unittest test_crl` from this directory.
+"""
+import tempfile
+import unittest
+from pathlib import Path
+
+from cryptography import x509
+
+from cert_registry import CertificateRegistry, normalize_serial
+from crl import CrlSigner
+from hsm_signer import CertificateSigner, load_extension_profile
+from sign_bench import CLIENT_EXT, make_csrs, make_software_ca
+
+CA = "Bench CA"
+
+
+class CrlTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        directory = Path(self.directory.name)
+        self.ca_cert, key = make_software_ca(directory)[:2]
+        ext_path = directory / "client_ext"
+        ext_path.write_text(CLIENT_EXT)
+        signer = CertificateSigner(self.ca_cert, key, load_extension_profile(ext_path))
+        self.registry = CertificateRegistry(directory / "certificates.db")
+        self.serials = [
+            self.registry.record_signed(
+                f"AG{number}", signer.sign(csr, 0x2000 + number).decode(), CA, 1, 0
+            )
+            for number, csr in enumerate(make_csrs(3))
+        ]
+        self.crl_signer = CrlSigner(
+            self.ca_cert, key, {"authorityKeyIdentifier": "keyid:always"}
+        )
+
+    def tearDown(self):
+        self.registry.close()
+        self.directory.cleanup()
+
+    def issue(self, delta=False) -> x509.CertificateRevocationList:
+        crl = x509.load_der_x509_crl(
+            self.registry.issue_crl(CA, self.crl_signer.sign, delta)
+        )
+        self.assertTrue(crl.is_signature_valid(self.ca_cert.public_key()))
+        return crl
+
+    @staticmethod
+    def number(crl: x509.CertificateRevocationList) -> int:
+        return crl.extensions.get_extension_for_class(x509.CRLNumber).value.crl_number
+
+    @staticmethod
+    def revoked(crl: x509.CertificateRevocationList) -> list:
+        return sorted(normalize_serial(entry.serial_number) for entry in crl)
+
+    def test_full_crl(self):
+        self.assertTrue(self.registry.revoke(self.serials[0], "keyCompromise"))
+        self.assertFalse(self.registry.revoke(self.serials[0]))
+        crl = self.issue()
+        self.assertEqual(self.number(crl), 1)
+        self.assertEqual(self.revoked(crl), [self.serials[0]])
+        (entry,) = crl
+        reason = entry.extensions.get_extension_for_class(x509.CRLReason).value
+        self.assertEqual(reason.reason, x509.ReasonFlags.key_compromise)
+        with self.assertRaises(x509.ExtensionNotFound):
+            crl.extensions.get_extension_for_class(x509.DeltaCRLIndicator)
+
+    def test_revoke_unknown(self):
+        with self.assertRaises(KeyError):
+            self.registry.revoke("ABCD")
+        with self.assertRaises(ValueError):
+            self.registry.revoke(self.serials[0], "bogus")
+
+    def test_delta_crl(self):
+        with self.assertRaises(ValueError):  # No full CRL to be a delta of
+            self.registry.issue_crl(CA, self.crl_signer.sign, delta=True)
+        self.registry.revoke(self.serials[0])
+        self.issue()
+        self.registry.revoke(self.serials[1])
+        delta = self.issue(delta=True)
+        self.assertEqual(self.number(delta), 2)
+        indicator = delta.extensions.get_extension_for_class(x509.DeltaCRLIndicator)
+        self.assertTrue(indicator.critical)
+        self.assertEqual(indicator.value.crl_number, 1)
+        self.assertEqual(self.revoked(delta), [self.serials[1]])
+        full = self.issue()
+        self.assertEqual(self.number(full), 3)
+        self.assertEqual(self.revoked(full), sorted(self.serials[:2]))
+
+    def test_failed_sign(self):
+        self.registry.revoke(self.serials[0])
+
+        def sign(number, base, revocations):
+            raise RuntimeError("HSM unreachable")
+
+        with self.assertRaises(RuntimeError):
+            self.registry.issue_crl(CA, sign)
+        crl = self.issue()
+        self.assertEqual(self.number(crl), 1)
+        self.assertEqual(self.revoked(crl), [self.serials[0]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -22,30 +22,22 @@
  */
 """
 
+import os
 import sys
+from multiprocessing import Pool
+from firmware import ChecksumCache, scan_image
 
-# Number of bytes to send in one shot
-CHUNK_SIZE = 1024  # 1 KB
+# Per-chunk checksums precomputed in batch mode
+CHUNK_SIZES = (16 * 1024, 4 * 1024)  # fwUpdate.py, BLE/sensor DFU tools
 
 
-def calculate_checksum(bin_file):
+def calculate_checksum(bin_file, cache=None):
     """ Calculate simple checksum to validate a binary file """
 
-    # Open Binary file
-    binary = open(bin_file, "rb")
-    checksum = 0
-    size = 0
-    while True:  # Calculate CheckSum and Size
-        binary_data = binary.read(CHUNK_SIZE)  # Try reading 'CHUNK_SIZE' bytes
-        if not binary_data:  # Break if nothing is read
-            break
-        binary_data = binary_data.decode("charmap")
-
-        checksum += sum(map(ord, binary_data))  # Update CheckSum
-        size += len(binary_data)  # Update Size
-
-    # Close bin file
-    binary.close()
+    # Calculate CheckSum and Size
+    cache = cache or ChecksumCache()
+    checksum, size = cache.lookup(bin_file)[:2]
+
     print("File                 : " + bin_file)
     print("Checksum [Decimal]   : " + str(checksum))
     print("Checksum [HEX]       : " + hex(checksum))
@@ -55,6 +47,43 @@ def calculate_checksum(bin_file):
     print("Done")
 
 
+def scan_bin_file(bin_file):
+    """ Pool worker, checksums a file for all CHUNK_SIZES """
+    return scan_image(bin_file, CHUNK_SIZES)
+
+
+def calculate_dir_checksums(directory):
+    """ Checksum every binary file of a directory and fill the cache """
+    cache = ChecksumCache()
+    bin_files = sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.endswith(".bin")
+    )
+
+    # Scan files not in cache yet in parallel
+    missing = [
+        bin_file
+        for bin_file in bin_files
+        if any(cache.find(bin_file, chunk_size) is None for chunk_size in CHUNK_SIZES)
+    ]
+    if missing:
+        pool = Pool()
+        try:
+            for result in pool.map(scan_bin_file, missing):
+                cache.store(*result)
+        finally:
+            pool.close()
+            pool.join()
+        cache.save()
+
+    print("{:<12} {:<10} {}".format("CHECKSUM", "SIZE", "FILE"))
+    for bin_file in bin_files:
+        checksum, size = cache.lookup(bin_file)[:2]
+        print("{:<12} {:<10} {}".format(hex(checksum), hex(size), bin_file))
+    print("Done ({} of {} files checksummed)".format(len(missing), len(bin_files)))
+
+
 if __name__ == "__main__":
 
     # Check for Arguments
@@ -62,8 +91,11 @@ if __name__ == "__main__":
         # Print Error Message
         print("\nError: Insufficient Arguments")
         # Print Usage Information
-        print("Expected  Firmware binary filename as arguments")
+        print("Expected  Firmware binary filename or directory as arguments")
         sys.exit()
 
     # calculate checksum
-    calculate_checksum(sys.argv[1])
+    if os.path.isdir(sys.argv[1]):
+        calculate_dir_checksums(sys.argv[1])
+    else:
+        calculate_checksum(sys.argv[1])
@@ -35,7 +35,7 @@ import argparse
 import time
 import json
 import datetime
-import serial
+from transport import SerialTransport, EchoError
 import logging
 
 
@@ -100,6 +100,7 @@ class EveModeSwitch:
     def __init__(self):
         self.com = None
         self.time_now = None
+        self.echo_lockstep = False  # Echo cmd byte by byte (old firmware)
         self.debug = False
 
     def connect(self, com_port, baud):
@@ -107,17 +108,15 @@ class EveModeSwitch:
 
         # Connect to serial COM port with specified configuration
         try:
-            self.com = serial.Serial(
-                port=com_port, baudrate=baud, timeout=self.DEFAULT_RD_TIMEOUT
+            self.com = SerialTransport(
+                com_port, baud, self.DEFAULT_RD_TIMEOUT, self.echo_lockstep
             )
+            self.com.open()
+
             # Print Connection Info to user
             self.time_now = datetime.datetime.now()
             logging.info("\nConnected to AG-55 at: {}".format(time.ctime()))
 
-            # Clear serial port
-            self.com.flushInput()
-            self.com.flushOutput()
-
         except:
             logging.info(
                 "\nFailed to establish connection with AG-55.  Verify COM Port, then contact KT."
@@ -136,29 +135,16 @@ class EveModeSwitch:
 
     def send_cmd(self, cmd):
         """ Send command """
-        # Clear serial port
-        self.com.flushInput()
-        self.com.flushOutput()
-        self.com.timeout = self.DEFAULT_RD_TIMEOUT  # Configure Serial timeout
-        cmd = cmd + "\n"  # Add LF to complete the cmd
-        for wdata in cmd:  # Read Byte from String
-            wdata = wdata.encode("charmap")  # Encode Byte
-            self.com.write(wdata)  # Send Byte
-            rdata = self.com.read(1)  # Read back the byte
-            if rdata != wdata:  # Check EVE is responding ?
-                logging.info("\nAG-55 is not responding!")  # Print error message
-                self.disconnect()  # Disconnect from EVE
-                sys.exit()  # Terminate
-
-        # Read new line printed on ending the cmd
-        self.com.readline()
+        try:
+            self.com.send_cmd(cmd)
+        except EchoError as err:  # Check EVE is responding ?
+            logging.info("\nAG-55 is not responding! ({})".format(err))
+            self.disconnect()  # Disconnect from EVE
+            sys.exit()  # Terminate
 
     def send_data(self, string):
         """ Send raw data """
-        for data in string:  # Read Byte from String
-            data = data.encode("charmap")  # Encode Byte
-            self.com.write(data)  # Send Data Byte
-            self.com.flushOutput()  # Flush Data
+        self.com.write(string)
 
     def reboot_eve(self):
         """ Reboot EVE  """
@@ -170,14 +156,13 @@ class EveModeSwitch:
         """ Handshake with TG Application """
         logging.info("Waiting for handshake.")
         left_time = self.TG_APP_HANDSHAKE_TIMEOUT
-        self.com.flushInput()
-        self.com.flushOutput()
+        self.com.flush()
 
         while left_time > 0:
-            self.com.timeout = left_time  # Configure Serial timeout
             start_time = time.time()  # To check for timeout
-            line = self.com.readline()  # Try to read expected handshake string
-            line.decode("charmap")
+            line = self.com.readline(left_time).decode(
+                "charmap"
+            )  # Try to read expected handshake string
             if self.debug == True:
                 logging.debug(line)  # Ignore, for debug only
             if self.TG_APP_SERIAL_NUMBER_STRING in line:
@@ -200,26 +185,7 @@ class EveModeSwitch:
 
     def read_response(self, timeout):
         """ Read Response """
-        output = ""
-        self.com.timeout = timeout  # Configure Serial timeout
-        line = self.com.readline()  # Read 1st line of Response
-        self.com.timeout = (
-            self.DEFAULT_RD_TIMEOUT
-        )  # Configure Serial timeout to default
-
-        while True:
-            if line == b"{\r\n":  # This is the start of response
-                output = ""  # Clear output
-            elif len(line) == 1 and line == b"$":  # Previous line was end of response
-                try:
-                    return json.loads(output)  # Convert to JSON object
-                except:
-                    return output  # Return Response
-            elif not line:  # No response
-                return output  # Timeout error
-
-            output += line.decode("charmap")  # Part of response, store it
-            line = self.com.readline()  # Read next line of Response
+        return self.com.read_response(timeout)
 
     def parse_response(self, response, module, display, terminate):
         """ Parse the Response and on error terminates program if terminate flag is Set """
@@ -273,14 +239,13 @@ class EveModeSwitch:
         """ Checking Battery Charge """
         logging.info("Waiting for Battery Charge Level.")
         left_time = self.TG_APP_BATTERY_CHECK_TIMEOUT
-        self.com.flushInput()
-        self.com.flushOutput()
+        self.com.flush()
 
         while left_time > 0:
-            self.com.timeout = left_time  # Configure Serial timeout
             start_time = time.time()  # To check for timeout
-            line = self.com.readline()  # Try to read expected handshake string
-            line.decode("charmap")
+            line = self.com.readline(left_time).decode(
+                "charmap"
+            )  # Try to read expected handshake string
             if self.debug == True:
                 logging.debug(line)  # Ignore, for debug only
             if self.TG_APP_SERIAL_NUMBER_STRING in line:
@@ -305,14 +270,13 @@ class EveModeSwitch:
         """ Handshake with TG Application """
         logging.info("Waiting for handshake.")
         left_time = self.TG_APP_HANDSHAKE_TIMEOUT
-        self.com.flushInput()
-        self.com.flushOutput()
+        self.com.flush()
 
         while left_time > 0:
-            self.com.timeout = left_time  # Configure Serial timeout
             start_time = time.time()  # To check for timeout
-            line = self.com.readline()  # Try to read expected handshake string
-            line.decode("charmap")
+            line = self.com.readline(left_time).decode(
+                "charmap"
+            )  # Try to read expected handshake string
             if self.debug == True:
                 logging.debug(line)  # Ignore, for debug only
             if self.TG_APP_SERIAL_NUMBER_STRING in line:
@@ -339,10 +303,9 @@ class EveModeSwitch:
             found_shipment_mode = False
             enter_shipment_mode_success = True
             while left_time > 0:
-                self.com.timeout = left_time  # Configure Serial timeout
                 start_time = time.time()  # To check for timeout
 
-                line = self.com.readline().decode("utf8")
+                line = self.com.readline(left_time).decode("utf8")
 
                 if found_shipment_mode:
                     if "Failed to enter SHIPMENT MODE" in line:
@@ -361,10 +324,8 @@ class EveModeSwitch:
         else:
             left_time = self.ENTER_FACT_MODE_TIMEOUT
             while left_time > 0:
-                self.com.timeout = left_time  # Configure Serial timeout
                 start_time = time.time()  # To check for timeout
-                line = self.com.readline()
-                line.decode("charmap")
+                line = self.com.readline(left_time).decode("charmap")
                 if "Welcome" in line:
                     logging.info("\nSwitched back to FACTORY MODE successfully...!!")
                     return
@@ -425,6 +386,12 @@ if __name__ == "__main__":
     ap = argparse.ArgumentParser()
     ap.add_argument("PORT", help="COM port (Ex: COM10)")
     ap.add_argument("--debug", help="print debug info", required=False)
+    ap.add_argument(
+        "-l",
+        "--lockstep",
+        action="store_true",
+        help="Echo commands byte by byte (for firmware without bulk echo support)",
+    )
 
     args = vars(ap.parse_args())
 
@@ -432,6 +399,7 @@ if __name__ == "__main__":
     signal.signal(signal.SIGINT, signal_handler)
 
     switch_mode = EveModeSwitch()
+    switch_mode.echo_lockstep = args["lockstep"]
 
     if not os.path.exists(".\\Logs"):
         os.makedirs(".\\Logs")
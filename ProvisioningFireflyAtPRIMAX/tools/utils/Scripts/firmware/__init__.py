@@ -0,0 +1,7 @@
+# __init__.py
+from .checksum import data_checksum, chunk_checksums, file_checksum
+from .cache import ChecksumCache, scan_image
+from .qspi import ErasePlan
+from .journal import TransferJournal
+from .flash_state import FlashStateDB
+from .images import ImageStore
@@ -0,0 +1,214 @@
+""" Persistent checksum/size cache of firmware images """
+
+import atexit
+import hashlib
+import json
+import mmap
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from .checksum import chunk_checksums, data_checksum
+
+# Read size used to hash an image
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class FileLock(object):
+    """ Exclusive lock of a file between processes, held while in the block """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, "a+b")
+        if fcntl:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+            return self
+        self.file.seek(0)
+        while True:
+            try:
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+                return self
+            except (IOError, OSError):
+                pass  # LK_LOCK gives up after 10 tries a second apart
+
+    def __exit__(self, *exc_info):
+        if not fcntl:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()  # Also releases the flock
+        self.file = None
+
+
+def write_json(path, data):
+    """ Replace a JSON file in one step, so a crash never leaves half of it """
+    temp_path = "{}.{}-{}.tmp".format(
+        path, os.getpid(), threading.current_thread().ident
+    )
+    try:
+        with open(temp_path, "w") as json_file:
+            json.dump(data, json_file)
+        if hasattr(os, "replace"):
+            os.replace(temp_path, path)
+            return
+        try:
+            os.rename(temp_path, path)
+        except OSError:  # Python 2 on Windows, rename does not overwrite
+            os.remove(path)
+            os.rename(temp_path, path)
+    except (IOError, OSError):
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def scan_image(path, chunk_sizes=()):
+    """
+    Hash and checksum an image in one go, module level so it can run in a pool
+    :param path: Binary file
+    :param chunk_sizes: Chunk sizes to compute per-chunk checksums for
+    :return: (path, stat key, content hash, cache entry)
+    """
+    stat = os.stat(path)
+    key = [stat.st_mtime, stat.st_size]
+    sha = hashlib.sha256()
+    entry = {"checksum": 0, "size": stat.st_size, "chunks": {}}
+    for chunk_size in chunk_sizes:
+        entry["chunks"][str(chunk_size)] = []
+    with open(path, "rb") as binary:
+        if stat.st_size:
+            data = mmap.mmap(binary.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for pos in range(0, len(data), HASH_BLOCK_SIZE):
+                    sha.update(data[pos : pos + HASH_BLOCK_SIZE])
+                entry["checksum"] = data_checksum(data)
+                for chunk_size in chunk_sizes:
+                    entry["chunks"][str(chunk_size)] = chunk_checksums(data, chunk_size)
+            finally:
+                data.close()
+    return os.path.abspath(path), key, sha.hexdigest(), entry
+
+
+class ChecksumCache(object):
+    """
+    Checksum, size and per-chunk checksums of images, kept in a JSON file.
+
+    Images are stored by SHA-256 of their content. A path is only hashed
+    again when its mtime or size changed, so the same image copied around
+    or rebuilt unchanged is not checksummed again. One cache can be shared
+    by the threads of a rack run.
+    """
+
+    VERSION = 1
+    DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".fw_checksum_cache.json")
+    MAX_IMAGES = 64  # Least recently used images are evicted beyond this
+
+    def __init__(self, path=None, max_images=MAX_IMAGES):
+        self.path = path or self.DEFAULT_PATH
+        self.max_images = max_images
+        self.files = {}  # path: [mtime, size, content hash]
+        self.images = {}  # content hash: entry
+        self.dirty = False
+        self.lock = threading.RLock()
+        self.load()
+        atexit.register(self.save)  # Use times of hits are only written here
+
+    def load(self):
+        """ Load the cache file, start empty if missing or unreadable """
+        try:
+            with open(self.path) as cache_file:
+                cache = json.load(cache_file)
+            if cache.get("version") == self.VERSION:
+                self.files = cache["files"]
+                self.images = cache["images"]
+        except (IOError, OSError, ValueError, KeyError):
+            self.files = {}
+            self.images = {}
+
+    def save(self):
+        """ Write the cache file if anything changed """
+        with self.lock:
+            if not self.dirty:
+                return
+            self.evict()
+            cache = {
+                "version": self.VERSION,
+                "files": self.files,
+                "images": self.images,
+            }
+            try:
+                write_json(self.path, cache)
+                self.dirty = False
+            except (IOError, OSError) as err:
+                print(
+                    "Warning: Failed to save checksum cache {} ({})".format(
+                        self.path, err
+                    )
+                )
+
+    def evict(self):
+        """ Drop least recently used images beyond max_images """
+        if len(self.images) <= self.max_images:
+            return
+        by_use = sorted(self.images, key=lambda digest: self.images[digest]["used"])
+        for digest in by_use[: len(self.images) - self.max_images]:
+            del self.images[digest]
+        for path in [p for p, f in self.files.items() if f[2] not in self.images]:
+            del self.files[path]
+
+    def find(self, path, chunk_size):
+        """ Return the cached entry of path if still valid, else None """
+        record = self.files.get(os.path.abspath(path))
+        if record is None:
+            return None
+        stat = os.stat(path)
+        if record[:2] != [stat.st_mtime, stat.st_size]:
+            return None
+        entry = self.images.get(record[2])
+        if entry is None or (chunk_size and str(chunk_size) not in entry["chunks"]):
+            return None
+        return entry
+
+    def store(self, path, key, digest, entry):
+        """ Store the result of scan_image() """
+        cached = self.images.get(digest)
+        if cached:  # Known content, keep the chunk sizes computed before
+            entry["chunks"].update(cached["chunks"])
+        entry["used"] = time.time()
+        self.images[digest] = entry
+        self.files[path] = key + [digest]
+        self.dirty = True
+
+    def lookup(self, path, chunk_size=None):
+        """
+        Get checksum information of an image, computing and saving it on a miss
+        :param path: Binary file
+        :param chunk_size: Also return per-chunk checksums of chunk_size if given
+        :return: (checksum, size, per-chunk checksums or None)
+        """
+        with self.lock:
+            entry = self.find(path, chunk_size)
+            if entry is None:
+                result = scan_image(path, (chunk_size,) if chunk_size else ())
+                self.store(*result)
+                entry = self.images[result[2]]
+                self.save()
+            else:  # Saved with the next miss or at exit
+                entry["used"] = time.time()
+                self.dirty = True
+            chunks = entry["chunks"][str(chunk_size)] if chunk_size else None
+            return entry["checksum"], entry["size"], chunks
+
+    def digest(self, path):
+        """ SHA-256 of the content of an image, computing it on a miss """
+        with self.lock:
+            self.lookup(path)
+            return self.files[os.path.abspath(path)][2]
@@ -0,0 +1,68 @@
+""" Additive firmware checksum (sum of all bytes) used by EVE for validation """
+
+import mmap
+
+try:
+    import numpy
+except ImportError:  # Plain python fallback, ~20x slower but still one pass
+    numpy = None
+
+if bytes is str:  # Python 2 iterates bytes as characters
+
+    def _sum(data):
+        return sum(bytearray(data))
+
+
+else:
+    _sum = sum
+
+
+def data_checksum(data):
+    """ Checksum of bytes, bytearray, memoryview or mmap """
+    if numpy is not None:
+        return int(numpy.frombuffer(data, numpy.uint8).sum(dtype=numpy.uint64))
+    return _sum(data[:])
+
+
+def chunk_checksums(data, chunk_size):
+    """
+    Checksums of consecutive chunks of data in one pass
+    :param data: bytes, bytearray, memoryview or mmap
+    :param chunk_size: Size of each chunk, the last one may be shorter
+    :return: list of checksums, one per chunk
+    """
+    if not len(data):
+        return []
+    if numpy is not None:
+        array = numpy.frombuffer(data, numpy.uint8)
+        full = len(array) - len(array) % chunk_size
+        sums = array[:full].reshape(-1, chunk_size).sum(axis=1, dtype=numpy.uint64)
+        chunks = [int(value) for value in sums.tolist()]
+        if full < len(array):  # Last, shorter chunk
+            chunks.append(int(array[full:].sum(dtype=numpy.uint64)))
+        del array, sums  # Release the buffer before an mmap gets closed
+        return chunks
+    return [
+        _sum(data[pos : pos + chunk_size]) for pos in range(0, len(data), chunk_size)
+    ]
+
+
+def file_checksum(path, chunk_size=None):
+    """
+    Checksum a binary file through a read only mmap
+    :param path: Binary file
+    :param chunk_size: Also return per-chunk checksums of chunk_size if given
+    :return: (checksum, size, per-chunk checksums or None)
+    """
+    with open(path, "rb") as binary:
+        try:
+            data = mmap.mmap(binary.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Empty files can not be mapped
+            return 0, 0, [] if chunk_size else None
+        try:
+            if chunk_size:
+                chunks = chunk_checksums(data, chunk_size)
+                return sum(chunks), len(data), chunks
+            return data_checksum(data), len(data), None
+        finally:
+            data.close()
@@ -0,0 +1,132 @@
+""" Host-side record of the images held in each device's QSPI memory """
+
+import os
+import sqlite3
+import time
+
+
+class FlashStateDB(object):
+    """
+    Images written to the QSPI memory of each device and the firmware
+    versions it last reported, kept in a SQLite file shared by the update
+    tools of a station.
+
+    Images are stored by device CSN and absolute QSPI address. Erasing a
+    range drops every image overlapping it, before the erase is sent, so
+    an image is only reported present if nothing touched it since it was
+    written in full. A device flashed from another station is not known
+    here; tools verify what they skip where EVE offers a way to.
+    """
+
+    DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".fw_flash_state.db")
+    TIMEOUT = 10  # Seconds to wait for another tool holding the file
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS images ("
+        " csn TEXT NOT NULL,"
+        " address INTEGER NOT NULL,"  # Absolute QSPI address
+        " size INTEGER NOT NULL,"
+        " digest TEXT NOT NULL,"  # SHA-256 of the image
+        " region INTEGER,"  # ExMem region and offset the image was sent to
+        " offset INTEGER,"
+        " written REAL NOT NULL,"
+        " PRIMARY KEY (csn, address))",
+        "CREATE TABLE IF NOT EXISTS versions ("
+        " csn TEXT PRIMARY KEY,"
+        " btl TEXT,"
+        " cli TEXT,"
+        " tg_app TEXT,"
+        " updated REAL NOT NULL)",
+    )
+
+    def __init__(self, path=None):
+        self.path = path or self.DEFAULT_PATH
+        self.db = None
+        try:
+            self.db = sqlite3.connect(self.path, timeout=self.TIMEOUT)
+            with self.db:
+                for statement in self.SCHEMA:
+                    self.db.execute(statement)
+        except sqlite3.Error as err:
+            self._failed(err)
+
+    def _failed(self, err):
+        """ Carry on without the database, every image is then unknown """
+        print("Warning: Flash state database {} unusable ({})".format(self.path, err))
+        if self.db:
+            self.db.close()
+        self.db = None
+
+    def _run(self, sql, args=()):
+        """ Run one statement in its own transaction, None on failure """
+        if self.db is None:
+            return None
+        try:
+            with self.db:
+                return self.db.execute(sql, args).fetchall()
+        except sqlite3.Error as err:
+            self._failed(err)
+            return None
+
+    def holds(self, csn, address, digest, size):
+        """ True if the image was written in full at address and not erased since """
+        if csn is None:
+            return False
+        rows = self._run(
+            "SELECT 1 FROM images WHERE csn = ? AND address = ? AND digest = ?"
+            " AND size = ?",
+            (csn, address, digest, size),
+        )
+        return bool(rows)
+
+    def erased(self, csn, start, end):
+        """ Drop the images overlapping [start, end), to call before erasing """
+        if csn is not None:
+            self._run(
+                "DELETE FROM images WHERE csn = ? AND address < ?"
+                " AND address + size > ?",
+                (csn, end, start),
+            )
+
+    def formatted(self, csn):
+        """ Drop every image of a device, to call before formatting its memory """
+        if csn is not None:
+            self._run("DELETE FROM images WHERE csn = ?", (csn,))
+
+    def written(self, csn, address, digest, size, region=None, offset=None):
+        """ Record an image EVE acknowledged in full """
+        if csn is None:
+            return
+        self.erased(csn, address, address + size)
+        self._run(
+            "INSERT INTO images VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (csn, address, size, digest, region, offset, time.time()),
+        )
+
+    def record_versions(self, csn, btl=None, cli=None, tg_app=None):
+        """ Record the versions reported by SYS FW_VER, keeping any not reported """
+        if csn is None:
+            return
+        previous = self.versions(csn) or {}
+        self._run(
+            "INSERT OR REPLACE INTO versions VALUES (?, ?, ?, ?, ?)",
+            (
+                csn,
+                str(btl) if btl is not None else previous.get("btl"),
+                str(cli) if cli is not None else previous.get("cli"),
+                str(tg_app) if tg_app is not None else previous.get("tg_app"),
+                time.time(),
+            ),
+        )
+
+    def versions(self, csn):
+        """ Last versions reported by a device, None if unknown """
+        rows = self._run("SELECT btl, cli, tg_app FROM versions WHERE csn = ?", (csn,))
+        if not rows:
+            return None
+        return dict(zip(("btl", "cli", "tg_app"), rows[0]))
+
+    def close(self):
+        if self.db:
+            self.db.close()
+            self.db = None
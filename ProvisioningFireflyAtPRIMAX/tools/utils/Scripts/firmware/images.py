@@ -0,0 +1,37 @@
+""" Firmware images held in memory, read once for every device of a run """
+
+import os
+import threading
+
+
+class ImageStore(object):
+    """
+    Content of image files, read from disk once and shared by every thread
+    of a rack run. A file is read again if its mtime or size changed.
+    """
+
+    def __init__(self):
+        self.images = {}  # abspath: (mtime, size, content)
+        self.lock = threading.Lock()
+
+    def read(self, path):
+        """ Content of an image file as bytes """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self.lock:
+            image = self.images.get(path)
+            if image is None or image[:2] != (stat.st_mtime, stat.st_size):
+                with open(path, "rb") as binary:
+                    image = (stat.st_mtime, stat.st_size, binary.read())
+                self.images[path] = image
+            return image[2]
+
+    def load(self, paths):
+        """ Read the images a run needs before the devices start """
+        for path in paths:
+            self.read(path)
+
+    @property
+    def size(self):
+        """ Bytes held """
+        return sum(image[1] for image in self.images.values())
@@ -0,0 +1,231 @@
+""" On-disk journal of firmware transfers, to resume them after a link drop """
+
+import atexit
+import json
+import os
+import threading
+import time
+
+from .cache import FileLock, write_json
+
+
+def _merge(ranges):
+    """ Sort and merge [start, end] ranges """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+class Transfer(object):
+    """
+    Progress of one image transfer to one device: whether its erase
+    completed and which byte ranges EVE acknowledged. When attached to a
+    journal, erase and reset are saved at once but acks only every
+    SAVE_CHUNKS acks or SAVE_INTERVAL seconds, on flush() and at exit. A
+    resumed transfer sends the unsaved acked bytes again, which rewrites
+    the same data to the erased memory
+    """
+
+    SAVE_CHUNKS = 32  # Acks between saves of the journal
+    SAVE_INTERVAL = 2.0  # Seconds between saves of the journal
+
+    def __init__(self, journal, key, entry):
+        self.journal = journal  # None if the device could not be identified
+        self.key = key
+        self.entry = entry
+        self.resumed = entry["erased"]  # An earlier run got past the erase
+        self.unsaved = 0  # Acks not in the journal file yet
+        self.saved = time.time()
+
+    @property
+    def erased(self):
+        return self.entry["erased"]
+
+    @property
+    def acked_bytes(self):
+        return sum(end - start for start, end in self.entry["acked"])
+
+    def mark_erased(self):
+        """ The memory the image goes to is erased, writes may start """
+        self.entry["erased"] = True
+        self._save()
+
+    def reset(self):
+        """ Start over, the memory is to be erased again """
+        self.entry["erased"] = False
+        self.entry["acked"] = []
+        self.resumed = False
+        self._save()
+
+    def ack(self, start, end):
+        """ EVE acknowledged the bytes from start to end """
+        self.entry["acked"] = _merge(self.entry["acked"] + [[start, end]])
+        if not self.journal:
+            return
+        self.unsaved += 1
+        if (
+            self.unsaved >= self.SAVE_CHUNKS
+            or time.time() - self.saved >= self.SAVE_INTERVAL
+        ):
+            self._save()
+        else:
+            with self.journal.lock:
+                self.journal.changed.add(self.key)
+
+    def flush(self):
+        """ Save the acks not saved yet, at the end of a send or on an error """
+        if self.unsaved:
+            self._save()
+
+    def pending(self, start, end):
+        """ Return the (start, end) ranges in [start, end) not acknowledged yet """
+        ranges = []
+        for acked_start, acked_end in self.entry["acked"]:
+            if acked_end <= start or acked_start >= end:
+                continue
+            if acked_start > start:
+                ranges.append((start, acked_start))
+            start = max(start, acked_end)
+        if start < end:
+            ranges.append((start, end))
+        return ranges
+
+    def done(self):
+        """ The image is in place and the update sequence completed """
+        if self.journal:
+            self.journal.discard(self.key)
+
+    def _save(self):
+        if self.journal:
+            with self.journal.lock:
+                self.entry["updated"] = time.time()
+                self.journal.transfers[self.key] = self.entry
+                self.journal.changed.add(self.key)
+                self.journal.save()
+            self.unsaved = 0
+            self.saved = time.time()
+
+
+class TransferJournal(object):
+    """
+    Transfers in progress, kept in a JSON file and keyed by device CSN,
+    SHA-256 of the image and target offset. A transfer is dropped once
+    completed, when another image is started at the same offset of the same
+    device, or when it has not been touched for MAX_AGE. Thread safe, so a
+    rack run shares one journal across ports, and processes sharing the
+    file keep each other's transfers: a save merges only the keys this
+    process set or dropped into what the file holds.
+    """
+
+    VERSION = 1
+    DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".fw_transfer_journal.json")
+    MAX_AGE = 7 * 24 * 3600  # Seconds before a stale transfer is dropped
+
+    def __init__(self, path=None):
+        self.path = path or self.DEFAULT_PATH
+        self.transfers = {}  # key: entry
+        self.changed = set()  # Keys set or dropped since the last save
+        self.wiped = set()  # Key prefixes of devices wiped since the last save
+        self.lock = threading.RLock()
+        self.load()
+        atexit.register(self.flush)
+
+    def _read(self):
+        """ Unexpired transfers in the journal file, none if missing or unreadable """
+        try:
+            with open(self.path) as journal_file:
+                journal = json.load(journal_file)
+            if journal.get("version") != self.VERSION:
+                return {}
+            transfers = journal["transfers"]
+        except (IOError, OSError, ValueError, KeyError):
+            return {}
+        expired = time.time() - self.MAX_AGE
+        return dict((k, e) for k, e in transfers.items() if e["updated"] >= expired)
+
+    def load(self):
+        """ Load the journal file, start empty if missing or unreadable """
+        with self.lock:
+            self.transfers = self._read()
+            self.changed = set()
+            self.wiped = set()
+
+    def save(self):
+        """
+        Write the keys this process set or dropped since the last save over
+        what the file holds now, under a lock between processes. The file is
+        replaced in one step, so a reader never sees half of it
+        """
+        with self.lock:
+            try:
+                with FileLock(self.path + ".lock"):
+                    transfers = self._read()
+                    for key in list(transfers):
+                        if key.split(":", 1)[0] + ":" in self.wiped:
+                            del transfers[key]
+                    for key in self.changed:
+                        if key in self.transfers:
+                            transfers[key] = self.transfers[key]
+                        else:
+                            transfers.pop(key, None)
+                    write_json(
+                        self.path, {"version": self.VERSION, "transfers": transfers}
+                    )
+                self.changed = set()
+                self.wiped = set()
+            except (IOError, OSError) as err:
+                print(
+                    "Warning: Failed to save transfer journal {} ({})".format(
+                        self.path, err
+                    )
+                )
+
+    def flush(self):
+        """ Save the acks and drops not saved yet """
+        with self.lock:
+            if self.changed or self.wiped:
+                self.save()
+
+    def open(self, csn, digest, offset, size):
+        """
+        Get the transfer of an image to a device, resuming a journaled one
+        :param csn: Device CSN, None to not journal the transfer
+        :param digest: SHA-256 of the image
+        :param offset: Target offset of the image
+        :param size: Image size
+        :return: Transfer
+        """
+        entry = {"erased": False, "acked": [], "size": size, "updated": time.time()}
+        if csn is None:
+            return Transfer(None, None, entry)
+
+        key = "{}:{}:{:x}".format(csn, digest, offset)
+        with self.lock:
+            for other in list(self.transfers):  # Anything else there is overwritten
+                if other != key and other.startswith(str(csn) + ":"):
+                    if other.endswith(":{:x}".format(offset)):
+                        del self.transfers[other]
+                        self.changed.add(other)
+            entry = self.transfers.get(key, entry)
+            self.transfers[key] = entry
+            self.changed.add(key)
+        return Transfer(self, key, entry)
+
+    def discard_device(self, csn):
+        """ Drop every transfer to a device, its memory was wiped """
+        prefix = str(csn) + ":"
+        with self.lock:
+            for key in [key for key in self.transfers if key.startswith(prefix)]:
+                del self.transfers[key]
+            self.wiped.add(prefix)
+            self.save()
+
+    def discard(self, key):
+        with self.lock:
+            if self.transfers.pop(key, None) is not None:
+                self.changed.add(key)
+                self.save()
@@ -0,0 +1,99 @@
+""" Planning of QSPI erases for the byte ranges a transfer will write """
+
+SECTOR_SIZE = 4 * 1024  # Erased by "QSPI SEC_ER 1"
+BLOCK_SIZE = 64 * 1024  # Erased by "QSPI SEC_ER 2"
+ERASE_ARGS = {SECTOR_SIZE: 1, BLOCK_SIZE: 2}  # Erase size: SEC_ER argument
+
+# Expected seconds per erase cmd, typical QSPI NOR erase times plus a cmd
+# round trip. Used to pick between erases and to report the expected time
+ERASE_TIME = {SECTOR_SIZE: 0.05 + 0.02, BLOCK_SIZE: 0.2 + 0.02}
+
+
+def _align(address, size):
+    return address - address % size
+
+
+def _spans(ranges, size):
+    """ Merge (start, end) ranges into sorted spans aligned out to size """
+    spans = []
+    for start, end in sorted(ranges):
+        if end <= start:
+            continue
+        start = _align(start, size)
+        end = _align(end + size - 1, size)
+        if spans and start <= spans[-1][1]:
+            spans[-1][1] = max(spans[-1][1], end)
+        else:
+            spans.append([start, end])
+    return spans
+
+
+def _within(start, end, spans):
+    """ True if [start, end) lies in one of spans """
+    return any(span[0] <= start and end <= span[1] for span in spans)
+
+
+class ErasePlan(object):
+    """
+    Erase cmds covering the byte ranges to be written: 64 KB block erases
+    for the blocks they fill and 4 KB sector erases at their edges. A block
+    that is only partly written is still erased whole when that is quicker
+    and the whole block lies in a region that may be erased
+    """
+
+    def __init__(self, ranges, erasable=()):
+        """
+        :param ranges: (start, end) byte ranges that will be written
+        :param erasable: (start, end) regions that may be erased beyond them,
+            Ex: the region reserved for the image
+        """
+        self.erases = []  # (erase size, address) in address order
+        allowed = _spans(erasable, 1)
+        blocks = {}  # Block address: addresses of sectors to be written
+        for start, end in _spans(ranges, SECTOR_SIZE):
+            for address in range(start, end, SECTOR_SIZE):
+                blocks.setdefault(_align(address, BLOCK_SIZE), []).append(address)
+
+        for block, sectors in sorted(blocks.items()):
+            if len(sectors) * SECTOR_SIZE == BLOCK_SIZE or (
+                len(sectors) * ERASE_TIME[SECTOR_SIZE] > ERASE_TIME[BLOCK_SIZE]
+                and _within(block, block + BLOCK_SIZE, allowed)
+            ):
+                self.erases.append((BLOCK_SIZE, block))
+            else:
+                self.erases.extend((SECTOR_SIZE, address) for address in sectors)
+
+    def __iter__(self):
+        """ Yield (SEC_ER argument, address) of each erase """
+        for size, address in self.erases:
+            yield ERASE_ARGS[size], address
+
+    def __len__(self):
+        return len(self.erases)
+
+    def count(self, size):
+        return sum(1 for erase in self.erases if erase[0] == size)
+
+    @property
+    def seconds(self):
+        """ Expected time to run the plan """
+        return sum(ERASE_TIME[size] for size, _ in self.erases)
+
+    @property
+    def extent(self):
+        """ (start, end) of the memory the plan erases, None if empty """
+        if not self.erases:
+            return None
+        return self.erases[0][1], max(address + size for size, address in self.erases)
+
+    @property
+    def bytes(self):
+        return sum(size for size, _ in self.erases)
+
+    def __str__(self):
+        return "{} x 64 KB + {} x 4 KB erases ({} KB), expected {:.1f}s".format(
+            self.count(BLOCK_SIZE),
+            self.count(SECTOR_SIZE),
+            self.bytes // 1024,
+            self.seconds,
+        )
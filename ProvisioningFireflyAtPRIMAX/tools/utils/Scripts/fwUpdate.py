@@ -38,7 +38,16 @@ import time
 import argparse
 import re
 import datetime
-import serial
+from transport import SerialTransport, EchoError, ChunkedWriter, WindowedSender
+from transport import ChunkSizer
+from firmware import (
+    ChecksumCache,
+    ErasePlan,
+    FlashStateDB,
+    ImageStore,
+    TransferJournal,
+    data_checksum,
+)
 
 
 class EveFwUpdate:
@@ -46,10 +55,14 @@ class EveFwUpdate:
 
     # Number of bytes to send in one shot
     CHUNK_SIZE = 16 * 1024  # Must be <= fw_updateCliBUFF_SIZE
+    MIN_CHUNK_SIZE = 1024  # Smallest chunk to shrink to on a failing link
 
     # Number of retries
     RE_TRY_COUNT = 3
 
+    # WR_FW chunks in flight, > 1 needs firmware that buffers the next WR_FW
+    WR_FW_WINDOW = 1  # 1 is stop and wait
+
     # TimeOuts in seconds
     SEC_ERASE_TIMEOUT = 2  # To wait for sector erase to get complete
     WR_FW_TIMEOUT = 30  # To transfer CHUNK_SIZE bytes
@@ -85,13 +98,14 @@ class EveFwUpdate:
     CMD_VER_MCU_CHKSM = "VER_MCU_CHECKSUM"
 
     QSPI_MODULE_NAME = "QSPI"
-    CMD_QSPI_SEC_ERASE = "SEC_ER"
-    QSPI_SEC_SIZE = 64 * 1024  # 64 KB Sector
-    QSPI_SEC_ARG = 2  # Argument to be passed to erase QSPI_SEC_SIZE sector
+    CMD_QSPI_SEC_ERASE = "SEC_ER"  # 4 KB or 64 KB, see firmware.qspi
 
     EXMEM_MODULE_NAME = "EXMEM"
     CMD_EXMEM_FORMAT = "FORMAT"
 
+    SN_MODULE_NAME = "SN"
+    CMD_RD_CSN = "RD_CSN"
+
     SYS_MODULE_NAME = "SYS"
     CMD_REBOOT = "REBOOT"
     CMD_FW_VER = "FW_VER"
@@ -131,6 +145,17 @@ class EveFwUpdate:
         self.bin_info = []
         self.mode = mode
         self.operation = operation
+        self.echo_lockstep = False  # Echo cmd byte by byte (old firmware)
+        self.show_stats = False  # Print cmd latency counters on disconnect
+        self.write_block_size = ChunkedWriter.BLOCK_SIZE  # Bytes per write()
+        self.write_pace = 0.0  # Seconds to wait between written blocks
+        self.wr_fw_window = self.WR_FW_WINDOW  # WR_FW chunks in flight
+        self.checksum_cache = ChecksumCache()
+        self.images = ImageStore()  # Binary files read once
+        self.chunk_sizer = ChunkSizer(self.CHUNK_SIZE, self.MIN_CHUNK_SIZE)
+        self.journal = TransferJournal()  # To resume interrupted transfers
+        self.flash_state = FlashStateDB()  # Images already in EVE's memory
+        self.csn = None  # Identifies EVE in the journal and flash state
         if operation == self.OP_SMT_SIMULATE:
             self.mode = self.EVE_MODES[0]
 
@@ -139,19 +164,18 @@ class EveFwUpdate:
 
         # Connect to serial COM port with specified configuration
         try:
-            self.com = serial.Serial(
-                port=com_port, baudrate=baud, timeout=self.DEFAULT_RD_TIMEOUT
+            self.com = SerialTransport(
+                com_port, baud, self.DEFAULT_RD_TIMEOUT, self.echo_lockstep
             )
+            self.com.open()
+            self.com.writer.block_size = self.write_block_size
+            self.com.writer.pace = self.write_pace
 
             # Print Connection Info to user
             self.time_now = datetime.datetime.now()
             print("\n{} Connected to EVE".format(time.ctime()))
             print(self.com)
 
-            # Clear serial port
-            self.com.flushInput()
-            self.com.flushOutput()
-
             # Perform handshake if EVE is in TG_AP mode
             if self.mode == self.EVE_MODES[1]:
                 if self.tg_app_handshake() != self.RESP_VALUES[0]:
@@ -170,6 +194,10 @@ class EveFwUpdate:
         """ Disconnects the connection between EVE and the PC """
         if self.com:
             self.com.close()
+            if self.show_stats:
+                print("\n" + "\n".join(self.com.stats.report()))
+                print("\n" + "\n".join(self.chunk_sizer.report()))
+                print(self.com.writer)
             print(
                 "\nDisconnected after {}".format(
                     str(datetime.datetime.now() - self.time_now)
@@ -328,6 +356,10 @@ class EveFwUpdate:
                 self.mode, self.cur_ver[1], self.cur_ver[0]
             )
         )
+        msg = (resp[self.SYS_MODULE_NAME])["MSG"]
+        self.flash_state.record_versions(
+            self.get_csn(), msg.get("BTL"), msg.get("CLI"), msg.get("TG_APP")
+        )
         return True
 
     def get_tg_app_ver(self):
@@ -571,6 +603,9 @@ class EveFwUpdate:
             write_offset += self.MAX_APP_FW_SIZE
             erase_offset += self.MAX_APP_FW_SIZE
 
+        present = self.in_memory(self.bin_info[inf_pos], erase_offset)
+        transfer = self.open_transfer(self.bin_info[inf_pos], write_offset)
+
         # Send Firmware Information
         self.send_fw_info(
             self.bin_info[inf_pos],
@@ -580,14 +615,30 @@ class EveFwUpdate:
             self.APP_FW_INT_FLASH_REGION,
         )
 
-        # Erase Memory
-        self.erase_exmemory(erase_offset, self.bin_info[inf_pos][3])
+        if not present:
+            # Erase Memory, unless an interrupted transfer already did
+            if not transfer.erased:
+                self.erase_exmemory(
+                    erase_offset, self.bin_info[inf_pos][3], self.MAX_APP_FW_SIZE
+                )
+                transfer.mark_erased()
 
-        # Send Firmware
-        self.send_binary(self.bin_info[inf_pos][2], write_offset)
+            # Send Firmware
+            self.send_binary(self.bin_info[inf_pos][2], write_offset, transfer)
+            self.record_written(
+                self.bin_info[inf_pos],
+                erase_offset,
+                self.mem_det[inf_pos][1],
+                write_offset,
+            )
+
+        # Verify checksum of an image not written in one go by this run
+        if present or transfer.resumed:
+            self.verify_checksum(transfer, erase_offset, self.bin_info[inf_pos][3])
 
         # Initiate Update
         self.set_update_flag()
+        transfer.done()
 
         # Re-Boot EVE
         self.reboot_eve()
@@ -595,6 +646,10 @@ class EveFwUpdate:
     def btl_fw_update(self, inf_pos, warn, reboot):
         """ Function to update Boot-loader firmware  """
 
+        # UPDATE_BTL checks the image against the info, also when not sent
+        present = self.in_memory(self.bin_info[inf_pos], self.mem_det[inf_pos][3])
+        transfer = self.open_transfer(self.bin_info[inf_pos], self.mem_det[inf_pos][2])
+
         # Send Firmware Information
         self.send_fw_info(
             self.bin_info[inf_pos],
@@ -604,11 +659,26 @@ class EveFwUpdate:
             self.BTL_FW_INT_FLASH_REGION,
         )
 
-        # Erase Memory
-        self.erase_exmemory(self.mem_det[inf_pos][3], self.bin_info[inf_pos][3])
+        if not present:
+            # Erase Memory, unless an interrupted transfer already did
+            if not transfer.erased:
+                self.erase_exmemory(
+                    self.mem_det[inf_pos][3],
+                    self.bin_info[inf_pos][3],
+                    self.MAX_BTL_FW_SIZE,
+                )
+                transfer.mark_erased()
 
-        # Send Firmware
-        self.send_binary(self.bin_info[inf_pos][2], self.mem_det[inf_pos][2])
+            # Send Firmware
+            self.send_binary(
+                self.bin_info[inf_pos][2], self.mem_det[inf_pos][2], transfer
+            )
+            self.record_written(
+                self.bin_info[inf_pos],
+                self.mem_det[inf_pos][3],
+                self.mem_det[inf_pos][1],
+                self.mem_det[inf_pos][2],
+            )
 
         # Warn use if required
         if warn:
@@ -618,9 +688,22 @@ class EveFwUpdate:
         print("\nUpdating Boot-loader....... ")
         self.send_cmd(self.FW_UP_MODULE_NAME + " " + self.CMD_UPDATE_BTL)
 
-        # Read and Parse the Response
+        # Read and Parse the Response, the image is not trusted again on failure
         resp = self.read_response(self.BTL_UPDATE_TIMEOUT)
-        self.parse_response(resp, self.FW_UP_MODULE_NAME, True, True)
+        if (
+            self.parse_response(resp, self.FW_UP_MODULE_NAME, True, False)
+            != self.RESP_VALUES[0]
+        ):
+            print("\nError: Boot-loader update failed, run again to transfer it again")
+            self.flash_state.erased(
+                self.get_csn(),
+                self.mem_det[inf_pos][3],
+                self.mem_det[inf_pos][3] + self.bin_info[inf_pos][3],
+            )
+            transfer.reset()
+            self.disconnect()
+            sys.exit()
+        transfer.done()
 
         print("Done")
 
@@ -628,6 +711,69 @@ class EveFwUpdate:
         if reboot:
             self.reboot_eve()
 
+    def get_csn(self):
+        """ Read the CSN identifying EVE in journal and flash state, None if unknown """
+        if self.csn is None:
+            self.send_cmd(self.SN_MODULE_NAME + " " + self.CMD_RD_CSN)
+            resp = self.read_response(self.DEFAULT_RD_TIMEOUT)
+            try:
+                self.csn = str(((resp[self.SN_MODULE_NAME])["MSG"])["INFO"])
+            except (KeyError, TypeError):
+                print("\nWarning: Unable to read CSN, transfer can't be resumed")
+        return self.csn
+
+    def open_transfer(self, bin_info, offset):
+        """ Get the journaled transfer of a firmware to EVE """
+        transfer = self.journal.open(
+            self.get_csn(), self.checksum_cache.digest(bin_info[2]), offset, bin_info[3]
+        )
+        if transfer.resumed:
+            print(
+                "\nResuming interrupted transfer, {} of {} bytes already sent".format(
+                    transfer.acked_bytes, bin_info[3]
+                )
+            )
+        return transfer
+
+    def in_memory(self, bin_info, address):
+        """ True if EVE's external memory already holds the firmware at address """
+        present = self.flash_state.holds(
+            self.get_csn(),
+            address,
+            self.checksum_cache.digest(bin_info[2]),
+            bin_info[3],
+        )
+        if present:
+            print("\nFirmware already in external memory, skipping erase and transfer")
+        return present
+
+    def record_written(self, bin_info, address, exmem_region, exmem_offset):
+        """ Record firmware EVE acknowledged in full at address """
+        self.flash_state.written(
+            self.get_csn(),
+            address,
+            self.checksum_cache.digest(bin_info[2]),
+            bin_info[3],
+            exmem_region,
+            exmem_offset,
+        )
+
+    def verify_checksum(self, transfer, address, size):
+        """ Verify checksum of the firmware in memory, start over on mismatch """
+        print("\nVerifying checksum")
+        self.send_cmd(self.FW_UP_MODULE_NAME + " " + self.CMD_VER_MCU_CHKSM)
+        resp = self.read_response(self.VER_FW_CHECKSUM_TIMEOUT)
+        if (
+            self.parse_response(resp, self.FW_UP_MODULE_NAME, True, False)
+            != self.RESP_VALUES[0]
+        ):
+            print("\nError: Checksum mismatch, run again to transfer from scratch")
+            transfer.reset()
+            self.flash_state.erased(self.get_csn(), address, address + size)
+            self.disconnect()
+            sys.exit()
+        print("Done")
+
     def warn_user(self):
         """ Function to warn user in critical cases and get user confirmation """
         # Print warning message
@@ -656,9 +802,8 @@ class EveFwUpdate:
         print("Waiting for handshake........")
         left_time = self.TG_APP_HANDSHAKE_TIMEOUT
         while left_time > 0:
-            self.com.timeout = left_time  # Configure Serial timeout
             start_time = time.time()  # To check for timeout
-            line = self.com.readline().decode(
+            line = self.com.readline(left_time).decode(
                 "utf-8"
             )  # Try to read expected handshake string
             print(line)  # Ignore, for debug only
@@ -681,10 +826,8 @@ class EveFwUpdate:
         """ Function to check whether application is in position to communicate or not"""
         left_time = timeout
         while left_time > 0:
-            self.com.timeout = left_time  # Configure Serial timeout
             start_time = time.time()  # To check for timeout
-            line = self.com.readline()
-            line.decode("charmap")
+            line = self.com.readline(left_time).decode("charmap")
             if look_for in line:
                 return self.RESP_VALUES[0]
 
@@ -696,9 +839,9 @@ class EveFwUpdate:
         """ Process operation requested from user """
         if self.operation == self.OP_FW_UPDATE:
             # Verify all dependencies are met or not
-            if update.check_dependencies():
+            if self.check_dependencies():
                 # Update firmware/s as requested
-                update.update_fw()
+                self.update_fw()
             return
 
         # Read current firmware version
@@ -734,6 +877,9 @@ class EveFwUpdate:
         else:
             # Prepare Memory for SMT simulation
             print("\nPreparing external memory for SMT.......")
+            if self.get_csn() is not None:  # Nothing survives the format
+                self.flash_state.formatted(self.csn)
+                self.journal.discard_device(self.csn)
             self.send_cmd(self.EXMEM_MODULE_NAME + " " + self.CMD_EXMEM_FORMAT)
             resp = self.read_response(self.EXMEM_FORMAT_TIMEOUT)
             self.parse_response(resp, self.EXMEM_MODULE_NAME, True, True)
@@ -756,6 +902,12 @@ class EveFwUpdate:
             self.send_cmd(self.FW_UP_MODULE_NAME + " " + self.CMD_VER_MCU_CHKSM)
             resp = self.read_response(self.VER_FW_CHECKSUM_TIMEOUT)
             self.parse_response(resp, self.FW_UP_MODULE_NAME, True, True)
+            self.record_written(
+                self.bin_info[0],
+                cur_dep_det[3] + self.MAX_BTL_FW_SIZE,
+                cur_dep_det[1],
+                cur_dep_det[2] + self.MAX_BTL_FW_SIZE,
+            )
             print("Done")
 
             # Send Firmware Information
@@ -778,6 +930,12 @@ class EveFwUpdate:
             self.send_cmd(self.FW_UP_MODULE_NAME + " " + self.CMD_VER_MCU_CHKSM)
             resp = self.read_response(self.VER_FW_CHECKSUM_TIMEOUT)
             self.parse_response(resp, self.FW_UP_MODULE_NAME, True, True)
+            self.record_written(
+                self.bin_info[1],
+                cur_dep_det[3] + self.MAX_BTL_FW_SIZE + self.MAX_APP_FW_SIZE,
+                cur_dep_det[1],
+                cur_dep_det[2] + self.MAX_BTL_FW_SIZE + self.MAX_APP_FW_SIZE,
+            )
             print("Done")
 
             print("\nTransfer complete")
@@ -785,21 +943,7 @@ class EveFwUpdate:
 
     def calculate_checksum(self, bin_file):
         """ Function to calculate checksum of given binary file """
-        # Open Binary file
-        binary = open(bin_file, "rb")
-        checksum = 0
-        while True:  # Calculate CheckSum
-            binary_data = binary.read(self.CHUNK_SIZE)  # Try reading 'CHUNK_SIZE' bytes
-            if not binary_data:  # Break if nothing is read
-                break
-            binary_data = binary_data.decode("charmap")
-
-            checksum += sum(map(ord, binary_data))  # Update CheckSum
-
-        # Close bin file
-        binary.close()
-
-        return checksum
+        return self.checksum_cache.lookup(bin_file)[0]
 
     def send_fw_info(
         self, bin_info, info_cmd, exmem_region, exmem_offset, intflash_region
@@ -857,18 +1001,29 @@ class EveFwUpdate:
 
         print("Done")
 
-    def erase_exmemory(self, start_address, size):
-        """ Erase the memory required to store firmware """
+    def erase_exmemory(self, start_address, size, reserved=None):
+        """
+        Erase the memory required to store firmware
+        :param reserved: Bytes reserved for the firmware at start_address, may
+            be erased beyond size where a 64 KB erase is quicker
+        """
+        plan = ErasePlan(
+            [(start_address, start_address + size)],
+            [(start_address, start_address + (reserved or size))],
+        )
         print("\nErasing Memory.................")
+        print(plan)
+        if plan.extent:
+            self.flash_state.erased(self.get_csn(), *plan.extent)
 
-        for sector in range(start_address, start_address + size, self.QSPI_SEC_SIZE):
+        for sec_arg, sector in plan:
             # Erase Sector
             self.send_cmd(
                 self.QSPI_MODULE_NAME
                 + " "
                 + self.CMD_QSPI_SEC_ERASE
                 + " "
-                + str(self.QSPI_SEC_ARG)
+                + str(sec_arg)
                 + " "
                 + ("%x" % sector)
             )
@@ -879,66 +1034,119 @@ class EveFwUpdate:
 
         print("Done")
 
-    def send_binary(self, bin_file, offset):
-        """ Send firmware to EVE's External Memory """
+    def send_binary(self, bin_file, offset, transfer=None):
+        """
+        Send firmware to EVE's External Memory
+        :param transfer: Journaled transfer, to send only what EVE did not
+            acknowledge yet and to record what it acknowledges
+        """
 
-        # Open Binary file
-        binary = open(bin_file, "rb")
+        # Read Binary file and get checksum of each chunk up front (cached)
+        binary = self.images.read(bin_file)
+        checksums = self.checksum_cache.lookup(bin_file, self.CHUNK_SIZE)[2]
+        if transfer is None:
+            transfer = self.journal.open(None, None, offset, len(binary))
 
         print("\nSending Firmware.............")
-        # Send Binary to EVE in chunks of 'CHUNK_SIZE' bytes
-        while True:
-            binary_data = binary.read(self.CHUNK_SIZE)  # Try reading 'CHUNK_SIZE' bytes
-            if not binary_data:  # Break if nothing is read
-                break
-
-            # Calculate checksum of the chunk
-            binary_data = binary_data.decode("charmap")
-            checksum = sum(map(ord, binary_data))
-
-            # Form command to be sent
-            cmd = (
-                self.FW_UP_MODULE_NAME
-                + " "
-                + self.CMD_WR_FW
-                + " "
-                + ("%x" % checksum)
-                + " "
-                + ("%x" % offset)
-                + " "
-                + str(len(binary_data))
-            )
+        chunks = []
+        chunk_checksums = {}  # offset: checksum
+        for pos, checksum in zip(range(0, len(binary), self.CHUNK_SIZE), checksums):
+            binary_data = binary[pos : pos + self.CHUNK_SIZE]
+
+            # Only the parts EVE did not acknowledge in an earlier run
+            for start, end in transfer.pending(offset, offset + len(binary_data)):
+                piece = binary_data[start - offset : end - offset]
+                if len(piece) != len(binary_data):
+                    checksum = data_checksum(piece)
+                chunk_checksums[start] = checksum
+                chunks.append(
+                    (start, self.wr_fw_cmd(checksum, start, len(piece)), piece)
+                )
 
             # Update Offset Value
             offset += len(binary_data)
 
-            for retry in range(1, self.RE_TRY_COUNT + 1, 1):
-                # Send CMD
-                self.send_cmd(cmd)
-
-                # Send Binary read
-                self.send_data(binary_data)
+        try:
+            # Keep several chunks in flight if the firmware supports it
+            if self.wr_fw_window > 1:
+                sender = WindowedSender(
+                    self.com,
+                    self.wr_fw_window,
+                    self.FW_UP_MODULE_NAME,
+                    self.WR_FW_TIMEOUT,
+                    self.RE_TRY_COUNT,
+                )
+                chunks = sender.send(chunks, transfer.ack)
+                if chunks:  # Firmware can't keep up, don't try again
+                    print(
+                        "Windowed transfer stopped ({}), sending {} chunks one by"
+                        " one".format(sender.error, len(chunks))
+                    )
+                    self.wr_fw_window = 1
 
-                # Read and Parse the Response
-                resp = self.read_response(self.WR_FW_TIMEOUT)
+            # Send Binary to EVE in chunks of 'CHUNK_SIZE' bytes, one at a time
+            for offset, _, binary_data in chunks:
+                self.send_chunk(offset, binary_data, chunk_checksums[offset], transfer)
+        finally:  # What EVE took so far, also when giving up
+            transfer.flush()
 
-                if retry == self.RE_TRY_COUNT:  # Is this last try
-                    resp_value = self.parse_response(
-                        resp, self.FW_UP_MODULE_NAME, True, True
-                    )  # Terminate on failure
-                else:
-                    resp_value = self.parse_response(
-                        resp, self.FW_UP_MODULE_NAME, True, False
-                    )  # Do not terminate here on failure
+        print("Done ({:.1f} KB/s)".format(self.com.writer.rate / 1024))
 
-                # Break on success
-                if resp_value == self.RESP_VALUES[0]:
-                    break
+    def wr_fw_cmd(self, checksum, offset, size):
+        """ Form WR_FW command """
+        return (
+            self.FW_UP_MODULE_NAME
+            + " "
+            + self.CMD_WR_FW
+            + " "
+            + ("%x" % checksum)
+            + " "
+            + ("%x" % offset)
+            + " "
+            + str(size)
+        )
 
-        # Close bin file
-        binary.close()
+    def send_chunk(self, offset, binary_data, checksum, transfer):
+        """
+        Send one chunk, in smaller pieces while the link keeps failing (see
+        transport.sizing). Terminates once a piece of MIN_CHUNK_SIZE fails
+        RE_TRY_COUNT times
+        """
+        pos = 0
+        failures = 0  # Of the current piece at MIN_CHUNK_SIZE
+        while pos < len(binary_data):
+            at_min = self.chunk_sizer.at_min
+            piece = binary_data[pos : pos + self.chunk_sizer.size]
+            if len(piece) != len(binary_data):
+                piece_checksum = data_checksum(piece)
+            else:
+                piece_checksum = checksum
+
+            start = time.time()
+            # Send CMD
+            self.send_cmd(self.wr_fw_cmd(piece_checksum, offset + pos, len(piece)))
+
+            # Send Binary read
+            self.send_data(piece)
+
+            # Read and Parse the Response, terminate on failure of last try
+            resp = self.read_response(self.WR_FW_TIMEOUT)
+            resp_value = self.parse_response(
+                resp,
+                self.FW_UP_MODULE_NAME,
+                True,
+                at_min and failures + 1 >= self.RE_TRY_COUNT,
+            )
+            passed = resp_value == self.RESP_VALUES[0]
+            self.chunk_sizer.record(len(piece), passed, time.time() - start)
 
-        print("Done")
+            if passed:
+                transfer.ack(offset + pos, offset + pos + len(piece))
+                pos += len(piece)
+                failures = 0
+            else:
+                failures += 1 if at_min else 0
+                print("Retrying with {} byte chunks".format(self.chunk_sizer.size))
 
     def set_update_flag(self):
         """ Initiate application Firmware update """
@@ -953,51 +1161,21 @@ class EveFwUpdate:
 
     def send_cmd(self, cmd):
         """ Send command """
-        # Clear serial port
-        self.com.flushInput()
-        self.com.flushOutput()
-        self.com.timeout = self.DEFAULT_RD_TIMEOUT  # Configure Serial timeout
-        cmd = cmd + "\n"  # Add LF to complete the cmd
-        for wdata in cmd:  # Read Byte from String
-            wdata = wdata.encode("charmap")  # Encode Byte
-            self.com.write(wdata)  # Send Byte
-            rdata = self.com.read(1)  # Read back the byte
-            if rdata != wdata:  # Check EVE is responding ?
-                print("\nEVE is not responding..!!")  # Print error message
-                self.disconnect()  # Disconnect from EVE
-                sys.exit()  # Terminate
-        self.com.readline()  # Read new line printed on ending the cmd
+        try:
+            self.com.send_cmd(cmd)
+        except EchoError as err:  # Check EVE is responding ?
+            print("\nEVE is not responding..!! ({})".format(err))
+            self.disconnect()  # Disconnect from EVE
+            sys.exit()  # Terminate
 
     def send_data(self, string):
         """ Send raw data """
         time.sleep(self.WR_FW_INITIAL_DELAY)  # Initial Delay
-        for data in string:  # Read Byte from String
-            data = data.encode("charmap")  # Encode Byte
-            self.com.write(data)  # Send Data Byte
-            self.com.flushOutput()  # Flush Data
+        self.com.write(string)
 
     def read_response(self, timeout):
         """ Read Response """
-        output = ""
-        self.com.timeout = timeout  # Configure Serial timeout
-        line = self.com.readline()  # Read 1st line of Response
-        self.com.timeout = (
-            self.DEFAULT_RD_TIMEOUT
-        )  # Configure Serial timeout to default
-
-        while True:
-            if line == b"{\r\n":  # This is the start of response
-                output = ""  # Clear output
-            elif len(line) == 1 and line == b"$":  # Previous line was end of response
-                try:
-                    return json.loads(output)  # Convert to JSON object
-                except:
-                    return output  # Return Response
-            elif not line:  # No response
-                return output  # Timeout error
-
-            output += line.decode("charmap")  # Part of response, store it
-            line = self.com.readline()  # Read next line of Response
+        return self.com.read_response(timeout)
 
     def parse_response(self, response, module, display, terminate):
         """ Parse the Response and on error terminates program if terminate flag is Set """
@@ -1070,7 +1248,44 @@ if __name__ == "__main__":
 
     reqArgs = ap.add_argument_group("required arguments")
     reqArgs.add_argument(
-        "-p", "--port", required=True, metavar="", help="COM port (Ex: COM10)"
+        "-p", "--port", required=True, metavar="PORT", help="COM port (Ex: COM10)"
+    )
+    ap.add_argument(
+        "-l",
+        "--lockstep",
+        action="store_true",
+        help="Echo commands byte by byte (for firmware without bulk echo support)",
+    )
+    ap.add_argument(
+        "-s",
+        "--stats",
+        action="store_true",
+        help="Print per command latency counters on exit",
+    )
+    ap.add_argument(
+        "--write-block",
+        type=int,
+        default=ChunkedWriter.BLOCK_SIZE,
+        metavar="BYTES",
+        help="Bytes per serial write while sending firmware (default {})".format(
+            ChunkedWriter.BLOCK_SIZE
+        ),
+    )
+    ap.add_argument(
+        "--write-pace",
+        type=float,
+        default=0,
+        metavar="MS",
+        help="Milliseconds to wait between serial writes while sending firmware",
+    )
+    ap.add_argument(
+        "-w",
+        "--window",
+        type=int,
+        default=EveFwUpdate.WR_FW_WINDOW,
+        metavar="N",
+        help="Firmware chunks in flight, only for firmware that buffers WR_FW"
+        " commands (default {}, stop and wait)".format(EveFwUpdate.WR_FW_WINDOW),
     )
 
     fwUpArgs = ap.add_argument_group("firmware update arguments")
@@ -1078,7 +1293,7 @@ if __name__ == "__main__":
         "-m",
         "--mode",
         choices=EveFwUpdate.EVE_MODES,
-        metavar="",
+        metavar="MODE",
         required="SMT_SIMULATE" not in sys.argv,
         help="Current mode of EVE {}".format(EveFwUpdate.EVE_MODES),
     )
@@ -1086,7 +1301,7 @@ if __name__ == "__main__":
         "-f",
         "--file",
         required="SMT_SIMULATE" not in sys.argv,
-        metavar="",
+        metavar="FILE",
         type=valid_file,
         nargs=argparse.ONE_OR_MORE,
         help="Firmware binary file/s. (Max 2 files application and "
@@ -1100,7 +1315,7 @@ if __name__ == "__main__":
         required="SMT_SIMULATE" in sys.argv,
         type=valid_file,
         nargs=2,
-        metavar="",
+        metavar="BIN",
         help="Factory and TG application firmware binary files",
     )
     smtSimArgs.add_argument(
@@ -1109,7 +1324,7 @@ if __name__ == "__main__":
         type=lambda x: int(x, 16),
         nargs=2,
         required="SMT_SIMULATE" in sys.argv,
-        metavar="",
+        metavar="CHECKSUM",
         help="Checksum(In hex) of factory and TG application firmware "
         "binary files in exact order of -b/--bin arguments",
     )
@@ -1127,6 +1342,11 @@ if __name__ == "__main__":
         sys.exit()
 
     update = EveFwUpdate(args["mode"], args["OP"])
+    update.echo_lockstep = args["lockstep"]
+    update.show_stats = args["stats"]
+    update.write_block_size = args["write_block"]
+    update.write_pace = args["write_pace"] / 1000.0
+    update.wr_fw_window = args["window"]
 
     # Extract info from given bin files
     if update.extract_bin_info(bin_files, args["checksum"]):
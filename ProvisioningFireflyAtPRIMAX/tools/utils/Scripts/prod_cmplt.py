@@ -28,7 +28,7 @@ import argparse
 import time
 import json
 import datetime
-import serial
+from transport import SerialTransport, EchoError
 
 
 class EveModeSwitch:
@@ -86,24 +86,23 @@ class EveModeSwitch:
     def __init__(self):
         self.com = None
         self.time_now = None
+        self.echo_lockstep = False  # Echo cmd byte by byte (old firmware)
 
     def connect(self, com_port, baud):
         """ To establish connection between EVE and the PC """
 
         # Connect to serial COM port with specified configuration
         try:
-            self.com = serial.Serial(
-                port=com_port, baudrate=baud, timeout=self.DEFAULT_RD_TIMEOUT
+            self.com = SerialTransport(
+                com_port, baud, self.DEFAULT_RD_TIMEOUT, self.echo_lockstep
             )
+            self.com.open()
+
             # Print Connection Info to user
             self.time_now = datetime.datetime.now()
             print("\n{} Connected to EVE".format(time.ctime()))
             print(self.com)
 
-            # Clear serial port
-            self.com.flushInput()
-            self.com.flushOutput()
-
         except:
             print("\nFailed to establish connection with EVE")
             sys.exit()
@@ -120,29 +119,16 @@ class EveModeSwitch:
 
     def send_cmd(self, cmd):
         """ Send command """
-        # Clear serial port
-        self.com.flushInput()
-        self.com.flushOutput()
-        self.com.timeout = self.DEFAULT_RD_TIMEOUT  # Configure Serial timeout
-        cmd = cmd + "\n"  # Add LF to complete the cmd
-        for wdata in cmd:  # Read Byte from String
-            wdata = wdata.encode("charmap")  # Encode Byte
-            self.com.write(wdata)  # Send Byte
-            rdata = self.com.read(1)  # Read back the byte
-            if rdata != wdata:  # Check EVE is responding ?
-                print("\nEVE is not responding..!!")  # Print error message
-                self.disconnect()  # Disconnect from EVE
-                sys.exit()  # Terminate
-
-        # Read new line printed on ending the cmd
-        self.com.readline()
+        try:
+            self.com.send_cmd(cmd)
+        except EchoError as err:  # Check EVE is responding ?
+            print("\nEVE is not responding..!! ({})".format(err))
+            self.disconnect()  # Disconnect from EVE
+            sys.exit()  # Terminate
 
     def send_data(self, string):
         """ Send raw data """
-        for data in string:  # Read Byte from String
-            data = data.encode("charmap")  # Encode Byte
-            self.com.write(data)  # Send Data Byte
-            self.com.flushOutput()  # Flush Data
+        self.com.write(string)
 
     def reboot_eve(self):
         """ Reboot EVE  """
@@ -152,26 +138,7 @@ class EveModeSwitch:
 
     def read_response(self, timeout):
         """ Read Response """
-        output = ""
-        self.com.timeout = timeout  # Configure Serial timeout
-        line = self.com.readline()  # Read 1st line of Response
-        self.com.timeout = (
-            self.DEFAULT_RD_TIMEOUT
-        )  # Configure Serial timeout to default
-
-        while True:
-            if line == b"{\r\n":  # This is the start of response
-                output = ""  # Clear output
-            elif len(line) == 1 and line == b"$":  # Previous line was end of response
-                try:
-                    return json.loads(output)  # Convert to JSON object
-                except:
-                    return output  # Return Response
-            elif not line:  # No response
-                return output  # Timeout error
-
-            output += line.decode("charmap")  # Part of response, store it
-            line = self.com.readline()  # Read next line of Response
+        return self.com.read_response(timeout)
 
     def parse_response(self, response, module, display, terminate):
         """ Parse the Response and on error terminates program if terminate flag is Set """
@@ -248,14 +215,13 @@ class EveModeSwitch:
         """ Handshake with TG Application """
         print("Waiting for handshake........")
         left_time = self.TG_APP_HANDSHAKE_TIMEOUT
-        self.com.flushInput()
-        self.com.flushOutput()
+        self.com.flush()
 
         while left_time > 0:
-            self.com.timeout = left_time  # Configure Serial timeout
             start_time = time.time()  # To check for timeout
-            line = self.com.readline()  # Try to read expected handshake string
-            line.decode("charmap")
+            line = self.com.readline(left_time).decode(
+                "charmap"
+            )  # Try to read expected handshake string
             print(line)  # Ignore, for debug only
             if self.TG_APP_HANDSHAKE_STRING in line:
                 self.send_data(
@@ -279,10 +245,9 @@ class EveModeSwitch:
             found_shipment_mode = False
             enter_shipment_mode_success = True
             while left_time > 0:
-                self.com.timeout = left_time  # Configure Serial timeout
                 start_time = time.time()  # To check for timeout
 
-                line = self.com.readline().decode("utf8")
+                line = self.com.readline(left_time).decode("utf8")
 
                 if found_shipment_mode:
                     if "Failed to enter SHIPMENT MODE" in line:
@@ -301,10 +266,8 @@ class EveModeSwitch:
         else:
             left_time = self.ENTER_FACT_MODE_TIMEOUT
             while left_time > 0:
-                self.com.timeout = left_time  # Configure Serial timeout
                 start_time = time.time()  # To check for timeout
-                line = self.com.readline()
-                line.decode("charmap")
+                line = self.com.readline(left_time).decode("charmap")
                 if "Welcome" in line:
                     print("\nSwitched back to FACTORY MODE successfully...!!")
                     return
@@ -440,12 +403,20 @@ if __name__ == "__main__":
         "switch to SHIP mode. Value in Hex (Ex: 0x4a0fc)",
     )
 
+    ap.add_argument(
+        "-l",
+        "--lockstep",
+        action="store_true",
+        help="Echo commands byte by byte (for firmware without bulk echo support)",
+    )
+
     args = vars(ap.parse_args())
 
     # Registering signal handle
     signal.signal(signal.SIGINT, signal_handler)
 
     switch_mode = EveModeSwitch()
+    switch_mode.echo_lockstep = args["lockstep"]
 
     switch_mode.connect(args["PORT"], 115200)
 
@@ -2,9 +2,8 @@
 
 import sys
 import os
-import json
 import time
-import serial
+from transport import SerialTransport, EchoError
 
 
 class Qsn:
@@ -14,23 +13,21 @@ class Qsn:
 
     def __init__(self):
         self.ser = None
+        self.echo_lockstep = False  # Echo cmd byte by byte (old firmware)
 
     def connect(self, *args):
         """ To establish connection between EVE and the PC """
 
         # Connect to serial COM port with specified configuration
         try:
-            self.ser = serial.Serial(
-                port=str(args[0]), baudrate=args[1], timeout=self.DEFAULT_RD_TIMEOUT
+            self.ser = SerialTransport(
+                str(args[0]), args[1], self.DEFAULT_RD_TIMEOUT, self.echo_lockstep
             )
+            self.ser.open()
 
             # Print Connection Info to user
             # print('\nConnected to EVE')
 
-            # Clear serial port
-            self.ser.flushInput()
-            self.ser.flushOutput()
-
         except:
             print("Failed to establish connection with EVE")
             sys.exit()
@@ -42,40 +39,16 @@ class Qsn:
 
     def send_cmd(self, cmd):
         """ Send String """
-        self.ser.timeout = self.DEFAULT_RD_TIMEOUT  # Configure Serial timeout
-        cmd = cmd + "\n"  # Add LF to complete the cmd
-        for wdata in cmd:  # Read Byte from String
-            wdata = wdata.encode("charmap")  # Encode Byte
-            self.ser.write(wdata)  # Send Byte
-            rdata = self.ser.read(1)  # Read back the byte
-            if rdata != wdata:  # Check EVE is responding ?
-                print("\nEVE is not responding..!!")  # Print error message
-                self.disconnect()  # Disconnect from EVE
-                sys.exit()  # Terminate
-        self.ser.readline()  # Read new line printed on ending the cmd
+        try:
+            self.ser.send_cmd(cmd)
+        except EchoError as err:  # Check EVE is responding ?
+            print("\nEVE is not responding..!! ({})".format(err))
+            self.disconnect()  # Disconnect from EVE
+            sys.exit()  # Terminate
 
     def read_response(self, timeout):
         """ Read Response """
-        output = ""
-        self.ser.timeout = timeout  # Configure Serial timeout
-        line = self.ser.readline()  # Read 1st line of Response
-        self.ser.timeout = (
-            self.DEFAULT_RD_TIMEOUT
-        )  # Configure Serial timeout to default
-
-        while True:
-            if line == b"{\r\n":  # This is the start of response
-                output = ""  # Clear output
-            elif len(line) == 1 and line == b"$":  # Previous line was end of response
-                try:
-                    return json.loads(output)  # Convert to JSON object
-                except:
-                    return output  # Return Response
-            elif not line:  # No response
-                return output  # Timeout error
-
-            output += line.decode("charmap")  # Part of response, store it
-            line = self.ser.readline()  # Read next line of Response
+        return self.ser.read_response(timeout)
 
     def write(self, data):
         self.send_cmd("EEPROM WRITE" + " " + self.QSN_ADDRESS + " " + data)
@@ -109,28 +82,35 @@ class Qsn:
 
 if __name__ == "__main__":
 
+    # Optional -l/--lockstep, anywhere on the command line
+    lockstep = [arg for arg in sys.argv[1:] if arg in ("-l", "--lockstep")]
+    argv = [arg for arg in sys.argv if arg not in lockstep]
+
     # Check for Arguments
-    if len(sys.argv) < 3:
+    if len(argv) < 3:
         # Print Error Message
         print("\nError: Insufficient Arguments")
         # Print Usage Information
         print("Expected  Arguments")
         print("1. COM Port to which EVE is connected")
         print("2. RD_QSN/WR_QSN [QSN]")
+        print("Optional: -l to echo commands byte by byte")
+        print("(for firmware without bulk echo support)")
         sys.exit()
 
     module = Qsn()
+    module.echo_lockstep = bool(lockstep)
 
     # Connect to EVE
-    module.connect(sys.argv[1], 115200)
+    module.connect(argv[1], 115200)
 
-    if sys.argv[2] == "RD_QSN":
+    if argv[2] == "RD_QSN":
         module.read()
-    elif sys.argv[2] == "WR_QSN":
-        if len(sys.argv) < 4:
+    elif argv[2] == "WR_QSN":
+        if len(argv) < 4:
             print("\nError: QSN missing")
         else:
-            module.write(sys.argv[3])
+            module.write(argv[3])
     else:
         print("\nError: Invalid command")
 
@@ -0,0 +1,495 @@
+# -*- coding: UTF-8 -*-
+"""
+/** @file  rack.py
+ *  @date  October 18, 2026
+ *  @brief Run one of the serial tools on every AG-55 of a rack at once
+ *  @bug No known bugs.
+ */
+"""
+
+import os
+import re
+import sys
+import glob
+import signal
+import time
+import logging
+import argparse
+import threading
+import traceback
+
+import fwUpdate
+import prod_cmplt
+import reboot
+import qsn
+import dcl_ship_mode
+from firmware import ChecksumCache, ImageStore, TransferJournal
+
+try:
+    import __builtin__ as builtins  # Python 2
+except ImportError:
+    import builtins
+
+BAUD = 115200
+STATUS_INTERVAL = 0.5  # Seconds between checks of the port states
+
+
+class ThreadOutput(object):
+    """
+    sys.stdout routed to the log of the port the calling thread works on,
+    so the tools can print as they do on their own
+    """
+
+    def __init__(self, default):
+        self.default = default  # Where threads without a port print
+        self.streams = {}  # thread ident: stream
+
+    def attach(self, stream):
+        self.streams[threading.current_thread().ident] = stream
+
+    def detach(self):
+        self.streams.pop(threading.current_thread().ident, None)
+
+    def _stream(self):
+        return self.streams.get(threading.current_thread().ident, self.default)
+
+    def write(self, data):
+        self._stream().write(data)
+
+    def flush(self):
+        self._stream().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.default, name)
+
+
+class PromptDeclined(Exception):
+    """ A tool asked for confirmation and the run was not started with -y """
+
+
+class PortRun(object):
+    """
+    State of one port of the rack: WAITING -> RUNNING -> PASS or FAIL.
+    Written to by the tool through ThreadOutput, keeps the last line
+    printed and the first one reporting an error
+    """
+
+    STATES = ["WAITING", "RUNNING", "PASS", "FAIL"]
+
+    # Lines the tools print when they give up on a device
+    FAILURE = re.compile(
+        r"^\W*(error|failed|handshake failed|device needs more charge)", re.I
+    )
+
+    def __init__(self, port, log_path):
+        self.port = port
+        self.log_path = log_path
+        self.state = self.STATES[0]
+        self.start = None
+        self.end = None
+        self.last = ""  # Last line printed
+        self.failure = None  # First error line printed
+        self.log = None
+        self._line = ""  # Line being printed
+
+    @property
+    def elapsed(self):
+        if self.start is None:
+            return 0.0
+        return (self.end or time.time()) - self.start
+
+    @property
+    def detail(self):
+        return self.failure or self.last
+
+    def write(self, data):
+        self.log.write(data)
+        lines = (self._line + data).split("\n")
+        self._line = lines.pop()
+        for line in lines:
+            self._scan(line)
+
+    def flush(self):
+        self.log.flush()
+
+    def _scan(self, line):
+        line = line.strip()
+        if not line:
+            return
+        self.last = line
+        if self.failure is None and self.FAILURE.match(line):
+            self.failure = line
+
+    def run(self, operation, args, shared, output):
+        """ Run operation on the port, in the calling thread """
+        self.log = open(self.log_path, "a")
+        output.attach(self)
+        self.start = time.time()
+        self.state = self.STATES[1]
+        try:
+            print("\n==== {} {} on {}".format(time.ctime(), args.op, self.port))
+            operation(self.port, args, shared)
+            self._scan(self._line)
+            self.state = self.STATES[3] if self.failure else self.STATES[2]
+        except SystemExit:  # How the tools give up
+            self._scan(self._line)
+            self.failure = self.failure or "Terminated: {}".format(self.last)
+            self.state = self.STATES[3]
+        except Exception as err:  # Not to stop the other ports
+            traceback.print_exc(file=self)
+            self.failure = self.failure or "{}: {}".format(type(err).__name__, err)
+            self.state = self.STATES[3]
+        finally:
+            self.end = time.time()
+            output.detach()
+            self.log.close()
+
+
+class Shared(object):
+    """ State shared by the ports of a run, images are loaded once """
+
+    def __init__(self):
+        self.images = ImageStore()
+        self.checksum_cache = ChecksumCache()
+        self.journal = TransferJournal()
+
+
+def run_fw_update(port, args, shared):
+    """ fwUpdate.py FW_UPDATE """
+    update = fwUpdate.EveFwUpdate(args.mode, fwUpdate.EveFwUpdate.OP_FW_UPDATE)
+    update.echo_lockstep = args.lockstep
+    update.wr_fw_window = args.window
+    update.images = shared.images
+    update.checksum_cache = shared.checksum_cache
+    update.journal = shared.journal
+    try:
+        if update.extract_bin_info(args.file, None):
+            update.connect(port, BAUD)
+            update.process_request()
+    finally:
+        update.disconnect()
+        update.flash_state.close()
+
+
+def load_fw_update(args, shared):
+    """ Read and checksum the firmware files before the ports start """
+    shared.images.load(args.file)
+    for bin_file in args.file:
+        shared.checksum_cache.lookup(bin_file, fwUpdate.EveFwUpdate.CHUNK_SIZE)
+
+
+def run_prod_cmplt(port, args, shared):
+    """ prod_cmplt.py """
+    switch_mode = prod_cmplt.EveModeSwitch()
+    switch_mode.echo_lockstep = args.lockstep
+    switch_mode.connect(port, BAUD)
+    try:
+        if args.switch_to == switch_mode.EVE_MODES[0]:
+            switch_mode.switch_to_fact_mode(args.checksum, args.size)
+        elif args.switch_to == switch_mode.EVE_MODES[1]:
+            switch_mode.switch_to_ship_mode(args.checksum, args.size)
+        else:
+            switch_mode.force_enter_ship_mode()
+    finally:
+        switch_mode.disconnect()
+
+
+def run_reboot(port, args, shared):
+    """ reboot.py """
+    rebooter = reboot.Rebooter()
+    rebooter.echo_lockstep = args.lockstep
+    rebooter.connect(port, BAUD)
+    try:
+        if rebooter.reboot_eve_with_handshake() != rebooter.RESP_VALUES[0]:
+            print("\nError: Reboot failed")
+    finally:
+        rebooter.disconnect()
+
+
+def run_qsn(port, args, shared):
+    """ qsn.py """
+    module = qsn.Qsn()
+    module.echo_lockstep = args.lockstep
+    module.connect(port, BAUD)
+    try:
+        if args.command == "RD_QSN":
+            module.read()
+        else:
+            module.write(args.qsn)
+    finally:
+        module.disconnect()
+
+
+def run_ship_mode(port, args, shared):
+    """ dcl_ship_mode.py """
+    switch_mode = dcl_ship_mode.EveModeSwitch()
+    switch_mode.echo_lockstep = args.lockstep
+    switch_mode.debug = args.debug
+    switch_mode.connect(port, BAUD)
+    try:
+        switch_mode.force_enter_ship_mode()
+    finally:
+        switch_mode.disconnect()
+
+
+class Rack(object):
+    """
+    Runs an operation on every port, one thread and one PortRun per port.
+    A port failing, even by terminating its tool, leaves the others running
+    """
+
+    def __init__(self, ports, log_dir, jobs=None):
+        self.runs = []
+        for port in ports:
+            name = re.sub(r"[^\w.-]+", "_", port).strip("_") or "port"
+            self.runs.append(PortRun(port, os.path.join(log_dir, name + ".log")))
+        self.jobs = threading.Semaphore(jobs or len(ports))  # Ports run at once
+        self.output = ThreadOutput(sys.stdout)
+        self.answer = None  # To confirmation prompts, None to fail the port
+        self.start = None
+        self.end = None
+
+    def prompt(self, text=""):
+        """ Stands for raw_input()/input() while the rack runs """
+        print(text)
+        if self.answer is None:
+            raise PromptDeclined("Confirmation needed, run with -y to confirm")
+        print(self.answer)
+        return self.answer
+
+    def _work(self, run, operation, args, shared):
+        with self.jobs:
+            run.run(operation, args, shared, self.output)
+
+    def run(self, operation, args, shared):
+        """ Run operation on every port and wait for them all """
+        saved = (sys.stdout, builtins.input, getattr(builtins, "raw_input", None))
+        sys.stdout = self.output
+        builtins.input = self.prompt
+        if saved[2] is not None:
+            builtins.raw_input = self.prompt
+        logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stdout)
+
+        self.start = time.time()
+        threads = []
+        for run in self.runs:
+            thread = threading.Thread(
+                target=self._work, args=(run, operation, args, shared)
+            )
+            thread.daemon = True  # Not to hold up Ctrl+C
+            thread.start()
+            threads.append(thread)
+
+        try:
+            states = {}
+            while any(thread.is_alive() for thread in threads):
+                self.report_changes(states)
+                time.sleep(STATUS_INTERVAL)
+            self.report_changes(states)
+        finally:
+            self.end = time.time()
+            sys.stdout, builtins.input = saved[:2]
+            if saved[2] is not None:
+                builtins.raw_input = saved[2]
+
+    def report_changes(self, states):
+        """ Print the ports that changed state since the last call """
+        for run in self.runs:
+            if states.get(run.port) == run.state:
+                continue
+            states[run.port] = run.state
+            line = "{} {:<24} {:<8}".format(
+                time.strftime("%H:%M:%S"), run.port, run.state
+            )
+            if run.end:
+                line += " {:7.1f}s  {}".format(run.elapsed, run.detail)
+            self.output.default.write(line.rstrip() + "\n")
+        self.output.default.flush()
+
+    def summary(self):
+        """ Lines of the final per-port table and throughput """
+        lines = [
+            "",
+            "{:<24} {:<8} {:>8}  {}".format("PORT", "RESULT", "TIME", "DETAIL"),
+        ]
+        for run in self.runs:
+            lines.append(
+                "{:<24} {:<8} {:>7.1f}s  {}".format(
+                    run.port, run.state, run.elapsed, run.detail
+                )
+            )
+        passed = sum(run.state == PortRun.STATES[2] for run in self.runs)
+        elapsed = (self.end or time.time()) - self.start
+        lines.append("")
+        lines.append(
+            "{}/{} passed in {:.1f}s, {:.1f} devices/hour".format(
+                passed, len(self.runs), elapsed, passed * 3600.0 / max(elapsed, 1e-3)
+            )
+        )
+        return lines
+
+
+def find_ports(ports, patterns):
+    """ Ports given plus those matching the glob patterns, in order, once each """
+    found = list(ports or [])
+    for pattern in patterns or []:
+        found.extend(sorted(glob.glob(pattern)))
+    unique = []
+    for port in found:
+        if port not in unique:
+            unique.append(port)
+    return unique
+
+
+def signal_handler(sig, frame):
+    print("\nYou pressed Ctrl+C!")
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+
+    # Argument parser
+    ap = argparse.ArgumentParser(
+        description="Run a serial tool on several AG-55s at once, one per port"
+    )
+    ap.add_argument(
+        "-p",
+        "--port",
+        action="append",
+        metavar="PORT",
+        help="COM port (Ex: COM10), may be repeated (Ex: -p COM10 -p COM11)",
+    )
+    ap.add_argument(
+        "-g",
+        "--glob",
+        action="append",
+        metavar="",
+        help="Pattern of COM ports (Ex: '/dev/serial/by-id/*'), may be repeated",
+    )
+    ap.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        metavar="",
+        help="Ports to run at once (default all)",
+    )
+    ap.add_argument(
+        "-y",
+        "--yes",
+        action="store_true",
+        help="Answer yes to the confirmations the tools ask for, on every port",
+    )
+    ap.add_argument(
+        "--logs",
+        default="rack_logs",
+        metavar="",
+        help="Directory of the per-port logs (default rack_logs)",
+    )
+    ap.add_argument(
+        "-l",
+        "--lockstep",
+        action="store_true",
+        help="Echo commands byte by byte (for firmware without bulk echo support)",
+    )
+
+    ops = ap.add_subparsers(dest="op", metavar="OP")
+    ops.required = True
+
+    fwUpArgs = ops.add_parser("fw_update", help="fwUpdate.py FW_UPDATE")
+    fwUpArgs.add_argument(
+        "-m",
+        "--mode",
+        choices=fwUpdate.EveFwUpdate.EVE_MODES,
+        metavar="",
+        required=True,
+        help="Current mode of EVE {}".format(fwUpdate.EveFwUpdate.EVE_MODES),
+    )
+    fwUpArgs.add_argument(
+        "-f",
+        "--file",
+        required=True,
+        metavar="",
+        type=fwUpdate.valid_file,
+        nargs=argparse.ONE_OR_MORE,
+        help="Firmware binary file/s, as for fwUpdate.py",
+    )
+    fwUpArgs.add_argument(
+        "-w",
+        "--window",
+        type=int,
+        default=fwUpdate.EveFwUpdate.WR_FW_WINDOW,
+        metavar="",
+        help="Firmware chunks in flight (default {}, stop and wait)".format(
+            fwUpdate.EveFwUpdate.WR_FW_WINDOW
+        ),
+    )
+    fwUpArgs.set_defaults(run=run_fw_update, load=load_fw_update)
+
+    prodArgs = ops.add_parser("prod_cmplt", help="prod_cmplt.py")
+    prodArgs.add_argument(
+        "switch_to",
+        metavar="SWITCH-TO",
+        choices=prod_cmplt.EveModeSwitch.EVE_MODES,
+        help="Switch to requested mode {}".format(prod_cmplt.EveModeSwitch.EVE_MODES),
+    )
+    prodArgs.add_argument(
+        "checksum",
+        metavar="CHECKSUM",
+        type=lambda x: int(x, 16),
+        help="Checksum of the firmware to switch to, in Hex (Ex: 0x1d513d1)",
+    )
+    prodArgs.add_argument(
+        "size",
+        metavar="SIZE",
+        type=lambda x: int(x, 16),
+        help="Size of the firmware to switch to, in Hex (Ex: 0x4a0fc)",
+    )
+    prodArgs.set_defaults(run=run_prod_cmplt)
+
+    rebootArgs = ops.add_parser("reboot", help="reboot.py")
+    rebootArgs.set_defaults(run=run_reboot)
+
+    qsnArgs = ops.add_parser("qsn", help="qsn.py")
+    qsnArgs.add_argument(
+        "command", metavar="RD_QSN|WR_QSN", choices=["RD_QSN", "WR_QSN"]
+    )
+    qsnArgs.add_argument("qsn", metavar="QSN", nargs="?", help="QSN to write")
+    qsnArgs.set_defaults(run=run_qsn)
+
+    shipArgs = ops.add_parser("ship_mode", help="dcl_ship_mode.py")
+    shipArgs.add_argument("--debug", action="store_true", help="Print debug info")
+    shipArgs.set_defaults(run=run_ship_mode)
+
+    args = ap.parse_args()
+
+    if args.op == "qsn" and args.command == "WR_QSN" and not args.qsn:
+        ap.error("QSN missing")
+
+    ports = find_ports(args.port, args.glob)
+    if not ports:
+        ap.error("No COM port given or matching")
+
+    # Registering signal handle
+    signal.signal(signal.SIGINT, signal_handler)
+
+    if not os.path.isdir(args.logs):
+        os.makedirs(args.logs)
+
+    shared = Shared()
+    if getattr(args, "load", None):
+        args.load(args, shared)
+        print(
+            "Loaded {} bytes of firmware for {} ports".format(
+                shared.images.size, len(ports)
+            )
+        )
+
+    rack = Rack(ports, args.logs, args.jobs)
+    if args.yes:
+        rack.answer = "y"
+    try:
+        rack.run(args.run, args, shared)
+    finally:
+        print("\n".join(rack.summary()))
+
+    sys.exit(0 if all(run.state == PortRun.STATES[2] for run in rack.runs) else 1)
@@ -17,7 +17,7 @@ import argparse
 import time
 import json
 import datetime
-import serial
+from transport import SerialTransport, EchoError
 
 
 class Rebooter:
@@ -44,23 +44,22 @@ class Rebooter:
     def __init__(self):
         self.com = None
         self.time_now = None
+        self.echo_lockstep = False  # Echo cmd byte by byte (old firmware)
 
     def connect(self, com_port, baud):
         """ To establish connection between EVE and the PC """
 
         # Connect to serial COM port with specified configuration
         try:
-            self.com = serial.Serial(
-                port=com_port, baudrate=baud, timeout=self.DEFAULT_RD_TIMEOUT
+            self.com = SerialTransport(
+                com_port, baud, self.DEFAULT_RD_TIMEOUT, self.echo_lockstep
             )
+            self.com.open()
+
             # Print Connection Info to user
             self.time_now = datetime.datetime.now()
             print("\nConnected to AG-55 at: {}".format(time.ctime()))
 
-            # Clear serial port
-            self.com.flushInput()
-            self.com.flushOutput()
-
         except:
             print("\nFailed to establish connection with AG-55.  Verify COM Port.")
             sys.exit()
@@ -77,29 +76,16 @@ class Rebooter:
 
     def send_cmd(self, cmd):
         """ Send command """
-        # Clear serial port
-        self.com.flushInput()
-        self.com.flushOutput()
-        self.com.timeout = self.DEFAULT_RD_TIMEOUT  # Configure Serial timeout
-        cmd = cmd + "\n"  # Add LF to complete the cmd
-        for wdata in cmd:  # Read Byte from String
-            wdata = wdata.encode("charmap")  # Encode Byte
-            self.com.write(wdata)  # Send Byte
-            rdata = self.com.read(1)  # Read back the byte
-            if rdata != wdata:  # Check EVE is responding ?
-                print("\nAG-55 is not responding!")  # Print error message
-                self.disconnect()  # Disconnect from EVE
-                sys.exit()  # Terminate
-
-        # Read new line printed on ending the cmd
-        self.com.readline()
+        try:
+            self.com.send_cmd(cmd)
+        except EchoError as err:  # Check EVE is responding ?
+            print("\nAG-55 is not responding! ({})".format(err))
+            self.disconnect()  # Disconnect from EVE
+            sys.exit()  # Terminate
 
     def send_data(self, string):
         """ Send raw data """
-        for data in string:  # Read Byte from String
-            data = data.encode("charmap")  # Encode Byte
-            self.com.write(data)  # Send Data Byte
-            self.com.flushOutput()  # Flush Data
+        self.com.write(string)
 
     def reboot_eve(self):
         """ Reboot EVE  """
@@ -111,14 +97,13 @@ class Rebooter:
         """ Handshake with TG Application """
         print("Waiting for handshake.")
         left_time = self.TG_APP_HANDSHAKE_TIMEOUT
-        self.com.flushInput()
-        self.com.flushOutput()
+        self.com.flush()
 
         while left_time > 0:
-            self.com.timeout = left_time  # Configure Serial timeout
             start_time = time.time()  # To check for timeout
-            line = self.com.readline()  # Try to read expected handshake string
-            line.decode("charmap")
+            line = self.com.readline(left_time).decode(
+                "charmap"
+            )  # Try to read expected handshake string
             if self.TG_APP_HANDSHAKE_STRING in line:
                 self.send_data(
                     self.TG_APP_HANDSHAKE_RESP
@@ -137,26 +122,7 @@ class Rebooter:
 
     def read_response(self, timeout):
         """ Read Response """
-        output = ""
-        self.com.timeout = timeout  # Configure Serial timeout
-        line = self.com.readline()  # Read 1st line of Response
-        self.com.timeout = (
-            self.DEFAULT_RD_TIMEOUT
-        )  # Configure Serial timeout to default
-
-        while True:
-            if line == b"{\r\n":  # This is the start of response
-                output = ""  # Clear output
-            elif len(line) == 1 and line == b"$":  # Previous line was end of response
-                try:
-                    return json.loads(output)  # Convert to JSON object
-                except:
-                    return output  # Return Response
-            elif not line:  # No response
-                return output  # Timeout error
-
-            output += line.decode("charmap")  # Part of response, store it
-            line = self.com.readline()  # Read next line of Response
+        return self.com.read_response(timeout)
 
     def parse_response(self, response, module, display, terminate):
         """ Parse the Response and on error terminates program if terminate flag is Set """
@@ -204,12 +170,20 @@ if __name__ == "__main__":
         "-p", "--port", required=True, metavar="", help="COM port (Ex: COM10)"
     )
 
+    ap.add_argument(
+        "-l",
+        "--lockstep",
+        action="store_true",
+        help="Echo commands byte by byte (for firmware without bulk echo support)",
+    )
+
     args = vars(ap.parse_args())
 
     # Registering signal handle
     signal.signal(signal.SIGINT, signal_handler)
 
     rebooter = Rebooter()
+    rebooter.echo_lockstep = args["lockstep"]
 
     rebooter.connect(args["port"], 115200)
 
@@ -12,7 +12,6 @@ import zipfile
 import shutil
 
 MANIFEST_FILE = "manifest.json"
-CHUNK_SIZE = 4 * 1024
 
 INIT_PKT_SIZE_MAX = 512  # init packet max size is 512
 
@@ -33,7 +32,11 @@ BLE_DFU_EXMEM_RAW_ID = 65281
 QSPI_BLE_SEC_START = 2785280
 QSPI_BLE_SEC_COUNT = 352
 
-RETRY_COUNT = 10  # Retry count
+# DFU staging region in QSPI, may be erased beyond what a package writes
+QSPI_BLE_DFU_START = BL_INIT_PKT_OFFSET
+QSPI_BLE_DFU_END = QSPI_BLE_SEC_START + QSPI_BLE_SEC_COUNT * 4096
+
+WR_FW_WINDOW = 1  # Chunks in flight, > 1 needs firmware that buffers WR_FW
 com = None
 qspi = None
 
@@ -44,7 +47,7 @@ def signal_handler(sig, frame):
     sys.exit(0)
 
 
-class DfuPackage(modules.module_class):
+class DfuPackage(modules.dfu_class):
     target_path = None
     zip_file_path = None
     zip_pkg = None
@@ -59,13 +62,18 @@ class DfuPackage(modules.module_class):
     RESP_KEY = "RESULT"
     RESP_VALUES = ["PASS", "FAIL", "TIMEOUT", "INVALID"]
 
+    EXMEM_RAW_ID = BLE_DFU_EXMEM_RAW_ID
+    DFU_REGION = (QSPI_BLE_DFU_START, QSPI_BLE_DFU_END)
+
+    window = WR_FW_WINDOW
+
     def __init__(self, arg, zip_file):
         """
         Check the zip is present and get the target path
         :param arg:
         :param zip_file:
         """
-        modules.module_class.__init__(self, arg)
+        modules.dfu_class.__init__(self, arg)
         if not os.path.isfile(zip_file):
             print("FILE NOT FOUND : Specified zip package does not exist")
             sys.exit(0)
@@ -102,19 +110,28 @@ class DfuPackage(modules.module_class):
             print("ERROR : Invalid zip package")
             self.dfu_exit()
 
-    def prep_qspi(self):
+    def package_files(self):
         """
-        Erase QSPI sectors to write firmware
+        Files of the package in the manifest and the QSPI offsets they go to
+        :return: list of (file path, offset)
         """
-        sec_addr = QSPI_BLE_SEC_START
-        for i in range(1, QSPI_BLE_SEC_COUNT + 1, 1):
-            resp = self.qspiSEC_ER(1, hex(sec_addr)[2:])
-            resp = self.parse_response(resp, "QSPI", True)
-            if resp != self.RESP_VALUES[0]:
-                self.dfu_exit()
-            # Check for failure
-            sec_addr = sec_addr + 4096
-            print("Erasing Sec addr " + hex(sec_addr)[2:])
+        with open(self.manifest_file, "r") as file_list:
+            manifest = json.load(file_list).get("manifest", {})
+        files = []
+        for image, init_offset, bin_offset in (
+            ("bootloader", BL_INIT_PKT_OFFSET, BL_BINARY_OFFSET),
+            ("softdevice", SD_INIT_PKT_OFFSET, SD_BINARY_OFFSET),
+            ("application", APP_INIT_PKT_OFFSET, APP_BINARY_OFFSET),
+        ):
+            try:
+                init_file = os.path.join(self.target_path, manifest[image]["dat_file"])
+                bin_file = os.path.join(self.target_path, manifest[image]["bin_file"])
+            except KeyError:
+                continue  # Not in the package
+            if os.path.isfile(init_file) and os.path.isfile(bin_file):
+                files.append((init_file, init_offset))
+                files.append((bin_file, bin_offset))
+        return files
 
     def remove_temp(self):
         """
@@ -130,63 +147,7 @@ class DfuPackage(modules.module_class):
         calculate Crc
         :return: checksum
         """
-        # Open Binary file
-        binary = open(file, "rb")
-        checksum = 0
-        while True:  # Calculate CheckSum
-            binary_data = binary.read(CHUNK_SIZE)  # Try reading 'CHUNK_SIZE' bytes
-            if not binary_data:  # Break if nothing is read
-                break
-            binary_data = binary_data.decode("charmap")
-
-            checksum += sum(map(ord, binary_data))  # Update CheckSum
-
-        # Close bin file
-        binary.close()
-        return checksum
-
-    def send_file(self, file_name, offset):
-        """
-        Send image to EVE
-        """
-        binary = open(file_name, "rb")
-        print("Sending " + file_name)
-        # Send chunk size of data
-        while True:
-            binary_data = binary.read(CHUNK_SIZE)  # Try reading 'CHUNK_SIZE' bytes
-            if not binary_data:  # Break if nothing is read
-                break
-            # Calculate checksum of the chunk
-            binary_data = binary_data.decode("charmap")
-            checksum = sum(map(ord, binary_data))
-            # ADAM-1662 : retry was not reaching the max value "RETRY_COUNT" in case of failure
-            # Hence script kept sending next chunk of data even when last chunk failed
-            # Now script will stop immediately if any data chunk fails for "RETRY_COUNT" times
-            for retry in range(1, RETRY_COUNT + 1, 1):
-                # send binary
-                resp = self.fw_update_WR_FW(
-                    hex(checksum), hex(offset), binary_data, len(binary_data)
-                )
-
-                # Parse response
-                resp_value = self.parse_response(
-                    resp, "FW_UPDATE", True
-                )  # Terminate on failure
-
-                # Break on success
-                if resp_value == self.RESP_VALUES[0]:
-                    break
-                else:
-                    if retry >= RETRY_COUNT:
-                        print("Failed to transmit binary data")
-                        binary.close()
-                        self.dfu_exit()
-                    else:
-                        print("Retrying...")
-            # increment offset
-            offset += len(binary_data)
-        # Close file
-        binary.close()
+        return self.checksum_cache.lookup(file)[0]
 
     def parse_response(self, response, module, display):
         """ Parse the Response and on error terminates program if terminate flag is Set """
@@ -397,6 +358,7 @@ class DfuPackage(modules.module_class):
         self.send_bootloader(datastore)
         self.send_softdevice(datastore)
         self.send_application(datastore)
+        print("\n".join(self.chunk_sizer.report()))
 
     def update_ble(self):
         """
@@ -429,6 +391,16 @@ if __name__ == "__main__":
         "-pkg", "--package", required=True, metavar="", help="Zip package not Found"
     )
 
+    ap.add_argument(
+        "-w",
+        "--window",
+        required=False,
+        metavar="",
+        type=int,
+        default=WR_FW_WINDOW,
+        help="Chunks in flight, only for firmware that buffers WR_FW commands",
+    )
+
     ap.add_argument(
         "-r",
         "--repeat",
@@ -453,6 +425,7 @@ if __name__ == "__main__":
     com = utils.com_class()
     # create object for dfu class
     dfu = DfuPackage(com, args["package"])
+    dfu.window = args["window"]
     if args["baud"]:
         com.connect(args["port"], args["baud"], 1)
     else:
@@ -491,6 +464,7 @@ if __name__ == "__main__":
 
         # Issue update command
         dfu.fw_updateBLE_DFU()
+        dfu.finish_transfers()
 
         # Get the new sw version
         sleep(15)
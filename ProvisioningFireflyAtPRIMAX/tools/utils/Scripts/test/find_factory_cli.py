@@ -1,6 +1,11 @@
-import time
+import os
+import sys
 import serial
 
+# The serial transport is shared with the station tools one directory up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from transport import ChunkedWriter, PacingController
+
 devs_to_try = [
     "/dev/ttyACM0",
     "/dev/ttyACM1",
@@ -16,24 +21,44 @@ devs_to_try = [
     "/dev/ttyS3",
 ]
 
+PROBE_CMD = b"FW_UPDATE\r\n"
+PROBE_TRIES = 4  # Garbled echo is retried slower, AG UART can't take the heat
+
+
+def probe(ser, pacing):
+    """ Send the bare FW_UPDATE command and see what shakes out """
+    writer = ChunkedWriter(ser)
+    for _ in range(PROBE_TRIES):
+        ser.reset_input_buffer()
+        delay = pacing["byte"].delay
+        writer.write(PROBE_CMD, 1 if delay else None, delay)
+        reply = ser.read(2024)
+        if not reply:  # Nothing connected or not a CLI
+            return False
+        echo_ok = reply.find(PROBE_CMD.strip()) >= 0
+        pacing.record("byte", echo_ok)
+        if echo_ok:
+            return reply.find(b"BLE_DFU") >= 0
+    return False
+
+
 if __name__ == "__main__":
     """Find and print the device name of serial port connect to an AG-55 running factory_cli"""
 
     for dev in devs_to_try:
         try:
             ser = serial.Serial(port=dev, baudrate=115200, timeout=0.5)
-
-            # Send the bare FW_UPDATE command and see what shakes out.
-            for c in "FW_UPDATE\r\n":
-                ser.write(c)
-                time.sleep(0.005)  # AG UART can't take the heat at 115K baud
-
-            if ser.read(2024).find("BLE_DFU") >= 0:
-                print(dev)
-                ser.close()
-                break
-
         except:
             continue
 
+        pacing = PacingController(dev)
+        try:
+            found = probe(ser, pacing)
+        except:
+            found = False
         ser.close()
+        pacing.save()
+
+        if found:
+            print(dev)
+            break
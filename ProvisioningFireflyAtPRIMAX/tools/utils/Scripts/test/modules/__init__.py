@@ -12,3 +12,4 @@ from .pm_module import pm_class
 from .qspi_module import qspi_class
 from .fw_update_module import fw_update_class
 from .modules import module_class
+from .dfu_module import dfu_class
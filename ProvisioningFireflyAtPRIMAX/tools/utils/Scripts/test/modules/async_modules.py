@@ -0,0 +1,252 @@
+"""
+Async counterparts of the module_class methods (Python 3 only, import as
+modules.async_modules)
+"""
+import asyncio
+import concurrent.futures
+
+from . import lte_module
+from .modules import module_class
+
+
+class CommandCancelled(Exception):
+    """ The async call running a module method was cancelled """
+
+
+def _discard(future):
+    """ Retrieve the outcome of a call nobody awaits any more """
+    if not future.cancelled():
+        future.exception()
+
+
+class _call_state(object):
+    """ Deadline and cancellation of one async call """
+
+    def __init__(self, deadline):
+        self.deadline = deadline  # loop.time() by which the call must be done
+        self.cancelled = False
+        self.future = None  # Exchange in progress on the loop
+
+    def cancel(self):
+        self.cancelled = True
+        if self.future:
+            self.future.cancel()
+
+
+class _loop_com_class(object):
+    """
+    com_class interface for module code running in a worker thread. Each
+    exchange is run on the event loop by the async_com_class of the device,
+    so the port itself is only ever touched by the loop
+    """
+
+    def __init__(self, com, loop):
+        self.com = com
+        self.loop = loop
+        self.call = _call_state(None)  # Of the module method running
+
+    @property
+    def DEFAULT_RD_TIMEOUT(self):
+        return self.com.DEFAULT_RD_TIMEOUT
+
+    @property
+    def pacing(self):
+        return self.com.pacing
+
+    @property
+    def ser(self):
+        return self.com.ser
+
+    def _timeout(self, timeout):
+        """ Shorten a read timeout to the deadline of the call """
+        if self.call.deadline is None:
+            return timeout
+        return max(min(timeout, self.call.deadline - self.loop.time()), 0)
+
+    def _run(self, coro):
+        call = self.call
+        if call.cancelled:
+            coro.close()
+            raise CommandCancelled()
+        call.future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return call.future.result()
+        except concurrent.futures.CancelledError:
+            raise CommandCancelled()
+        finally:
+            call.future = None
+
+    def send_str(self, string):
+        self._run(self.com.send_str(string))
+
+    def read_response(self, timeout):
+        return self._run(self.com.read_response(self._timeout(timeout)))
+
+    def raw_read(self, timeout, read_until):
+        return self._run(self.com.raw_read(self._timeout(timeout), read_until))
+
+    def send_binary(self, binary):
+        self._run(self.com.send_binary(binary))
+
+
+class async_module_class(object):
+    """
+    Every module_class method of one device as a coroutine, Ex:
+        ag = async_module_class(com)
+        cal = await ag.rtcGetCalendar(deadline=5)
+
+    The hot methods (rtcGetCalendar, lteAt, bleEsDevices) are coroutines of
+    their own that exchange with the CLI on the event loop. Any other module
+    code is shared with the sync API: it runs in a worker thread while its
+    CLI exchanges are awaited on the event loop. Workers are shared by all
+    devices and only held while a method runs, so idle devices cost no
+    thread; beyond WORKERS methods at once, calls wait for a worker, which
+    is reported (see set_workers). The optional deadline (seconds) caps
+    every read of the call, whatever timeout the module method asks for.
+    Cancelling the call cancels the exchange in progress and stops the
+    method at its next exchange. Calls to one device run one at a time, in
+    order.
+    """
+
+    WORKERS = 32  # Module methods running at once, over all devices
+    _executor = None  # Shared by every device, made on first use
+    _running = 0  # Module methods handed to the workers and not done
+    _waiting = 0  # Most methods waiting for a worker since the queue was empty
+
+    def __init__(self, com):
+        self.com = com  # async_com_class of the device
+        self.lock = None  # Held from the start to the end of a call
+        self.bridge = _loop_com_class(com, None)  # Loop set by each call
+        self.modules = module_class(self.bridge)
+
+    @classmethod
+    def executor(cls):
+        if cls._executor is None:
+            cls._executor = concurrent.futures.ThreadPoolExecutor(cls.WORKERS)
+        return cls._executor
+
+    @classmethod
+    def set_workers(cls, workers):
+        """
+        Change how many module methods run at once over all devices. Methods
+        already handed to the workers finish on the previous ones
+        """
+        cls.WORKERS = workers
+        if cls._executor is not None:
+            cls._executor.shutdown(wait=False)
+            cls._executor = None
+
+    @classmethod
+    def _worker_started(cls):
+        cls._running += 1
+        waiting = cls._running - cls.WORKERS
+        if waiting > cls._waiting:
+            if not cls._waiting:
+                print(
+                    "Warning: Module calls waiting for a worker, all {} are busy"
+                    " (see async_module_class.set_workers)".format(cls.WORKERS)
+                )
+            cls._waiting = waiting
+
+    @classmethod
+    def _worker_done(cls):
+        cls._running -= 1
+        if cls._waiting and cls._running <= cls.WORKERS:
+            print(
+                "Module calls no longer waiting for a worker, {} waited at"
+                " most".format(cls._waiting)
+            )
+            cls._waiting = 0
+
+    def __getattr__(self, name):
+        method = getattr(self.modules, name)
+        if not callable(method):
+            return method
+
+        async def call(*args, deadline=None, **kwargs):
+            return await self._call(method, args, kwargs, deadline)
+
+        call.__name__ = name
+        call.__doc__ = method.__doc__
+        return call
+
+    async def _acquire(self):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        await self.lock.acquire()
+
+    async def _call(self, method, args, kwargs, deadline):
+        loop = asyncio.get_running_loop()
+        if deadline is not None:
+            deadline += loop.time()
+        call = _call_state(deadline)
+
+        def run():
+            if call.cancelled:  # Cancelled while queued
+                raise CommandCancelled()
+            self.bridge.loop = loop
+            self.bridge.call = call
+            return method(*args, **kwargs)
+
+        await self._acquire()
+        try:
+            task = loop.run_in_executor(self.executor(), run)
+        except BaseException:
+            self.lock.release()
+            raise
+        self._worker_started()
+
+        def done(task):  # Even if cancelled
+            self._worker_done()
+            self.lock.release()
+
+        task.add_done_callback(done)
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            call.cancel()
+            task.add_done_callback(_discard)  # Ends with CommandCancelled
+            raise
+
+    async def _exchange(self, command, deadline, delay=0):
+        """
+        Send a module command and read its response on the event loop
+        :param deadline: Seconds the whole exchange may take, None for no cap
+        :param delay: Seconds to let the module work before reading
+        :return: Response, as the module_class method would read it
+        """
+        loop = asyncio.get_running_loop()
+        timeout = self.com.DEFAULT_RD_TIMEOUT
+        if deadline is not None:
+            deadline += loop.time()
+        await self._acquire()
+        try:
+            await self.com.send_str(command)
+            if delay:
+                remaining = delay if deadline is None else deadline - loop.time()
+                await asyncio.sleep(max(min(delay, remaining), 0))
+            if deadline is not None:
+                timeout = max(min(timeout, deadline - loop.time()), 0)
+            return await self.com.read_response(timeout)
+        finally:
+            self.lock.release()
+
+    async def rtcGetCalendar(self, deadline=None):
+        command = self.modules.rtc_module_name + " GET_CALENDAR\r\n"
+        print("\r\nsending...%s" % command.rstrip())
+        resp = await self._exchange(command, deadline)
+        return self.modules.rtcParseCalendar(resp)
+
+    async def lteAt(self, ATCmd, deadline=None):
+        command = self.modules.lte_module_name + " SEND AT" + ATCmd + "\r\n"
+        print("\r\nsending...%s" % command.rstrip())
+        resp = await self._exchange(command, deadline, lte_module.timeout_sec)
+        return self.modules.lteParseAt(resp)
+
+    async def bleEsDevices(self, deadline=None):
+        command = self.modules.ble_module_name + " AT es_devices\r\n"
+        resp = await self._exchange(command, deadline)
+        return self.modules.bleParseEsDevices(resp)
+
+    def close(self):
+        self.com.disconnect()
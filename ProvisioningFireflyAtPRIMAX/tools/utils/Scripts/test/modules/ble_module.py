@@ -122,7 +122,10 @@ class ble_class(object):
 
     def bleEsDevices(self):
         self.__write("AT es_devices")
-        resp = self.__read()
+        return self.bleParseEsDevices(self.__read())
+
+    def bleParseEsDevices(self, resp):
+        # Response of AT es_devices, shared with modules.async_modules
         env_sensors = {}
         try:
             r = re.compile(r"(-?\d+) ([0-9A-F:]*) (ES-2 \d{6})")
@@ -0,0 +1,232 @@
+""" Staging of DFU packages in QSPI, shared by the BLE and sensor update scripts """
+import json
+import os
+from time import time
+
+from firmware import (  # Put on sys.path by utils
+    ChecksumCache,
+    ErasePlan,
+    FlashStateDB,
+    TransferJournal,
+    data_checksum,
+)
+from transport import ChunkSizer
+
+from .modules import module_class
+
+
+class dfu_class(module_class):
+    """
+    Sends the files of a DFU package to their QSPI offsets: erases only the
+    sectors the package needs, skips files QSPI already holds and resumes
+    interrupted transfers. Update scripts give package_files(), DFU_REGION,
+    RESP_VALUES, dfu_exit() and parse_response()
+    """
+
+    CHUNK_SIZE = 4 * 1024
+    MIN_CHUNK_SIZE = 512  # Smallest chunk to shrink to on a failing link
+    RETRY_COUNT = 10  # Retry count
+    EXMEM_RAW_ID = 65281  # 0xFF01, external memory region the files go to
+    DFU_REGION = None  # (start, end) of the staging region, may be erased whole
+
+    window = 1  # Chunks in flight, > 1 needs firmware that buffers WR_FW
+
+    def __init__(self, arg):
+        module_class.__init__(self, arg)
+        self.checksum_cache = ChecksumCache()
+        self.chunk_sizer = ChunkSizer(self.CHUNK_SIZE, self.MIN_CHUNK_SIZE)
+        self.journal = TransferJournal()  # To resume interrupted transfers
+        self.flash_state = FlashStateDB()  # Images already in QSPI
+        self.csn = None  # Identifies EVE in the journal and flash state
+        self.transfers = {}  # offset: journaled transfer of the file sent there
+
+    def package_files(self):
+        """
+        Files of the package and the QSPI offsets they go to
+        :return: list of (file path, offset)
+        """
+        raise NotImplementedError
+
+    def write_ranges(self):
+        """
+        QSPI byte ranges the package in the manifest will be written to
+        :return: list of (start, end)
+        """
+        return [
+            (offset, offset + os.path.getsize(path))
+            for path, offset in self.package_files()
+        ]
+
+    def get_csn(self):
+        """
+        Read the CSN identifying EVE in the journal and flash state
+        :return: CSN, None if unknown
+        """
+        if self.csn is None:
+            try:
+                self.csn = str(json.loads(self.rdCSN())["SN"]["MSG"]["INFO"])
+            except:
+                print("Unable to read CSN, transfer can't be resumed")
+        return self.csn
+
+    def open_transfers(self):
+        """
+        Get the journaled transfer of each file of the package
+        :return: True if an interrupted transfer of the package is resumed
+        """
+        self.transfers = {}
+        csn = self.get_csn()
+        for path, offset in self.package_files():
+            self.transfers[offset] = self.journal.open(
+                csn,
+                self.checksum_cache.digest(path),
+                offset,
+                os.path.getsize(path),
+            )
+        return bool(self.transfers) and all(
+            transfer.erased for transfer in self.transfers.values()
+        )
+
+    def in_qspi(self, path, offset):
+        """
+        Check the flash state for a file of the package
+        :return: True if QSPI already holds the file at offset
+        """
+        return self.flash_state.holds(
+            self.get_csn(),
+            offset,
+            self.checksum_cache.digest(path),
+            os.path.getsize(path),
+        )
+
+    def finish_transfers(self):
+        """
+        Drop the package from the transfer journal once EVE took it
+        """
+        for transfer in self.transfers.values():
+            transfer.done()
+        self.transfers = {}
+
+    def prep_qspi(self):
+        """
+        Erase QSPI sectors to write firmware, only those the package needs.
+        Skipped when resuming an interrupted transfer of the same package;
+        files share sectors, so anything less starts over from the erase
+        """
+        files = self.package_files()
+        if files and all(self.in_qspi(path, offset) for path, offset in files):
+            print("Package already in QSPI, skipping erase and transfer")
+            return
+        if self.open_transfers():
+            sent = sum(t.acked_bytes for t in self.transfers.values())
+            print("Resuming interrupted transfer, {} bytes already sent".format(sent))
+            return
+        for transfer in self.transfers.values():
+            transfer.reset()
+
+        plan = ErasePlan(self.write_ranges(), [self.DFU_REGION])
+        print("Erasing " + str(plan))
+        if plan.extent:
+            self.flash_state.erased(self.get_csn(), *plan.extent)
+        for sec_arg, sec_addr in plan:
+            print("Erasing Sec addr " + hex(sec_addr)[2:])
+            resp = self.qspiSEC_ER(sec_arg, hex(sec_addr)[2:])
+            resp = self.parse_response(resp, "QSPI", True)
+            # Check for failure
+            if resp != self.RESP_VALUES[0]:
+                self.dfu_exit()
+
+        for transfer in self.transfers.values():
+            transfer.mark_erased()
+
+    def send_file(self, file_name, offset):
+        """
+        Send image to EVE
+        """
+        if self.in_qspi(file_name, offset):
+            print("Already in QSPI " + file_name)
+            return
+        with open(file_name, "rb") as binary_file:
+            binary = binary_file.read()
+        # Get checksum of each chunk up front (cached)
+        checksums = self.checksum_cache.lookup(file_name, self.CHUNK_SIZE)[2]
+        transfer = self.transfers.get(offset)
+        if transfer is None:
+            transfer = self.journal.open(None, None, offset, len(binary))
+        print("Sending " + file_name)
+        # Only the parts EVE did not acknowledge in an earlier run
+        chunks = []
+        for pos, checksum in zip(range(0, len(binary), self.CHUNK_SIZE), checksums):
+            chunk_offset = offset + pos
+            binary_data = binary[pos : pos + self.CHUNK_SIZE]
+            for start, end in transfer.pending(
+                chunk_offset, chunk_offset + len(binary_data)
+            ):
+                piece = binary_data[start - chunk_offset : end - chunk_offset]
+                if len(piece) != len(binary_data):
+                    checksum = data_checksum(piece)
+                chunks.append((hex(checksum), hex(start), piece))
+        try:
+            # Keep several chunks in flight if the firmware supports it, whatever
+            # it did not acknowledge is sent one by one below
+            if self.window > 1:
+                chunks = self.fw_update_WR_FW_window(
+                    chunks, self.window, self.RETRY_COUNT, transfer.ack
+                )
+                if chunks:
+                    self.window = 1
+            # Send chunk size of data, in smaller pieces while the link keeps failing
+            for chunk_checksum, chunk_offset, binary_data in chunks:
+                pos = 0
+                retry = 0  # Failures of the current piece at MIN_CHUNK_SIZE
+                while pos < len(binary_data):
+                    at_min = self.chunk_sizer.at_min
+                    piece = binary_data[pos : pos + self.chunk_sizer.size]
+                    piece_checksum = chunk_checksum
+                    if len(piece) != len(binary_data):
+                        piece_checksum = hex(data_checksum(piece))
+
+                    # send binary
+                    start_time = time()
+                    resp = self.fw_update_WR_FW(
+                        piece_checksum,
+                        hex(int(chunk_offset, 16) + pos),
+                        piece,
+                        len(piece),
+                    )
+
+                    # Parse response
+                    resp_value = self.parse_response(resp, "FW_UPDATE", True)
+                    passed = resp_value == self.RESP_VALUES[0]
+                    self.chunk_sizer.record(len(piece), passed, time() - start_time)
+
+                    # Next piece on success
+                    if passed:
+                        piece_offset = int(chunk_offset, 16) + pos
+                        transfer.ack(piece_offset, piece_offset + len(piece))
+                        pos += len(piece)
+                        retry = 0
+                        continue
+                    # ADAM-1662 : retry was not reaching the max value "RETRY_COUNT" in case of failure
+                    # Hence script kept sending next chunk of data even when last chunk failed
+                    # Now script will stop immediately if any data chunk fails for "RETRY_COUNT" times
+                    retry += 1 if at_min else 0
+                    if retry >= self.RETRY_COUNT:
+                        print("Failed to transmit binary data")
+                        self.dfu_exit()
+                    else:
+                        print(
+                            "Retrying with {} byte chunks...".format(
+                                self.chunk_sizer.size
+                            )
+                        )
+        finally:  # What EVE took so far, also when giving up
+            transfer.flush()
+        self.flash_state.written(
+            self.get_csn(),
+            offset,
+            self.checksum_cache.digest(file_name),
+            len(binary),
+            self.EXMEM_RAW_ID,
+            offset,
+        )
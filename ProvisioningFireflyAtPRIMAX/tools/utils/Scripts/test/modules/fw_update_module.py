@@ -1,9 +1,12 @@
 import json
 import time
 
+from transport import WindowedSender  # Put on sys.path by utils
+
 
 class fw_update_class(object):
     fw_update_module_name = "FW_UPDATE"
+    WR_FW_WINDOW_TIMEOUT = 30  # To wait for the reply to the oldest chunk in flight
 
     def __init__(self, arg):
         self.__cmdComm = arg
@@ -50,23 +53,55 @@ class fw_update_class(object):
         self.__write(cmd)
 
         # ADAM-1662 : Additional checks has been added in Application while writing binary
-        # Slow down the data rate
-        time.sleep(0.1)
+        # Slow down the data rate, as much as the failures so far require
+        self.__cmdComm.pacing.wait("chunk")
         # Send image
         self.__write_binary(data)
         # Send binary here
         resp = self.__read()
         try:
             json_obj = json.loads(resp)
-            print(
-                "WR_FW successful..."
-                + str(json_obj[self.fw_update_module_name]["RESULT"])
-            )
+            result = json_obj[self.fw_update_module_name]["RESULT"]
+            self.__cmdComm.pacing.record("chunk", result == "PASS")
+            print("WR_FW successful..." + str(result))
             return resp
         except:
+            self.__cmdComm.pacing.record("chunk", False)
             print("WR_FW READ operation failed\r\n")
             return None
 
+    def fw_update_WR_FW_window(self, chunks, window, retries, on_ack=None):
+        """
+        Send chunks keeping window of them in flight, see transport.window
+        :param chunks: (checksum, offset, data) of each chunk, as for WR_FW
+        :param window: Chunks in flight
+        :param retries: Sends of one chunk before giving up on the window
+        :param on_ack: Called with (start, end) of each acknowledged chunk
+        :return: (checksum, offset, data) of chunks not acknowledged
+        """
+        by_offset = {}
+        cmds = []
+        for checksum, offset, data in chunks:
+            cmd = (
+                "WR_FW" + " " + str(checksum) + " " + str(offset) + " " + str(len(data))
+            )
+            key = int(str(offset), 16)
+            by_offset[key] = (checksum, offset, data)
+            cmds.append((key, self.fw_update_module_name + " " + cmd, data))
+
+        sender = WindowedSender(
+            self.__cmdComm.ser,
+            window,
+            self.fw_update_module_name,
+            self.WR_FW_WINDOW_TIMEOUT,
+            retries,
+        )
+        remaining = sender.send(cmds, on_ack)
+        print("WR_FW window sent {} chunks".format(len(cmds) - len(remaining)))
+        if remaining:
+            print("WR_FW window stopped ({})".format(sender.error))
+        return [by_offset[chunk[0]] for chunk in remaining]
+
     def fw_updateWR_BLE_DFU_INFO(
         self,
         img_type,
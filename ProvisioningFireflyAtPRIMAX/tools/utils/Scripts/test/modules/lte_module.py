@@ -48,7 +48,10 @@ class lte_class(object):
         cmd = "SEND AT" + ATCmd
         self.__write(cmd)
         time.sleep(timeout_sec)
-        resp = self.__read()
+        return self.lteParseAt(self.__read())
+
+    def lteParseAt(self, resp):
+        # Response of SEND AT, shared with modules.async_modules
         try:
             json_obj = json.loads(resp)
             print("Command send..." + str(json_obj[self.lte_module_name]["RESULT"]))
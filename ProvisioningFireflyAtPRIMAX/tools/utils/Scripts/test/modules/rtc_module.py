@@ -78,7 +78,10 @@ class rtc_class(object):
 
     def rtcGetCalendar(self):
         self.__write("GET_CALENDAR")
-        resp = self.__read()
+        return self.rtcParseCalendar(self.__read())
+
+    def rtcParseCalendar(self, resp):
+        # Response of GET_CALENDAR, shared with modules.async_modules
         try:
             json_obj = json.loads(resp)
             print("Result..." + str(json_obj[self.rtc_module_name]["RESULT"]))
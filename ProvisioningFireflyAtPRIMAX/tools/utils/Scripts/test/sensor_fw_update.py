@@ -11,7 +11,7 @@ import sys
 import signal
 import argparse
 import os
-from time import time, sleep
+from time import sleep
 
 import utils
 import modules
@@ -24,7 +24,6 @@ import binascii
 import serial
 
 MANIFEST_FILE = "manifest.json"
-CHUNK_SIZE = 4 * 1024  # 4KB
 
 APP_INIT_PKT_OFFSET = 2936832  # 0x2CD000
 APP_BINARY_OFFSET = 2937856  # 0x2CD400
@@ -44,7 +43,7 @@ SENSOR_APP_INIT_OFFSET = 2162688  # 0x210000 initial sector is image info
 SENSOR_APP_BINARY_OFFSET = 2166784  # 0x211000 app image begins at next sector
 SENSOR_APP_BINARY_MAX_SIZE = 512 * 1024  # max size is 512KB
 
-RETRY_COUNT = 10  # Retry count
+WR_FW_WINDOW = 1  # Chunks in flight, > 1 needs firmware that buffers WR_FW
 com = None
 qspi = None
 
@@ -55,7 +54,7 @@ def signal_handler(sig, frame):
     sys.exit(0)
 
 
-class DfuPackage(modules.module_class):
+class DfuPackage(modules.dfu_class):
     target_path = None
     zip_file_path = None
     zip_pkg = None
@@ -66,13 +65,21 @@ class DfuPackage(modules.module_class):
     RESP_KEY = "RESULT"
     RESP_VALUES = ["PASS", "FAIL", "TIMEOUT", "INVALID"]
 
+    EXMEM_RAW_ID = BLE_DFU_EXMEM_RAW_ID
+    DFU_REGION = (
+        QSPI_SENSOR_OTA_SEC_START,
+        QSPI_SENSOR_OTA_SEC_START + QSPI_SENSOR_OTA_SEC_COUNT * QSPI_SEC_SIZE,
+    )
+
+    window = WR_FW_WINDOW
+
     def __init__(self, arg, zip_file):
         """
         Check the zip is present and get the target path
         :param arg:
         :param zip_file:
         """
-        modules.module_class.__init__(self, arg)
+        modules.dfu_class.__init__(self, arg)
         if not os.path.isfile(zip_file):
             print("FILE NOT FOUND : Specified zip package does not exist")
             sys.exit(0)
@@ -102,19 +109,21 @@ class DfuPackage(modules.module_class):
             print("ERROR : Invalid zip package")
             self.dfu_exit()
 
-    def prep_qspi(self):
+    def package_files(self):
         """
-        Erase QSPI sectors to write firmware
+        Files of the package in the manifest and the QSPI offsets they go to
+        :return: list of (file path, offset)
         """
-        sec_addr = QSPI_SENSOR_OTA_SEC_START
-        for i in range(1, QSPI_SENSOR_OTA_SEC_COUNT + 1, 1):
-            print("Erasing Sec addr " + hex(sec_addr)[2:])
-            resp = self.qspiSEC_ER(1, hex(sec_addr)[2:])
-            resp = self.parse_response(resp, "QSPI", True)
-            # Check for failure
-            if resp != self.RESP_VALUES[0]:
-                self.dfu_exit()
-            sec_addr = sec_addr + 4096
+        with open(self.manifest_file, "r") as file_list:
+            data_list = json.load(file_list)
+        files = [(self.manifest_file, SENSOR_APP_INIT_OFFSET)]
+        try:
+            bin_file = os.path.join(self.target_path, data_list["files"][0]["file"])
+        except (KeyError, IndexError):
+            return files  # No application in the package
+        if os.path.isfile(bin_file):
+            files.append((bin_file, SENSOR_APP_BINARY_OFFSET))
+        return files
 
     def remove_temp(self):
         """
@@ -130,63 +139,7 @@ class DfuPackage(modules.module_class):
         calculate Crc
         :return: checksum
         """
-        # Open Binary file
-        binary = open(file, "rb")
-        checksum = 0
-        while True:  # Calculate CheckSum
-            binary_data = binary.read(CHUNK_SIZE)  # Try reading 'CHUNK_SIZE' bytes
-            if not binary_data:  # Break if nothing is read
-                break
-            binary_data = binary_data.decode("charmap")
-
-            checksum += sum(map(ord, binary_data))  # Update CheckSum
-
-        # Close bin file
-        binary.close()
-        return checksum
-
-    def send_file(self, file_name, offset):
-        """
-        Send image to EVE
-        """
-        binary = open(file_name, "rb")
-        print("Sending " + file_name)
-        # Send chunk size of data
-        while True:
-            binary_data = binary.read(CHUNK_SIZE)  # Try reading 'CHUNK_SIZE' bytes
-            if not binary_data:  # Break if nothing is read
-                break
-            # Calculate checksum of the chunk
-            binary_data = binary_data.decode("charmap")
-            checksum = sum(map(ord, binary_data))
-            # ADAM-1662 : retry was not reaching the max value "RETRY_COUNT" in case of failure
-            # Hence script kept sending next chunk of data even when last chunk failed
-            # Now script will stop immediately if any data chunk fails for "RETRY_COUNT" times
-            for retry in range(1, RETRY_COUNT + 1, 1):
-                # send binary
-                resp = self.fw_update_WR_FW(
-                    hex(checksum), hex(offset), binary_data, len(binary_data)
-                )
-
-                # Parse response
-                resp_value = self.parse_response(
-                    resp, "FW_UPDATE", True
-                )  # Terminate on failure
-
-                # Break on success
-                if resp_value == self.RESP_VALUES[0]:
-                    break
-                else:
-                    if retry >= RETRY_COUNT:
-                        print("Failed to transmit binary data")
-                        binary.close()
-                        self.dfu_exit()
-                    else:
-                        print("Retrying...")
-            # increment offset
-            offset += len(binary_data)
-        # Close file
-        binary.close()
+        return self.checksum_cache.lookup(file)[0]
 
     def parse_response(self, response, module, display):
         """ Parse the Response and on error terminates program if terminate flag is Set """
@@ -285,6 +238,7 @@ class DfuPackage(modules.module_class):
         Send app package and manifest to eve
         """
         self.send_application()
+        print("\n".join(self.chunk_sizer.report()))
 
     def update_sensor(self):
         resp = self.fw_updateXFER_SENSOR()
@@ -313,12 +267,23 @@ if __name__ == "__main__":
         "-pkg", "--package", required=True, metavar="", help="Zip package not Found"
     )
 
+    ap.add_argument(
+        "-w",
+        "--window",
+        required=False,
+        metavar="",
+        type=int,
+        default=WR_FW_WINDOW,
+        help="Chunks in flight, only for firmware that buffers WR_FW commands",
+    )
+
     args = vars(ap.parse_args())
 
     # Connect to EVE
     com = utils.com_class()
     # create object for dfu class
     dfu = DfuPackage(com, args["package"])
+    dfu.window = args["window"]
     if args["baud"]:
         com.connect(args["port"], args["baud"], 1)
     else:
@@ -332,6 +297,7 @@ if __name__ == "__main__":
 
     # Send update package to eve
     dfu.send_fw_to_eve()
+    dfu.finish_transfers()
 
     # Issue command to transfer image to flash on the nRF52840
     #    dfu.update_SENSOR()
@@ -0,0 +1,71 @@
+"""
+asyncio counterpart of com_class (Python 3 only, import as utils.async_com)
+"""
+
+from .com import com_class
+from transport.aio import AsyncSerialTransport  # Put on sys.path by com
+
+
+class async_com_class:
+    """ Communication class, every exchange is a coroutine """
+
+    # TimeOuts
+    DEFAULT_RD_TIMEOUT = com_class.DEFAULT_RD_TIMEOUT
+
+    def __init__(self):
+        self.ser = None
+        self.sent = None  # Last string sent, to check its echo
+
+    @property
+    def pacing(self):
+        """ Adaptive delays of the port, see transport.pacing """
+        return self.ser.pacing
+
+    async def connect(self, *args):
+        """ To establish connection between EVE and the PC """
+        self.ser = AsyncSerialTransport(str(args[0]), args[1], float(args[2]))
+        try:
+            await self.ser.open()
+        except Exception:
+            print("Failed to establish connection with EVE on {}".format(args[0]))
+            raise  # Leave the other ports running
+        print("Connected to EVE")
+        print(self.ser)
+
+    def disconnect(self):
+        """ Disconnects the connection between EVE and the PC """
+        self.ser.close()
+        print("Disconnected")
+
+    async def send_str(self, string):
+        """ Send String """
+        await self.ser.wait_pace("cmd")
+        self.ser.flush()  # Flush input buffer
+
+        # Send String, byte by byte with a delay if EVE could not keep up
+        delay = self.pacing["byte"].delay
+        await self.ser.write(string, 1 if delay else None, delay)
+        self.sent = string
+
+    async def read_response(self, timeout):
+        """ Read Response """
+        localEcho = await self.ser.readline(timeout)  # To omit local echo
+        if self.sent is not None:  # Slow down if EVE garbled the echo
+            self.ser.record_echo(self.sent.strip() in localEcho.decode("charmap"))
+            self.sent = None
+
+        # Read entire data
+        line = await self.ser.read_until(b"\n$", timeout)
+        line = line.decode("charmap")
+        if "$" in line:
+            line = line[:-1].strip()  # Remove '$'
+        location = line.find("{")
+        return line[location:]
+
+    async def raw_read(self, timeout, read_until):
+        """ Raw Read console """
+        return (await self.ser.read_until(read_until, timeout)).decode("utf8")
+
+    async def send_binary(self, binary):
+        """ Send binary image """
+        await self.ser.write(binary)
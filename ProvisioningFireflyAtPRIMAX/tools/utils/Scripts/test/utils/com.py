@@ -1,35 +1,40 @@
-import time
-import serial
+import os
 import sys
 
+# The serial transport is shared with the station tools two directories up
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+from transport import SerialTransport
+
 
 class com_class:
     """ Communication class """
 
     # TimeOuts
-    INTER_BYTE_TIMEOUT = 0.001
     DEFAULT_RD_TIMEOUT = 30000
 
     def __init__(self):
         self.ser = None
+        self.sent = None  # Last string sent, to check its echo
+
+    @property
+    def pacing(self):
+        """ Adaptive delays of the port, see transport.pacing """
+        return self.ser.pacing
 
     def connect(self, *args):
         """ To establish connection between EVE and the PC """
 
         # Connect to serial COM port with specified configuration
         try:
-            self.ser = serial.Serial(
-                port=str(args[0]), baudrate=args[1], timeout=float(args[2])
-            )
+            self.ser = SerialTransport(str(args[0]), args[1], float(args[2]))
+            self.ser.open()
 
             # Print Connection Info to user
             print("Connected to EVE")
             print(self.ser)
 
-            # Clear serial port
-            self.ser.flushInput()
-            self.ser.flushOutput()
-
         # Ensure EVE console is not busy
         # self.send_str('HELP\r\n')
         # res = self.read_response(com.DEFAULT_RD_TIMEOUT)
@@ -46,22 +51,24 @@ class com_class:
     def send_str(self, string):
         """ Send String """
         # Wait for sometime to flush unread data
-        time.sleep(0.1)
-        self.ser.flushInput()  # Flush input buffer
+        self.pacing.wait("cmd")
+        self.ser.flush()  # Flush input buffer
 
-        for data in string:  # Read Byte from String
-            data = data.encode("charmap")  # Encode Byte
-            self.ser.write(data)  # Send Byte
-            time.sleep(self.INTER_BYTE_TIMEOUT)  # Wait for Timeout
+        # Send String, byte by byte with a delay if EVE could not keep up
+        delay = self.pacing["byte"].delay
+        self.ser.write(string, 1 if delay else None, delay)
+        self.sent = string
 
     def read_response(self, timeout):
         """ Read Response """
         #        time.sleep(0.1)
-        self.ser.timeout = timeout  # Configure Serial timeout
-        localEcho = self.ser.readline()  # To omit local echo, read a line here
+        localEcho = self.ser.readline(timeout)  # To omit local echo, read a line here
+        if self.sent is not None:  # Slow down if EVE garbled the echo
+            self.ser.record_echo(self.sent.strip() in localEcho.decode("charmap"))
+            self.sent = None
 
         # Read entire data
-        line = self.ser.read_until(b"\n$")
+        line = self.ser.read_until(b"\n$", timeout)
 
         # Debug output of printERRORs  TODO: Add logging
         # if line.startswith("[E 20"):
@@ -84,15 +91,8 @@ class com_class:
     def raw_read(self, timeout, read_until):
         """ Raw Read console """
 
-        self.ser.timeout = timeout  # Configure Serial timeout
-        data = []
-        data.append(self.ser.read_until(read_until))
-        return b"".join(data).decode("utf8")
+        return self.ser.read_until(read_until, timeout).decode("utf8")
 
     def send_binary(self, binary):
         """ Send binary image """
-        for data in binary:  # Read Byte from String
-            # print '%x' % ord(data)
-            data = data.encode("charmap")
-            self.ser.write(data)
-            self.ser.flushOutput()
+        self.ser.write(binary)
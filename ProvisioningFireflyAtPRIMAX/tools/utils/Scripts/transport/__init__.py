@@ -0,0 +1,9 @@
+# __init__.py
+from .port import SerialTransport
+from .protocol import EchoError
+from .framer import ResponseFramer
+from .writer import ChunkedWriter
+from .window import WindowedSender
+from .sizing import ChunkSizer
+from .stats import LatencyStats
+from .pacing import PacingController
@@ -0,0 +1,273 @@
+"""
+asyncio serial transport to the EVE/AG-55 CLI console (Python 3 only)
+
+Not imported by the transport package, which the station tools still load
+on Python 2. Import it as transport.aio.
+"""
+
+import asyncio
+import os
+
+import serial
+
+from .framer import ResponseFramer
+from .pacing import PacingController
+from .protocol import (
+    cmd_bytes,
+    echo_block_size,
+    echo_error,
+    parse_reply,
+    pop_reply,
+    pop_until,
+)
+from .stats import LatencyStats
+from .writer import to_bytes
+
+
+class AsyncSerialTransport(object):
+    """
+    Coroutine counterpart of SerialTransport for one device, so one event
+    loop can drive many ports.
+
+    On POSIX the port fd is non-blocking and read by the event loop as soon
+    as it is readable; writes go out through the loop as the fd accepts
+    them. Elsewhere, or for a port object without a fd (Ex: the emulator),
+    the port is polled and written from the default executor.
+    Cancelling a coroutine leaves the port usable: the next cmd flushes
+    whatever the interrupted exchange left behind.
+    """
+
+    # TimeOuts in seconds
+    DEFAULT_RD_TIMEOUT = 1  # To wait for the next line of a response
+
+    ECHO_BLOCK_SIZE = 256  # Cmd bytes sent before reading back their echo
+    READ_SIZE = 4096  # Bytes per read of a readable fd
+    POLL_INTERVAL = 0.005  # Seconds between polls of a port without fd
+
+    def __init__(self, port, baud, timeout=DEFAULT_RD_TIMEOUT, echo_lockstep=False):
+        self.port = port
+        self.baud = baud
+        self.timeout = timeout
+        self.echo_lockstep = echo_lockstep  # Echo cmd byte by byte (old firmware)
+        self.ser = None
+        self.fd = None  # Non-blocking fd read by the loop, None if polled
+        self.loop = None
+        self.framer = ResponseFramer()
+        self.pacing = None  # Learned delays of the port, loaded on open
+        self.stats = LatencyStats()
+        self.error = None  # Why the port stopped delivering data
+        self._data = None  # Set whenever data arrives
+        self._poller = None
+        self._pending = None  # [cmd, start time] of the cmd awaiting response
+
+    def __str__(self):
+        return str(self.ser)
+
+    async def open(self):
+        """ Open the port and start receiving from it """
+        ser = serial.Serial(port=self.port, baudrate=self.baud, timeout=0)
+        self.attach(ser, PacingController(self.port))
+
+    def attach(self, ser, pacing):
+        """ Receive from an already open port object on the running loop """
+        self.loop = asyncio.get_event_loop()
+        self.ser = ser
+        self.pacing = pacing
+        self._data = asyncio.Event()
+        self.framer.clear()
+        fileno = getattr(ser, "fileno", None)
+        if os.name == "posix" and fileno:
+            self.fd = fileno()
+            os.set_blocking(self.fd, False)
+            self.loop.add_reader(self.fd, self._on_readable)
+        else:
+            self._poller = self.loop.create_task(self._poll())
+
+    def close(self):
+        if self.fd is not None:
+            self.loop.remove_reader(self.fd)
+            self.fd = None
+        if self._poller:
+            self._poller.cancel()
+            self._poller = None
+        if self.ser:
+            self.ser.close()
+        if self.pacing:
+            self.pacing.save()
+
+    @property
+    def is_open(self):
+        return bool(self.ser) and self.ser.isOpen() and self.error is None
+
+    def _received(self, data):
+        self.framer.feed(data)
+        self._data.set()
+
+    def _on_readable(self):
+        """ The fd is readable, nothing to read then means the device is gone """
+        try:
+            data = os.read(self.fd, self.READ_SIZE)
+        except BlockingIOError:
+            return
+        except OSError as err:
+            data, self.error = b"", err
+        if not data:  # Device gone (USB adapter unplugged)
+            self.error = self.error or "port closed"
+            self.loop.remove_reader(self.fd)
+            self._data.set()
+            return
+        self._received(data)
+
+    async def _poll(self):
+        while True:
+            try:
+                waiting = self.ser.in_waiting
+                if waiting:
+                    self._received(self.ser.read(waiting))
+            except (serial.SerialException, OSError) as err:
+                self.error = err
+                self._data.set()
+                return
+            await asyncio.sleep(self.POLL_INTERVAL)
+
+    async def _fill(self, deadline):
+        """
+        Wait for more data to be received
+        :param deadline: loop.time() value up to which to wait
+        :return: False if nothing arrived before deadline
+        """
+        self._data.clear()
+        left = deadline - self.loop.time()
+        if left <= 0 or self.error is not None:
+            return False
+        try:
+            await asyncio.wait_for(self._data.wait(), left)
+        except asyncio.TimeoutError:
+            return False
+        return self.error is None
+
+    def flush(self):
+        """ Drop anything received so far """
+        if self.fd is not None:
+            try:
+                while os.read(self.fd, self.READ_SIZE):  # What the OS buffered
+                    pass
+            except BlockingIOError:
+                pass
+        self.framer.clear()
+
+    async def _write_fd(self, data):
+        view = memoryview(data)
+        while view:
+            try:
+                view = view[os.write(self.fd, view) :]
+                continue
+            except BlockingIOError:
+                pass
+            writable = self.loop.create_future()
+            self.loop.add_writer(self.fd, writable.set_result, None)
+            try:
+                await writable
+            finally:
+                self.loop.remove_writer(self.fd)
+
+    async def write(self, data, block_size=None, pace=None):
+        """ Send raw data, in blocks of block_size with pace seconds between """
+        data = to_bytes(data)
+        block_size = block_size or len(data) or 1
+        for pos in range(0, len(data), block_size):
+            if pos and pace:
+                await asyncio.sleep(pace)
+            block = data[pos : pos + block_size]
+            if self.fd is not None:
+                await self._write_fd(block)
+            else:
+                await self.loop.run_in_executor(None, self.ser.write, block)
+        return len(data)
+
+    async def read(self, size, timeout):
+        """ Read size bytes, returns less if timeout elapses """
+        deadline = self.loop.time() + max(timeout, 0)
+        while len(self.framer) < size and await self._fill(deadline):
+            pass
+        return self.framer.take(size)
+
+    async def wait_pace(self, name):
+        delay = self.pacing[name].delay
+        if delay:
+            await asyncio.sleep(delay)
+
+    async def send_cmd(self, cmd):
+        """ Send a cmd and verify its echo, raises EchoError on mismatch """
+        await self.wait_pace("cmd")
+        self.flush()
+        start = self.loop.time()
+        data = cmd_bytes(cmd)
+        pace = self.pacing["byte"]
+        block = echo_block_size(self.ECHO_BLOCK_SIZE, self.echo_lockstep, pace.delay)
+        for pos in range(0, len(data), block):  # Send cmd block by block
+            if pos and pace.delay:
+                await asyncio.sleep(pace.delay)
+            wdata = data[pos : pos + block]
+            await self.write(wdata)
+            rdata = await self.read(len(wdata), self.DEFAULT_RD_TIMEOUT)
+            error = echo_error(pos, wdata, rdata)
+            if error:
+                self.stats.record(cmd, self.loop.time() - start, False)
+                self.record_echo(False)
+                raise error
+        self.record_echo(True)
+        await self.readline(self.DEFAULT_RD_TIMEOUT)  # New line ending the cmd
+        self._pending = [cmd, start]
+
+    def record_echo(self, ok):
+        """ Adapt command pacing to whether the CLI echoed a cmd correctly """
+        self.pacing.record("byte", ok)
+        self.pacing.record("cmd", ok)
+
+    async def read_until(self, terminator, timeout):
+        """ Read until terminator is seen, returns what arrived if timeout elapses """
+        terminator = to_bytes(terminator)
+        deadline = self.loop.time() + max(timeout, 0)
+        data = pop_until(self.framer, terminator)
+        while data is None:
+            data = pop_until(self.framer, terminator, await self._fill(deadline))
+        return data
+
+    async def readline(self, timeout):
+        """ Read one line, returns b"" if nothing arrives within timeout """
+        return await self.read_until(b"\n", timeout)
+
+    async def read_reply(self, timeout):
+        """
+        Read a response
+        :param timeout: Time to wait for the response to start
+        :return: (text of the response, True if terminated by the prompt)
+        """
+        deadline = self.loop.time() + max(timeout, 0)
+        reply = pop_reply(self.framer)
+        while reply is None:  # Until the prompt, or no response
+            more = await self._fill(deadline)
+            deadline = self.loop.time() + self.DEFAULT_RD_TIMEOUT
+            reply = pop_reply(self.framer, more)
+        output, complete = reply
+
+        if self._pending:
+            cmd, start = self._pending
+            self.stats.record(cmd, self.loop.time() - start, complete)
+            self._pending = None
+        return output.decode("charmap"), complete
+
+    async def read_response(self, timeout):
+        """ Read a response, returns a JSON object if it parses else its text """
+        return parse_reply((await self.read_reply(timeout))[0])
+
+    async def command(self, cmd, timeout):
+        """ Send a cmd and read its response, within timeout seconds overall """
+        deadline = self.loop.time() + timeout
+
+        async def exchange():
+            await self.send_cmd(cmd)
+            return await self.read_response(deadline - self.loop.time())
+
+        return await asyncio.wait_for(exchange(), timeout)
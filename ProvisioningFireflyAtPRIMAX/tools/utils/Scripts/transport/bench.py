@@ -0,0 +1,170 @@
+"""
+Microbenchmark of the response framer against the readline based reads
+
+Usage (from the Scripts directory):
+    python -m transport.bench [-b BOOT_LOG] [-d DUMP_DB_REPLY] [-n ROUNDS]
+
+Recorded captures (raw bytes as received from the port) can be given for the
+boot log and the "BLE AT dump_db" reply, synthetic ones are used otherwise.
+The port is simulated in memory, so the numbers show the host side cost only;
+on real hardware every read() call is also a system call.
+"""
+
+import argparse
+import json
+
+from .port import SerialTransport, clock
+
+
+class ReplayPort(object):
+    """ In memory stand-in for serial.Serial replaying a capture """
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+        self.timeout = 1
+        self.reads = 0
+
+    @property
+    def in_waiting(self):
+        return len(self.data) - self.pos
+
+    def read(self, size=1):
+        self.reads += 1
+        data = self.data[self.pos : self.pos + size]
+        self.pos += len(data)
+        return data
+
+    def readline(self):
+        """ Same algorithm as pyserial: one read() per byte """
+        line = bytearray()
+        while True:
+            c = self.read(1)
+            if not c:
+                break
+            line += c
+            if c == b"\n":
+                break
+        return bytes(line)
+
+
+def legacy_read_response(com):
+    """ read_response as implemented in the tools before the framer """
+    output = ""
+    line = com.readline()  # Read 1st line of Response
+    while True:
+        if line == b"{\r\n":  # This is the start of response
+            output = ""  # Clear output
+        elif len(line) == 1 and line == b"$":  # Previous line was end of response
+            try:
+                return json.loads(output)  # Convert to JSON object
+            except:
+                return output  # Return Response
+        elif not line:  # No response
+            return output  # Timeout error
+
+        output += line.decode("charmap")  # Part of response, store it
+        line = com.readline()  # Read next line of Response
+
+
+def legacy_scan_boot_log(com, look_for):
+    """ Boot log scan as done by the handshake loops before the framer """
+    while True:
+        line = com.readline()
+        if not line:
+            return False
+        if look_for in line.decode("charmap"):
+            return True
+
+
+def framer_read_response(com):
+    transport = SerialTransport(None, None)
+    transport.ser = com
+    return transport.read_response(0)
+
+
+def framer_scan_boot_log(com, look_for):
+    transport = SerialTransport(None, None)
+    transport.ser = com
+    while True:
+        line = transport.readline(0)
+        if not line:
+            return False
+        if look_for in line.decode("charmap"):
+            return True
+
+
+def synthetic_boot_log(lines):
+    log = bytearray()
+    for index in range(lines):
+        log += "[I {:08d}] module_{}: init step {} done, status 0x{:08x}\r\n".format(
+            index * 13, index % 17, index, index * 2654435761 & 0xFFFFFFFF
+        ).encode("charmap")
+    log += b"Welcome to EVE CLI\r\n$"
+    return bytes(log)
+
+
+def synthetic_dump_db(entries):
+    response = {}
+    for index in range(entries):
+        mac = ":".join("{:02X}".format((index * 7 + n) & 0xFF) for n in range(6))
+        response[str(index)] = "{}. {} Security level: {} RSSI: -{} dBm".format(
+            index, mac, index % 4, 40 + index % 50
+        )
+    reply = json.dumps(
+        {"BLE": {"CMD": "AT", "MSG": {"RESPONSE": response}, "RESULT": "PASS"}},
+        indent=1,
+    ).replace("\n", "\r\n")
+    return ("BLE AT dump_db\r\n\r\n" + reply + "\r\n$").encode("charmap")
+
+
+def bench(name, func, data, rounds, *args):
+    best = None
+    reads = 0
+    for _ in range(rounds):
+        com = ReplayPort(data)
+        start = clock()
+        result = func(com, *args)
+        elapsed = clock() - start
+        best = elapsed if best is None else min(best, elapsed)
+        reads = com.reads
+    print("{:<28} {:>10} {:>10.2f} {:>10}".format(name, len(data), best * 1000, reads))
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Response framer microbenchmark")
+    ap.add_argument("-b", "--boot-log", help="Recorded boot log capture")
+    ap.add_argument("-d", "--dump-db", help="Recorded 'BLE AT dump_db' reply")
+    ap.add_argument("-n", "--rounds", type=int, default=5, help="Rounds per case")
+    args = ap.parse_args()
+
+    if args.boot_log:
+        with open(args.boot_log, "rb") as capture:
+            boot_log = capture.read()
+    else:
+        boot_log = synthetic_boot_log(20000)
+    if args.dump_db:
+        with open(args.dump_db, "rb") as capture:
+            dump_db = capture.read()
+    else:
+        dump_db = synthetic_dump_db(5000)
+
+    print("{:<28} {:>10} {:>10} {:>10}".format("CASE", "BYTES", "BEST[ms]", "READS"))
+    for label, func in (
+        ("readline boot log", legacy_scan_boot_log),
+        ("framer boot log", framer_scan_boot_log),
+    ):
+        bench(label, func, boot_log, args.rounds, "Welcome")
+    results = []
+    for label, func in (
+        ("readline dump_db", legacy_read_response),
+        ("framer dump_db", framer_read_response),
+    ):
+        results.append(bench(label, func, dump_db, args.rounds))
+    if results[0] != results[1]:
+        print("\nError: framer and readline responses differ")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+EVE CLI emulator and WR_FW transfer benchmark
+
+Usage (from the Scripts directory):
+    python -m transport.emulator [-s SIZE_KB] [-c CHUNK_KB] [-w WINDOW ...]
+                                 [-b BAUD] [-f FLASH_MS] [-e ERROR_RATE]
+                                 [-a MIN_CHUNK_KB] [--no-buffer]
+
+The emulator stands in for serial.Serial. A device thread echoes cmds,
+receives WR_FW data at the emulated baud rate, verifies its checksum, spends
+flash_time per chunk writing it and replies like the CLI. It answers any
+other cmd with PASS. Without rx_buffer, data arriving while a chunk is
+written to flash is lost, like on firmware that does not support windowed
+transfers.
+"""
+
+import argparse
+import random
+import re
+import threading
+import time
+
+from .port import SerialTransport, clock
+from .pacing import PacingController
+from .sizing import ChunkSizer
+from .window import WindowedSender
+
+
+class EmulatedEve(object):
+    """ In memory stand-in for serial.Serial talking to an emulated EVE CLI """
+
+    WR_FW_RE = re.compile(r"WR_FW\s+(\S+)\s+(\S+)\s+(\d+)")
+
+    def __init__(self, baud=115200, flash_time=0.05, rx_buffer=True, error_rate=0.0):
+        self.byte_time = 10.0 / baud  # Start + 8 data + stop bits
+        self.flash_time = flash_time  # To write one chunk to flash
+        self.rx_buffer = rx_buffer  # Keep receiving while writing to flash
+        self.error_rate = error_rate  # Chance of each KB arriving corrupted
+        self.timeout = 1
+        self.flash = {}  # offset: data written
+        self.chunks = 0  # WR_FW cmds handled
+        self.rx = bytearray()  # Host to device
+        self.tx = bytearray()  # Device to host
+        self.busy = False
+        self.running = True
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    # serial.Serial API used by SerialTransport
+
+    def isOpen(self):
+        return self.running
+
+    def close(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+
+    def flushInput(self):
+        with self.cond:
+            del self.tx[:]
+
+    def flushOutput(self):
+        pass
+
+    def flush(self):
+        pass
+
+    @property
+    def in_waiting(self):
+        return len(self.tx)
+
+    def write(self, data):
+        time.sleep(len(data) * self.byte_time)  # On the wire
+        with self.cond:
+            if self.busy and not self.rx_buffer:
+                return len(data)  # Dropped by the UART
+            self.rx += data
+            self.cond.notify_all()
+        return len(data)
+
+    def read(self, size=1):
+        deadline = clock() + (self.timeout or 0)
+        with self.cond:
+            while not self.tx and clock() < deadline:
+                self.cond.wait(deadline - clock())
+            data = bytes(self.tx[:size])
+            del self.tx[:size]
+        return data
+
+    # Device side
+
+    def _send(self, data):
+        with self.cond:
+            self.tx += data
+            self.cond.notify_all()
+
+    def _recv(self, size=None, terminator=None):
+        """ Block until size bytes or a terminated line was received """
+        with self.cond:
+            while self.running:
+                if terminator is not None:
+                    index = self.rx.find(terminator)
+                    end = index + len(terminator) if index >= 0 else None
+                else:
+                    end = size if len(self.rx) >= size else None
+                if end is not None:
+                    data = bytes(self.rx[:end])
+                    del self.rx[:end]
+                    return data
+                self.cond.wait(0.1)
+        return None
+
+    def _reply(self, module, result):
+        self._send(
+            '\r\n{{\r\n"{}":{{"RESULT":"{}"}}\r\n}}\r\n$'.format(module, result).encode(
+                "charmap"
+            )
+        )
+
+    def _run(self):
+        while self.running:
+            line = self._recv(terminator=b"\n")
+            if line is None:
+                break
+            self._send(line + b"\r\n")  # Echo
+            cmd = line.decode("charmap").strip()
+            words = cmd.split()
+            if not words:
+                continue
+            match = self.WR_FW_RE.search(cmd)
+            if not match:
+                self._reply(words[0], "PASS")
+                continue
+            data = self._recv(int(match.group(3)))
+            if data is None:
+                break
+            chance = 1 - (1 - self.error_rate) ** (len(data) / 1024.0)
+            if random.random() < chance:
+                data = bytearray(data)
+                data[random.randrange(len(data))] ^= 0xFF  # Line noise
+            with self.cond:
+                self.busy = True
+            time.sleep(self.flash_time)
+            self.chunks += 1
+            result = "FAIL"
+            if sum(bytearray(data)) == int(match.group(1), 16):
+                self.flash[int(match.group(2), 16)] = data
+                result = "PASS"
+            with self.cond:
+                self.busy = False
+            self._reply(words[0], result)
+
+
+def emulated_transport(device):
+    """ SerialTransport connected to an emulated EVE """
+    transport = SerialTransport("emulator", None)
+    transport.ser = transport.writer.ser = device
+    transport.pacing = PacingController("emulator")
+    return transport
+
+
+def wr_fw(transport, offset, data):
+    """ Send one WR_FW chunk, True if EVE acknowledged it """
+    transport.send_cmd(
+        "FW_UPDATE WR_FW {:x} {:x} {}".format(sum(bytearray(data)), offset, len(data))
+    )
+    transport.write(data)
+    return '"PASS"' in transport.read_reply(30)[0]
+
+
+def stop_and_wait(transport, chunks, retries=3, sizer=None):
+    """
+    WR_FW transfer the way the tools do it without a window
+    :param sizer: ChunkSizer to send chunks in pieces sized to the link
+    """
+    for offset, _, data in chunks:
+        pos = 0
+        failures = 0
+        while pos < len(data) and failures < retries:
+            size = sizer.size if sizer else len(data)
+            at_min = sizer.at_min if sizer else True
+            start = clock()
+            passed = wr_fw(transport, offset + pos, data[pos : pos + size])
+            if sizer:
+                sizer.record(len(data[pos : pos + size]), passed, clock() - start)
+            if passed:
+                pos += size
+                failures = 0
+            elif at_min:
+                failures += 1
+
+
+def make_chunks(image, chunk_size, offset=0):
+    chunks = []
+    for pos in range(0, len(image), chunk_size):
+        data = image[pos : pos + chunk_size]
+        cmd = "FW_UPDATE WR_FW {:x} {:x} {}".format(
+            sum(bytearray(data)), offset + pos, len(data)
+        )
+        chunks.append((offset + pos, cmd, data))
+    return chunks
+
+
+def run(args, window):
+    device = EmulatedEve(
+        args.baud, args.flash_ms / 1000.0, not args.no_buffer, args.error_rate
+    )
+    transport = emulated_transport(device)
+    image = bytes(bytearray(random.getrandbits(8) for _ in range(args.size * 1024)))
+    chunks = make_chunks(image, args.chunk * 1024)
+    start = clock()
+    fallback = ""
+    if window > 1:
+        sender = WindowedSender(transport, window, timeout=2)
+        chunks = sender.send(chunks)
+        if chunks:
+            fallback = "{} chunks stop and wait ({})".format(len(chunks), sender.error)
+    sizer = None
+    if args.adaptive:
+        sizer = ChunkSizer(args.chunk * 1024, int(args.adaptive * 1024))
+    stop_and_wait(transport, chunks, sizer=sizer)
+    elapsed = clock() - start
+    ok = b"".join(data for _, data in sorted(device.flash.items())) == image
+    device.close()
+    print(
+        "{:>6} {:>9.2f} {:>9.1f} {:>7} {:>4}  {}".format(
+            window,
+            elapsed,
+            len(image) / elapsed / 1024,
+            device.chunks,
+            "OK" if ok else "BAD",
+            fallback,
+        )
+    )
+    if sizer:
+        print("\n".join(sizer.report()))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="WR_FW transfer benchmark on an emulator")
+    ap.add_argument("-s", "--size", type=int, default=64, help="Image size in KB")
+    ap.add_argument("-c", "--chunk", type=int, default=4, help="Chunk size in KB")
+    ap.add_argument(
+        "-w", "--window", type=int, nargs="+", default=[1, 2, 4], help="Windows"
+    )
+    ap.add_argument("-b", "--baud", type=int, default=115200, help="Emulated baud")
+    ap.add_argument(
+        "-f", "--flash-ms", type=float, default=50, help="Flash write time per chunk"
+    )
+    ap.add_argument(
+        "-e", "--error-rate", type=float, default=0.0, help="Chance of a bad KB"
+    )
+    ap.add_argument(
+        "-a",
+        "--adaptive",
+        type=float,
+        metavar="MIN_CHUNK_KB",
+        help="Shrink chunks down to MIN_CHUNK_KB on failures, see transport.sizing",
+    )
+    ap.add_argument(
+        "--no-buffer",
+        action="store_true",
+        help="Emulate firmware that drops data received while writing flash",
+    )
+    args = ap.parse_args()
+
+    print(
+        "{:>6} {:>9} {:>9} {:>7} {:>4}".format(
+            "WINDOW", "TIME[s]", "KB/s", "CHUNKS", "DATA"
+        )
+    )
+    for window in args.window:
+        run(args, window)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+""" Incremental line/response framer for the EVE/AG-55 CLI console """
+
+
+class ResponseFramer(object):
+    """
+    Buffers everything received from the port in one reusable bytearray and
+    splits it into lines and responses without re-reading or re-joining data.
+
+    A response starts with the line "{\\r\\n" and is complete once the lone
+    "$" prompt follows it. Lines received before the start of the response
+    (echo, logs) are dropped from the response, like the readline based
+    implementation did.
+    """
+
+    RESP_START = b"{\r\n"  # First line of a response
+    RESP_END = b"$"  # Prompt printed once the response is complete
+
+    # Compact the buffer once this many consumed bytes sit in front of it
+    COMPACT_SIZE = 64 * 1024
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.pos = 0  # Start of unconsumed data
+        self.scan = 0  # Start of the line the response scan resumes at
+        self.mark = 0  # Start of the response being framed
+        self.start = None  # Start of the response of a pipelined exchange
+
+    def __len__(self):
+        return len(self.buf) - self.pos
+
+    def clear(self):
+        """ Drop everything buffered """
+        del self.buf[:]
+        self.pos = self.scan = self.mark = 0
+        self.start = None
+
+    def feed(self, data):
+        """ Append received data """
+        if self.pos >= self.COMPACT_SIZE and self.pos * 2 >= len(self.buf):
+            del self.buf[: self.pos]  # Drop consumed data, amortised O(1)
+            self.scan -= self.pos
+            self.mark -= self.pos
+            if self.start is not None:
+                self.start -= self.pos
+            self.pos = 0
+        self.buf += data
+
+    def _consume(self, end):
+        """ Return buffered data up to end and mark it consumed """
+        data = bytes(self.buf[self.pos : end])
+        self.pos = end
+        self.scan = self.mark = max(self.scan, end)
+        self.start = None
+        return data
+
+    def take(self, size):
+        """ Return up to size bytes """
+        return self._consume(min(self.pos + size, len(self.buf)))
+
+    def take_all(self):
+        """ Return everything buffered, complete line or not """
+        return self._consume(len(self.buf))
+
+    def pop_until(self, terminator):
+        """ Return data up to and including terminator, None if not received yet """
+        index = self.buf.find(terminator, self.pos)
+        if index < 0:
+            return None
+        return self._consume(index + len(terminator))
+
+    def pop_line(self):
+        """ Return the next complete line, None if not received yet """
+        return self.pop_until(b"\n")
+
+    def pop_response(self):
+        """
+        Frame a response incrementally, resuming where the last call stopped
+        :return: response bytes (without the prompt) once complete, else None
+        """
+        buf = self.buf
+        end = len(buf)
+        scan = max(self.scan, self.pos)
+        mark = max(self.mark, self.pos)
+        while scan < end:
+            if buf[scan : scan + 1] == self.RESP_END and scan + 1 == end:
+                # Lone prompt, the response is complete
+                response = bytes(buf[mark:scan])
+                self.pos = self.scan = self.mark = end
+                return response
+            newline = buf.find(b"\n", scan)
+            if newline < 0:  # Partial line, wait for more data
+                break
+            if buf[scan : newline + 1] == self.RESP_START:
+                mark = scan  # This is the start of response
+            scan = newline + 1
+        self.scan = scan
+        self.mark = mark
+        return None
+
+    def pop_exchange(self):
+        """
+        Frame the next exchange of pipelined cmds. The CLI may already be
+        echoing the next cmd right after the prompt, so the prompt completes
+        the response at the start of a line, not only at the end of the data
+        :return: (lead, response) once complete, else None. lead is what came
+            before the response (echo, logs), response excludes the prompt
+        """
+        buf = self.buf
+        end = len(buf)
+        scan = max(self.scan, self.pos)
+        start = self.start
+        while scan < end:
+            if start is not None and buf[scan : scan + 1] == self.RESP_END:
+                lead = bytes(buf[self.pos : start])
+                response = bytes(buf[start:scan])
+                self._consume(scan + 1)  # Next echo starts after the prompt
+                return lead, response
+            newline = buf.find(b"\n", scan)
+            if newline < 0:  # Partial line, wait for more data
+                break
+            if start is None and buf[scan : newline + 1] == self.RESP_START:
+                start = scan  # This is the start of response
+            scan = newline + 1
+        self.scan = scan
+        self.start = start
+        return None
+
+    def partial_response(self):
+        """ Return what was framed of the pending response and consume it """
+        response = bytes(self.buf[max(self.mark, self.pos) :])
+        self.clear()
+        return response
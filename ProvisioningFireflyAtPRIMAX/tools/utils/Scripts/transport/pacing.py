@@ -0,0 +1,171 @@
+""" Adaptive pacing of data sent to the EVE/AG-55 CLI """
+
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+_save_lock = threading.Lock()
+
+
+class _FileLock(object):
+    """ Exclusive lock of a file between processes, held while in the block """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, "a+b")
+        if fcntl:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+            return self
+        self.file.seek(0)
+        while True:
+            try:
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+                return self
+            except (IOError, OSError):
+                pass  # LK_LOCK gives up after 10 tries a second apart
+
+    def __exit__(self, *exc_info):
+        if not fcntl:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()  # Also releases the flock
+        self.file = None
+
+
+def _replace(temp_path, path):
+    """ Replace path by temp_path in one step where the OS allows """
+    if hasattr(os, "replace"):
+        os.replace(temp_path, path)
+        return
+    try:
+        os.rename(temp_path, path)
+    except OSError:  # Python 2 on Windows, rename does not overwrite
+        os.remove(path)
+        os.rename(temp_path, path)
+
+
+def adapter_id(port):
+    """ Identify the adapter behind a port by its USB hwid, else by port name """
+    try:
+        from serial.tools import list_ports
+
+        for info in list_ports.comports():
+            if info.device == port and "SER=" in (info.hwid or ""):
+                return info.hwid
+    except Exception:
+        pass
+    return str(port)
+
+
+class Pace(object):
+    """
+    Delay that backs off multiplicatively when the receiver fails to keep up
+    and ramps slowly back down while it keeps succeeding
+    """
+
+    BACKOFF = 2.0  # Delay multiplier on failure
+    RAMP = 0.9  # Delay multiplier after RAMP_AFTER consecutive successes
+    RAMP_AFTER = 20  # Consecutive successes before speeding up
+
+    def __init__(self, floor, ceiling, delay=0.0):
+        self.floor = floor  # Smallest non-zero delay, below it no delay at all
+        self.ceiling = ceiling  # Largest delay, the old fixed value
+        self.delay = min(delay, ceiling)
+        self.successes = 0
+        self.failures = 0
+
+    def wait(self):
+        if self.delay:
+            time.sleep(self.delay)
+
+    def record(self, ok):
+        """ Account one transmission and adapt the delay """
+        if ok:
+            self.successes += 1
+            if self.delay and self.successes >= self.RAMP_AFTER:
+                self.successes = 0
+                self.delay *= self.RAMP
+                if self.delay < self.floor:
+                    self.delay = 0.0
+        else:
+            self.successes = 0
+            self.failures += 1
+            self.delay = min(max(self.delay * self.BACKOFF, self.floor), self.ceiling)
+
+
+class PacingController(object):
+    """ Pacing of one port, remembered per adapter between sessions """
+
+    DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".serial_pacing.json")
+
+    # Channel: (floor, ceiling) in seconds
+    CHANNELS = {
+        "byte": (0.0005, 0.005),  # Between bytes of a command
+        "cmd": (0.005, 0.1),  # Before a command
+        "chunk": (0.005, 0.1),  # Before the binary data of a WR_FW chunk
+    }
+
+    def __init__(self, port, path=None):
+        self.key = adapter_id(port)
+        self.path = path or self.DEFAULT_PATH
+        learned = self._read().get(self.key, {})
+        self.channels = {}
+        for name, (floor, ceiling) in self.CHANNELS.items():
+            self.channels[name] = Pace(floor, ceiling, learned.get(name, 0.0))
+
+    def __getitem__(self, name):
+        return self.channels[name]
+
+    def wait(self, name):
+        """ Sleep the current delay of a channel """
+        self.channels[name].wait()
+
+    def record(self, name, ok):
+        """ Report whether a transmission on a channel succeeded """
+        self.channels[name].record(ok)
+
+    def _read(self):
+        try:
+            with open(self.path) as pacing_file:
+                return json.load(pacing_file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def save(self):
+        """
+        Remember the learned delays of this adapter, keeping those other
+        ports and processes saved. The file is replaced in one step, so a
+        reader never sees half of it
+        """
+        temp_path = "{}.{}-{}.tmp".format(
+            self.path, os.getpid(), threading.current_thread().ident
+        )
+        try:
+            # Ports of a rack run, and other processes, share the file
+            with _save_lock, _FileLock(self.path + ".lock"):
+                learned = self._read()
+                learned[self.key] = dict(
+                    (name, round(pace.delay, 6)) for name, pace in self.channels.items()
+                )
+                with open(temp_path, "w") as pacing_file:
+                    json.dump(learned, pacing_file, indent=1, sort_keys=True)
+                _replace(temp_path, self.path)
+        except (IOError, OSError):
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def __str__(self):
+        return ", ".join(
+            "{} {:.1f}ms ({} failures)".format(name, pace.delay * 1000, pace.failures)
+            for name, pace in sorted(self.channels.items())
+        )
@@ -0,0 +1,191 @@
+""" Serial transport to the EVE/AG-55 CLI console """
+
+import serial
+
+from .framer import ResponseFramer
+from .pacing import PacingController
+from .protocol import (
+    cmd_bytes,
+    echo_block_size,
+    echo_error,
+    parse_reply,
+    pop_reply,
+    pop_until,
+)
+from .stats import LatencyStats
+from .writer import ChunkedWriter, clock, to_bytes
+
+
+class SerialTransport(object):
+    """ Owns the serial port, command framing and response reads of one device """
+
+    # TimeOuts in seconds
+    DEFAULT_RD_TIMEOUT = 1  # To wait for the next line of a response
+
+    # Number of cmd bytes sent before reading back their echo
+    ECHO_BLOCK_SIZE = 256  # 1 for old firmware, see echo_lockstep
+
+    def __init__(self, port, baud, timeout=DEFAULT_RD_TIMEOUT, echo_lockstep=False):
+        self.port = port
+        self.baud = baud
+        self.timeout = timeout
+        self.echo_lockstep = echo_lockstep  # Echo cmd byte by byte (old firmware)
+        self.ser = None
+        self.framer = ResponseFramer()
+        self.writer = ChunkedWriter()
+        self.pacing = None  # Learned delays of the port, loaded on open
+        self.stats = LatencyStats()
+        self._pending = None  # [cmd, start time] of the cmd awaiting response
+
+    def __str__(self):
+        return str(self.ser)
+
+    def open(self):
+        """ Open the port and discard anything already received """
+        self.ser = serial.Serial(
+            port=self.port, baudrate=self.baud, timeout=self.timeout
+        )
+        self.writer.ser = self.ser
+        self.pacing = PacingController(self.port)
+        self.flush()
+
+    def close(self):
+        if self.ser:
+            self.ser.close()
+        if self.pacing:
+            self.pacing.save()
+
+    @property
+    def is_open(self):
+        return bool(self.ser) and self.ser.isOpen()
+
+    def flush(self):
+        """ Clear serial port """
+        self.ser.flushInput()
+        self.ser.flushOutput()
+        self.framer.clear()
+
+    def write(self, data, block_size=None, pace=None):
+        """ Send raw data and wait until it is out of the port """
+        return self.writer.write(data, block_size, pace)
+
+    def _fill(self, deadline):
+        """
+        Move everything received into the framer in one read
+        :param deadline: clock() value up to which to wait for data
+        :return: False if nothing arrived before deadline
+        """
+        waiting = self.ser.in_waiting
+        if not waiting:
+            left = deadline - clock()
+            if left <= 0:
+                return False
+            self.ser.timeout = left
+            data = self.ser.read(1)  # Block until data arrives
+            if not data:
+                return False
+            self.framer.feed(data)
+            waiting = self.ser.in_waiting
+        if waiting:
+            self.framer.feed(self.ser.read(waiting))
+        return True
+
+    def read(self, size, timeout):
+        """ Read size bytes, returns less if timeout elapses """
+        deadline = clock() + max(timeout, 0)
+        while len(self.framer) < size and self._fill(deadline):
+            pass
+        return self.framer.take(size)
+
+    def send_cmd(self, cmd):
+        """ Send a cmd and verify its echo, raises EchoError on mismatch """
+        self.pacing.wait("cmd")
+        self.flush()
+        start = clock()
+        data = cmd_bytes(cmd)
+        pace = self.pacing["byte"]
+        block = echo_block_size(self.ECHO_BLOCK_SIZE, self.echo_lockstep, pace.delay)
+        for pos in range(0, len(data), block):  # Send cmd block by block
+            if pos:
+                pace.wait()
+            wdata = data[pos : pos + block]
+            self.ser.write(wdata)
+            rdata = self.read(len(wdata), self.DEFAULT_RD_TIMEOUT)  # Read the echo
+            error = echo_error(pos, wdata, rdata)
+            if error:
+                self.stats.record(cmd, clock() - start, False)
+                self.record_echo(False)
+                raise error
+        self.record_echo(True)
+        self.readline(self.DEFAULT_RD_TIMEOUT)  # Read new line ending the cmd
+        self._pending = [cmd, start]
+
+    def send_nowait(self, cmd):
+        """ Send a cmd without reading back its echo, to pipeline cmds """
+        pace = self.pacing["byte"]
+        self.writer.write(cmd_bytes(cmd), 1 if pace.delay else None, pace.delay)
+
+    def record_echo(self, ok):
+        """ Adapt command pacing to whether the CLI echoed a cmd correctly """
+        self.pacing.record("byte", ok)
+        self.pacing.record("cmd", ok)
+
+    def read_until(self, terminator, timeout):
+        """ Read until terminator is seen, returns what arrived if timeout elapses """
+        terminator = to_bytes(terminator)
+        deadline = clock() + max(timeout, 0)
+        data = pop_until(self.framer, terminator)
+        while data is None:
+            data = pop_until(self.framer, terminator, self._fill(deadline))
+        return data
+
+    def readline(self, timeout):
+        """ Read one line, returns b"" if nothing arrives within timeout """
+        return self.read_until(b"\n", timeout)
+
+    def read_reply(self, timeout):
+        """
+        Read a response
+        :param timeout: Time to wait for the response to start
+        :return: (text of the response, True if terminated by the prompt)
+        """
+        deadline = clock() + max(timeout, 0)
+        reply = pop_reply(self.framer)
+        while reply is None:  # Until the prompt, or no response
+            more = self._fill(deadline)
+            deadline = clock() + self.DEFAULT_RD_TIMEOUT  # Wait for next data
+            reply = pop_reply(self.framer, more)
+        output, complete = reply
+
+        if self._pending:
+            self.stats.record(self._pending[0], clock() - self._pending[1], complete)
+            self._pending = None
+        return output.decode("charmap"), complete
+
+    def read_exchange(self, timeout):
+        """
+        Read the echo and response of the oldest pipelined cmd
+        :return: (text before the response, response text), None on timeout
+        """
+        deadline = clock() + max(timeout, 0)
+        while True:
+            exchange = self.framer.pop_exchange()
+            if exchange is not None:
+                return exchange[0].decode("charmap"), exchange[1].decode("charmap")
+            if not self._fill(deadline):
+                return None
+
+    def drain(self, quiet=DEFAULT_RD_TIMEOUT):
+        """ Discard everything received until nothing arrives for quiet seconds """
+        while self._fill(clock() + quiet):
+            self.framer.clear()
+        self.framer.clear()
+
+    def read_response(self, timeout):
+        """ Read a response, returns a JSON object if it parses else its text """
+        return parse_reply(self.read_reply(timeout)[0])
+
+    def command(self, cmd, timeout):
+        """ Send a cmd and read its response """
+        self.send_cmd(cmd)
+        return self.read_response(timeout)
@@ -0,0 +1,75 @@
+""" Byte-level CLI exchange logic shared by the blocking and asyncio transports """
+
+import json
+
+from .writer import to_bytes
+
+
+class EchoError(Exception):
+    """ CLI did not echo back a command as sent """
+
+    def __init__(self, offset, expected, received):
+        Exception.__init__(self, "echo mismatch at byte {}".format(offset))
+        self.offset = offset
+        self.expected = expected
+        self.received = received
+
+
+def cmd_bytes(cmd):
+    """ Bytes sent for a cmd, with the LF completing it """
+    return to_bytes(cmd + "\n")
+
+
+def echo_block_size(block_size, echo_lockstep, byte_delay):
+    """ Cmd bytes to send before reading back their echo """
+    return 1 if echo_lockstep or byte_delay else block_size
+
+
+def echo_error(pos, sent, echoed):
+    """
+    Check the echo of the cmd bytes sent from pos
+    :return: EchoError locating the first byte that differs, None if echoed
+    """
+    if echoed == sent:
+        return None
+    offset = pos
+    for sent_byte, echoed_byte in zip(sent, echoed):  # Locate failing byte
+        if sent_byte != echoed_byte:
+            break
+        offset += 1
+    return EchoError(offset, sent, echoed)
+
+
+def pop_until(framer, terminator, more=True):
+    """
+    Data up to and including terminator
+    :param more: False once nothing more will arrive (timeout)
+    :return: the data, everything buffered if more is False, else None to wait
+    """
+    data = framer.pop_until(terminator)
+    if data is None and not more:
+        return framer.take_all()
+    return data
+
+
+def pop_reply(framer, more=True):
+    """
+    Response framed so far
+    :param more: False once nothing more will arrive (timeout)
+    :return: (response, True) once the prompt arrived, (what arrived of it,
+        False) if more is False, else None to wait
+    """
+    output = framer.pop_response()
+    if output is not None:
+        return output, True
+    if not more:
+        return framer.partial_response(), False
+    return None
+
+
+def parse_reply(output):
+    """ A response as a JSON object if it parses, else its text """
+    try:
+        return json.loads(output)  # Convert to JSON object
+    except ValueError:
+        return output  # Return Response
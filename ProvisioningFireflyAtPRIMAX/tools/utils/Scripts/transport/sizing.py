@@ -0,0 +1,92 @@
+""" Adaptive chunk size of firmware transfers """
+
+
+class SizeGoodput(object):
+    """ Goodput counter of one chunk size """
+
+    def __init__(self, size):
+        self.size = size
+        self.count = 0
+        self.failures = 0
+        self.bytes = 0  # Bytes acknowledged by EVE
+        self.seconds = 0.0  # Time spent on all chunks, failed ones included
+
+    def record(self, nbytes, ok, seconds):
+        self.count += 1
+        if ok:
+            self.bytes += nbytes
+        else:
+            self.failures += 1
+        self.seconds += seconds
+
+    @property
+    def rate(self):
+        """ Goodput in bytes/s """
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return "{:>8} {:>6} {:>5} {:>9.1f}".format(
+            self.size, self.count, self.failures, self.rate / 1024
+        )
+
+
+class ChunkSizer(object):
+    """
+    Chunk size that halves when a chunk fails (checksum mismatch, timeout)
+    and doubles back after a run of successes, between min_size and
+    max_size. It does not grow to a size whose goodput so far is below that
+    of the current size, so a marginal link settles on its best size.
+    """
+
+    GROW_AFTER = 8  # Consecutive successes before trying a larger size
+    MIN_SAMPLES = 4  # Chunks sent at a size before its goodput is trusted
+
+    HEADER = "{:>8} {:>6} {:>5} {:>9}".format("CHUNK", "COUNT", "FAIL", "KB/s")
+
+    def __init__(self, max_size, min_size=1024):
+        self.max_size = max_size  # Firmware limit, Ex: fw_updateCliBUFF_SIZE
+        self.min_size = min(min_size, max_size)
+        self.size = max_size
+        self.successes = 0
+        self.goodput = {}  # size: SizeGoodput
+
+    @property
+    def at_min(self):
+        return self.size <= self.min_size
+
+    def record(self, nbytes, ok, seconds):
+        """
+        Account one chunk sent at the current size and adapt the size
+        :param nbytes: Bytes in the chunk, less than the size for the last one
+        :param ok: EVE acknowledged the chunk
+        :param seconds: Time from sending the cmd to reading the response
+        """
+        counter = self.goodput.get(self.size)
+        if counter is None:
+            counter = self.goodput[self.size] = SizeGoodput(self.size)
+        counter.record(nbytes, ok, seconds)
+
+        if not ok:
+            self.successes = 0
+            self.size = max(self.size // 2, self.min_size)
+            return
+        self.successes += 1
+        if self.successes >= self.GROW_AFTER and self.size < self.max_size:
+            self.successes = 0
+            larger = min(self.size * 2, self.max_size)
+            if not self._worse(larger, self.size):
+                self.size = larger
+
+    def _worse(self, size, than):
+        """ True if size is known to do worse than size than """
+        counter = self.goodput.get(size)
+        current = self.goodput.get(than)
+        if counter is None or current is None or counter.count < self.MIN_SAMPLES:
+            return False
+        return counter.rate < current.rate
+
+    def report(self):
+        """ Return goodput per chunk size as printable lines """
+        return [self.HEADER] + [
+            str(counter) for _, counter in sorted(self.goodput.items())
+        ]
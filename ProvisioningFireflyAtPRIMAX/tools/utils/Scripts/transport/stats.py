@@ -0,0 +1,72 @@
+""" Per-command latency counters of a serial transport """
+
+
+class CmdLatency(object):
+    """ Latency counter of a single command """
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.failures = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+
+    def record(self, seconds, ok):
+        """ Account one command round trip """
+        self.count += 1
+        if not ok:
+            self.failures += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def __str__(self):
+        return "{:<32} {:>6} {:>5} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.2f}".format(
+            self.name,
+            self.count,
+            self.failures,
+            (self.min or 0.0) * 1000,
+            self.mean * 1000,
+            self.max * 1000,
+            self.total,
+        )
+
+
+class LatencyStats(object):
+    """ Latency counters of all commands sent over one port """
+
+    HEADER = "{:<32} {:>6} {:>5} {:>9} {:>9} {:>9} {:>9}".format(
+        "CMD", "COUNT", "FAIL", "MIN[ms]", "MEAN[ms]", "MAX[ms]", "TOTAL[s]"
+    )
+
+    def __init__(self):
+        self.counters = {}
+
+    @staticmethod
+    def cmd_name(cmd):
+        """ Name a command by its module and command words (Ex: FW_UPDATE WR_FW) """
+        return " ".join(cmd.split()[:2])
+
+    def record(self, cmd, seconds, ok=True):
+        """ Account one round trip of given command """
+        name = self.cmd_name(cmd)
+        counter = self.counters.get(name)
+        if counter is None:
+            counter = self.counters[name] = CmdLatency(name)
+        counter.record(seconds, ok)
+
+    def report(self):
+        """ Return the counters as printable lines, slowest in total first """
+        lines = [self.HEADER]
+        for counter in sorted(
+            self.counters.values(), key=lambda c: c.total, reverse=True
+        ):
+            lines.append(str(counter))
+        return lines
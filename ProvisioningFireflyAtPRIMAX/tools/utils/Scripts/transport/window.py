@@ -0,0 +1,100 @@
+""" Pipelined (windowed) WR_FW transfer """
+
+import json
+import re
+from collections import deque
+
+from .writer import clock
+
+
+class WindowedSender(object):
+    """
+    Sends WR_FW chunks without waiting for the reply to the previous one,
+    keeping up to window chunks in flight while EVE writes to flash.
+
+    The CLI handles cmds in order, so each reply follows the echo of its cmd;
+    replies are matched to chunks by the offset in that echo and only failed
+    chunks are sent again. This needs firmware that keeps receiving the next
+    cmd while it writes a chunk. When the exchange goes out of step (no reply,
+    or an echo matching no chunk in flight) the port is drained and the
+    chunks not acknowledged are handed back to be sent stop and wait.
+    """
+
+    # Offset argument in the echo of a WR_FW cmd (checksum, offset, size)
+    ECHO_RE = re.compile(r"WR_FW\s+\S+\s+(\S+)\s+\d+")
+
+    RESP_KEY = "RESULT"
+    RESP_PASS = "PASS"
+
+    def __init__(self, transport, window, module="FW_UPDATE", timeout=30, retries=3):
+        self.transport = transport
+        self.window = window  # Chunks in flight
+        self.module = module
+        self.timeout = timeout  # To wait for the reply to the oldest chunk
+        self.retries = retries  # Sends of one chunk before handing it back
+        self.error = None  # Why the transfer fell back to stop and wait
+
+    def send(self, chunks, on_ack=None):
+        """
+        Send chunks, retransmitting failed ones
+        :param chunks: (offset, cmd, data) of each chunk
+        :param on_ack: Called with (start, end) of each acknowledged chunk
+        :return: chunks not acknowledged, to be sent stop and wait
+        """
+        pending = deque(chunks)
+        inflight = {}  # offset: (chunk, time sent)
+        tries = dict((chunk[0], 0) for chunk in pending)
+        self.error = None
+        self.transport.flush()
+        while pending or inflight:
+            while pending and len(inflight) < self.window:
+                chunk = pending.popleft()
+                self._send(chunk)
+                inflight[chunk[0]] = (chunk, clock())
+                tries[chunk[0]] += 1
+
+            exchange = self.transport.read_exchange(self.timeout)
+            if exchange is None:
+                self.error = "no reply"
+                break
+            offset = self._offset(exchange[0])
+            if offset not in inflight:
+                self.error = "reply out of step"
+                break
+            chunk, sent = inflight.pop(offset)
+            passed = self._result(exchange[1]) == self.RESP_PASS
+            self.transport.stats.record(chunk[1], clock() - sent, passed)
+            self.transport.pacing.record("chunk", passed)
+            if passed and on_ack:
+                on_ack(offset, offset + len(chunk[2]))
+            if not passed:
+                pending.append(chunk)  # Send it again after the others
+                if tries[offset] >= self.retries:
+                    self.error = "chunk at {:x} failed {} times".format(
+                        offset, tries[offset]
+                    )
+                    break
+        else:
+            return []
+
+        self.transport.drain()  # Let EVE finish what it buffered
+        return sorted([item[0] for item in inflight.values()] + list(pending))
+
+    def _send(self, chunk):
+        self.transport.send_nowait(chunk[1])
+        self.transport.pacing.wait("chunk")
+        self.transport.write(chunk[2])
+
+    def _offset(self, lead):
+        """ Offset of the chunk a reply belongs to, from the echo of its cmd """
+        match = self.ECHO_RE.search(lead)
+        try:
+            return int(match.group(1), 16)
+        except (AttributeError, ValueError):
+            return None
+
+    def _result(self, response):
+        try:
+            return json.loads(response)[self.module][self.RESP_KEY]
+        except (ValueError, KeyError, TypeError):
+            return None
@@ -0,0 +1,59 @@
+""" Chunked binary writer for firmware transfers """
+
+import time
+
+# time.monotonic is not available on Python 2
+clock = getattr(time, "monotonic", time.time)
+
+
+def to_bytes(data):
+    """ Encode str data the way the CLI expects it, pass binary data through """
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return data
+    return data.encode("charmap")
+
+
+class ChunkedWriter(object):
+    """
+    Writes bytes/memoryview data to the port in large sub-blocks, sleeping
+    pace seconds between them if the receiver needs time to keep up
+    """
+
+    BLOCK_SIZE = 4096  # Bytes handed to the port in one write()
+
+    def __init__(self, ser=None, block_size=BLOCK_SIZE, pace=0.0):
+        self.ser = ser
+        self.block_size = block_size
+        self.pace = pace  # Seconds to sleep between sub-blocks
+        self.bytes = 0  # Total bytes written
+        self.seconds = 0.0  # Total time spent writing them
+
+    def write(self, data, block_size=None, pace=None):
+        """
+        Write all data and wait until it is out of the port
+        :param block_size: Override of self.block_size for this write
+        :param pace: Override of self.pace for this write
+        """
+        block_size = block_size or self.block_size
+        pace = self.pace if pace is None else pace
+        view = memoryview(to_bytes(data))
+        size = len(view)
+        start = clock()
+        for pos in range(0, size, block_size):
+            if pos and pace:
+                time.sleep(pace)
+            self.ser.write(view[pos : pos + block_size])
+        self.ser.flush()
+        self.bytes += size
+        self.seconds += clock() - start
+        return size
+
+    @property
+    def rate(self):
+        """ Achieved throughput in bytes/s """
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return "Sent {} bytes in {:.2f}s ({:.1f} KB/s)".format(
+            self.bytes, self.seconds, self.rate / 1024
+        )